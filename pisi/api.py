@@ -12,6 +12,7 @@
 import os
 import fcntl
 import re
+import functools
 #import fetcher
 
 
@@ -20,6 +21,11 @@ __trans = gettext.translation('pisi', fallback=True)
 _ = __trans.gettext
 
 import pisi.fetcher
+import pisi.mirrors
+import pisi.buildcache
+import pisi.httpclient
+import pisi.daemon
+import pisi.hashcache
 import pisi
 import pisi.context as ctx
 import pisi.uri
@@ -33,6 +39,7 @@ import pisi.db.historydb
 import pisi.db.sourcedb
 import pisi.db.componentdb
 import pisi.db.groupdb
+import pisi.db.versiontable
 import pisi.index
 import pisi.config
 import pisi.metadata
@@ -73,8 +80,29 @@ def locked(func):
             pisi.db.update_caches()
             return ret
         finally:
+            pisi.hashcache.save()
             ctx.locked = False
+            ctx.comar_link = None
             lock.close()
+            pisi.daemon.notify()
+
+    return wrapper
+
+
+def query(func):
+    """
+    Decorator for read-only queries which are answered by the pisi daemon
+    when a connection to it is set with set_daemon
+    """
+    @functools.wraps(func)
+    def wrapper(*__args, **__kw):
+        if ctx.daemon:
+            try:
+                return ctx.daemon.call(func.__name__, __args, __kw)
+            except pisi.daemon.ConnectionError as e:
+                ctx.ui.debug(str(e))
+                ctx.daemon = None
+        return func(*__args, **__kw)
 
     return wrapper
 
@@ -115,6 +143,7 @@ def set_comar_updated(updated):
     @param updated: True if COMAR package is updated, else False
     """
     ctx.comar_updated = updated
+    ctx.comar_link = None
 
 
 def set_dbus_sockname(sockname):
@@ -165,6 +194,16 @@ def set_options(options):
     ctx.config.set_options(options)
 
 
+def set_daemon(enable):
+    """
+    Answer the read-only queries with the pisi daemon if it is running
+    @param enable: Flag indicating daemon usage
+    """
+    if ctx.daemon:
+        ctx.daemon.close()
+    ctx.daemon = pisi.daemon.connect() if enable else None
+
+
 def list_needs_restart():
     """
     Return a list of packages that need a service restart.
@@ -207,6 +246,7 @@ def remove_needs_reboot(package):
     pisi.db.installdb.InstallDB().clear_needs_reboot(package)
 
 
+@query
 def list_pending():
     """
     Return a list of configuration pending packages -> list_of_strings
@@ -214,6 +254,7 @@ def list_pending():
     return pisi.db.installdb.InstallDB().list_pending()
 
 
+@query
 def list_installed():
     """
     Return a list of installed packages -> list_of_strings
@@ -221,6 +262,7 @@ def list_installed():
     return pisi.db.installdb.InstallDB().list_installed()
 
 
+@query
 def list_obsoleted(repo=None):
     """
     Return a list of obsoleted packages -> list_of_strings
@@ -230,6 +272,7 @@ def list_obsoleted(repo=None):
     return pisi.db.packagedb.PackageDB().get_obsoletes(repo)
 
 
+@query
 def list_replaces(repo=None):
     """
     Return a dictionary of the replaced packages in the given repository
@@ -244,6 +287,7 @@ def list_replaces(repo=None):
     return pisi.db.packagedb.PackageDB().get_replaces(repo)
 
 
+@query
 def list_available(repo=None):
     """
     Return a list of available packages in the given repository -> list_of_strings
@@ -253,6 +297,7 @@ def list_available(repo=None):
     return pisi.db.packagedb.PackageDB().list_packages(repo)
 
 
+@query
 def list_sources(repo=None):
     """
     Return a list of available source packages in the given repository -> list_of_strings
@@ -262,6 +307,7 @@ def list_sources(repo=None):
     return pisi.db.sourcedb.SourceDB().list_sources(repo)
 
 
+@query
 def list_newest(repo=None, since=None):
     """
     Return a list of newest packages in the given repository -> list_of_strings since
@@ -273,14 +319,16 @@ def list_newest(repo=None, since=None):
     return pisi.db.packagedb.PackageDB().list_newest(repo, since)
 
 
+@query
 def list_upgradable():
     """
     Return a list of packages that are upgraded in the repository -> list_of_strings
     """
     installdb = pisi.db.installdb.InstallDB()
-    is_upgradable = pisi.operations.upgrade.is_upgradable
+    packagedb = pisi.db.packagedb.PackageDB()
 
-    upgradable = [pkg for pkg in installdb.list_installed() if is_upgradable(pkg)]
+    upgradable = pisi.db.versiontable.find_upgrades(installdb.version_table,
+                                                    packagedb.get_version_table())[0]
     # replaced packages can not pass is_upgradable test, so we add them manually
     upgradable.extend(list_replaces())
 
@@ -290,6 +338,37 @@ def list_upgradable():
     return upgradable
 
 
+def list_mirrors(names=None, probe=False):
+    """
+    Return a dictionary of mirror names and lists of their (url, MirrorStat) tuples, best mirror
+    first. MirrorStat is None for mirrors which have not been used yet.
+    @param names: names of the mirrors as used in mirrors:// urls, all mirrors if None
+    @param probe: measure the latency of the http mirrors before ranking them
+    """
+    mirrors = pisi.mirrors.Mirrors()
+    stats = pisi.mirrors.MirrorStats()
+
+    ranking = {}
+    for name in names or sorted(mirrors.mirrors):
+        urls = mirrors.get_mirrors(name)
+        if not urls:
+            raise pisi.Error(_("%s mirrors are not defined.") % name)
+        ranking[name] = urls
+
+    if probe:
+        client = pisi.httpclient.HTTPClient(pisi.fetcher.connection_pool,
+                                            proxies=pisi.fetcher.http_proxies())
+        candidates = [(url, url) for urls in ranking.values()
+                      for url in urls if pisi.mirrors.probeable(url)]
+        pisi.mirrors.probe(client, candidates, stats)
+        stats.save()
+
+    for name, urls in ranking.items():
+        ranking[name] = [(url, stats.get(url)) for url in stats.rank(urls)]
+
+    return ranking
+
+@query
 def list_repos(only_active=True):
     """
     Return a list of the repositories -> list_of_strings
@@ -298,6 +377,7 @@ def list_repos(only_active=True):
     return pisi.db.repodb.RepoDB().list_repos(only_active)
 
 
+@query
 def get_install_order(packages):
     """
     Return a list of packages in the installation order with extra needed
@@ -309,6 +389,7 @@ def get_install_order(packages):
     return order
 
 
+@query
 def get_remove_order(packages):
     """
     Return a list of packages in the remove order -> list_of_strings
@@ -319,6 +400,7 @@ def get_remove_order(packages):
     return order
 
 
+@query
 def get_upgrade_order(packages):
     """
     Return a list of packages in the upgrade order with extra needed
@@ -330,6 +412,7 @@ def get_upgrade_order(packages):
     return order
 
 
+@query
 def get_base_upgrade_order(packages):
     """
     Return a list of packages of the system.base component that needs to be upgraded
@@ -375,6 +458,14 @@ def check(package, config=False):
     """
     return pisi.operations.check.check_package(package, config)
 
+def verify_package(path):
+    """
+    Returns a dictionary like check() for the files in the install archive of a package file
+    @param path: path of the .pisi file to be verified against its files.xml
+    """
+    return pisi.operations.check.check_package_archive(path)
+
+@query
 def search_package(terms, lang=None, repo=None):
     """
     Return a list of packages that contains all the given terms either in its name, summary or
@@ -387,6 +478,7 @@ def search_package(terms, lang=None, repo=None):
     packagedb = pisi.db.packagedb.PackageDB()
     return packagedb.search_package(terms, lang, repo)
 
+@query
 def search_installed(terms, lang=None):
     """
     Return a list of components that contains all the given terms either in its name, summary or
@@ -397,6 +489,7 @@ def search_installed(terms, lang=None):
     installdb = pisi.db.installdb.InstallDB()
     return installdb.search_package(terms, lang)
 
+@query
 def search_source(terms, lang=None, repo=None):
     """
     Return a list of source packages that contains all the given terms either in its name, summary or
@@ -409,6 +502,7 @@ def search_source(terms, lang=None, repo=None):
     sourcedb = pisi.db.sourcedb.SourceDB()
     return sourcedb.search_spec(terms, lang, repo)
 
+@query
 def search_component(terms, lang=None, repo=None):
     """
     Return a list of components that contains all the given terms either in its name, summary or
@@ -421,6 +515,7 @@ def search_component(terms, lang=None, repo=None):
     componentdb = pisi.db.componentdb.ComponentDB()
     return componentdb.search_component(terms, lang, repo)
 
+@query
 def search_file(term):
     """
     Returns a tuple of package and matched files list that matches the files of the installed
@@ -449,7 +544,7 @@ def fetch(packages=[], path=os.path.curdir):
         ctx.ui.info(f"{package.name} package found in {repo} repository")
         uri = pisi.uri.URI(package.packageURI)
         output = os.path.join(path, uri.path())
-        if os.path.exists(output) and package.packageHash == pisi.util.sha1_file(output):
+        if os.path.exists(output) and package.packageHash == pisi.util.sha1_file(output, cache=True):
             ctx.ui.warning(f"{uri.path()} package already fetched")
             continue
         if uri.is_absolute_path():
@@ -506,6 +601,45 @@ def install(packages, reinstall=False, ignore_file_conflicts=False, ignore_packa
     else:
         return pisi.operations.install.install_pkg_names(packages, reinstall)
 
+@locked
+def configure_pending(packages=None):
+    """
+    Run the COMAR post install operations of the packages waiting to be configured
+    @param packages: list of package names, all pending packages if empty -> list_of_strings
+    """
+    import pisi.comariface
+
+    installdb = pisi.db.installdb.InstallDB()
+    pending = [x for x in installdb.list_pending() if not packages or x in packages]
+
+    infos = {}
+    items = []
+    for name in pending:
+        if not installdb.has_package(name):
+            installdb.clear_pending(name)
+            continue
+        package = installdb.get_package(name)
+        pkg_path = installdb.package_path(name)
+        infos[name] = package
+        items.append((name, package.providesComar,
+                      pisi.util.join_path(pkg_path, ctx.const.comar_dir),
+                      pisi.util.join_path(pkg_path, ctx.const.metadata_xml),
+                      pisi.util.join_path(pkg_path, ctx.const.files_xml),
+                      None, None, package.version, package.release))
+
+    # Post install scripts run after the scripts of their dependencies
+    deps = {}
+    for name in infos:
+        for revdep, dependency in installdb.get_rev_deps(name):
+            deps.setdefault(revdep, set()).add(name)
+
+    def notify(event, name):
+        ctx.ui.notify(event, package=infos[name], files=None)
+        if event == pisi.ui.configured:
+            installdb.clear_pending(name)
+
+    pisi.comariface.post_install_packages(items, deps, notify)
+
 @locked
 def takeback(operation):
     """
@@ -592,25 +726,37 @@ def print_version():
     """
     print("Pisi version:", pisi.__version__)
 
+@query
 def list_installed():
     """
     Returns the list of currently installed packages
     """
     return pisi.db.installdb.InstallDB().installed()
 
-def index(dirs=None, output='pisi-index.xml', skip_sources=False, skip_signing=False, compression=0):
-    """Accumulate PiSi XML files in a directory, and write an index."""
+def index(dirs=None, output='pisi-index.xml', skip_sources=False, skip_signing=False, compression=0, full=False):
+    """Accumulate PiSi XML files in a directory, and write an index.
+
+    Unless full is set, metadata of packages unchanged since the previous
+    run is taken from the index cache kept in each directory. Packages are
+    streamed to the (compressed) index files as soon as they are added."""
     index = pisi.index.Index()
     index.distribution = None
     if not dirs:
         dirs = ['.']
-    for repo_dir in dirs:
-        repo_dir = str(repo_dir)
-        ctx.ui.info(_('Building index of PiSi files under %s') % repo_dir)
-        index.index(repo_dir, skip_sources)
 
     sign = None if skip_signing else pisi.file.File.detached
-    index.write(output, sha1sum=True, compress=compression, sign=sign)
+    writer = pisi.index.IndexWriter(output, sha1sum=True, compress=compression, sign=sign)
+    try:
+        for repo_dir in dirs:
+            repo_dir = str(repo_dir)
+            ctx.ui.info(_('Building index of PiSi files under %s') % repo_dir)
+            index.index(repo_dir, skip_sources, full, writer)
+        writer.write_index(index)
+    except:
+        writer.abort()
+        raise
+
+    writer.close()
     ctx.ui.info(_('Index file written'))
 
 @locked
@@ -701,6 +847,8 @@ def rebuild_db():
     ctx.filesdb.destroy()
     ctx.filesdb = pisi.db.filesldb.FilesLDB()
 
+    pisi.db.historydb.HistoryDB().reindex()
+
     # reinitialize everything
     set_userinterface(ui)
     set_options(options)
@@ -718,6 +866,30 @@ def build_until(*args, **kw):
 def build(*args, **kw):
     return pisi.atomicoperations.build(*args, **kw)
 
+def run_daemon(path=None):
+    """
+    Serve the read-only queries over a Unix socket until interrupted
+    @param path: path of the socket, the default one in the lock directory if None
+    """
+    pisi.daemon.serve(path)
+
+def build_cache_info():
+    """
+    Returns a dictionary with the statistics of the build cache: number of builds, total size
+    and size limit in bytes, number of hits and misses
+    """
+    cache = pisi.buildcache.BuildCache()
+    entries = cache.entries()
+    info = {"builds": len(entries),
+            "size": sum(size for used, size, key in entries),
+            "limit": cache.limit}
+    info.update(cache.stats())
+    return info
+
+def clear_build_cache():
+    """Removes all the builds from the build cache"""
+    pisi.buildcache.BuildCache().clear()
+
 @locked
 def clearCache(all=False):
     """Deletes the cached pisi packages to keep the package cache dir within cache limits.
@@ -16,7 +16,9 @@
 import os
 import stat
 import errno
+import multiprocessing
 import shutil
+import struct
 import tarfile
 import zipfile
 
@@ -28,6 +30,8 @@ _ = __trans.gettext
 import pisi
 import pisi.util as util
 import pisi.context as ctx
+import pisi.extractor
+import pisi.xzblock
 
 
 class UnknownArchiveType(Exception):
@@ -120,10 +124,11 @@ class TarFile(tarfile.TarFile):
 
         if fileobj is not None:
             fileobj = _LZMAProxy(fileobj, mode)
+        elif mode == "r":
+            fileobj = lzma.LZMAFile(name, mode)
         else:
-            options = {"format": compressformat,
-                       "level": compresslevel}
-            fileobj = lzma.LZMAFile(name, mode, options=options)
+            fmt = lzma.FORMAT_ALONE if compressformat == "lzma" else lzma.FORMAT_XZ
+            fileobj = lzma.LZMAFile(name, mode, format=fmt, preset=compresslevel)
 
         try:
             t = cls.taropen(name, mode, fileobj, **kwargs)
@@ -133,6 +138,43 @@ class TarFile(tarfile.TarFile):
         return t
 
 
+    @classmethod
+    def xzblockopen(cls,
+                    name=None,
+                    mode="r",
+                    fileobj=None,
+                    compresslevel=6,
+                    threads=1,
+                    **kwargs):
+        """Open xz compressed tar archive name for reading or writing.
+           Archives are written as multi-block xz. Blocks are decompressed
+           in parallel if the archive is read from a file and has more
+           than one block, single block archives and other file objects
+           are read as a plain xz stream.
+        """
+
+        if len(mode) > 1 or mode not in "rw":
+            raise ValueError("mode must be 'r' or 'w'.")
+
+        if mode == "r":
+            if fileobj is None:
+                fileobj = pisi.xzblock.block_reader(name)
+            if not isinstance(fileobj, pisi.xzblock.BlockReader):
+                return cls.lzmaopen(name, mode, fileobj, **kwargs)
+        else:
+            fileobj = pisi.xzblock.BlockWriter(fileobj or open(name, "wb"),
+                                               preset=compresslevel,
+                                               jobs=threads)
+
+        try:
+            t = cls.taropen(name, mode, fileobj, **kwargs)
+        except IOError:
+            fileobj.close()
+            raise tarfile.ReadError("not a xz file")
+        t._extfileobj = False
+        return t
+
+
 class ArchiveBase:
     """Base class for Archive classes."""
     def __init__(self, file_path, atype):
@@ -246,19 +288,23 @@ class ArchiveTar(ArchiveBase):
     def __init__(self, file_path=None, arch_type="tar",
                  no_same_permissions=True,
                  no_same_owner=True,
-                 fileobj=None):
+                 fileobj=None,
+                 compresslevel=None,
+                 threads=None):
         super(ArchiveTar, self).__init__(file_path, arch_type)
         self.tar = None
         self.no_same_permissions = no_same_permissions
         self.no_same_owner = no_same_owner
         self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.threads = threads
 
     def unpack(self, target_dir, clean_dir=False):
         """Unpack tar archive to a given target directory(target_dir)."""
         super(ArchiveTar, self).unpack(target_dir, clean_dir)
         self.unpack_dir(target_dir)
 
-    def unpack_dir(self, target_dir, callback=None):
+    def open_tar(self):
         rmode = ""
         self.tar = None
         if self.type == 'tar':
@@ -267,174 +313,80 @@ class ArchiveTar(ArchiveBase):
             rmode = 'r:gz'
         elif self.type == 'tarbz2':
             rmode = 'r:bz2'
-        elif self.type in ('tarlzma', 'tarxz'):
-            self.tar = tarfile.lzmaopen(self.file_path, fileobj=self.fileobj)
+        elif self.type == 'tarlzma':
+            self.tar = TarFile.lzmaopen(self.file_path, fileobj=self.fileobj)
+        elif self.type == 'tarxz':
+            self.tar = TarFile.xzblockopen(self.file_path, fileobj=self.fileobj)
         else:
             raise UnknownArchiveType()
 
         if self.tar is None:
             self.tar = tarfile.open(self.file_path, rmode, fileobj=self.fileobj)
 
+    def unpack_dir(self, target_dir, callback=None, dirs=None):
+        """Unpack the archive into target_dir with the extraction engine.
+
+        dirs is an optional list of directories (relative to target_dir)
+        which are created before the archive is read. Returns the
+        TarExtractor used, for its statistics."""
+
+        self.open_tar()
+
         oldwd = None
         try:
             # Don't fail if CWD doesn't exist (#6748)
             oldwd = os.getcwd()
         except OSError:
             pass
+        # The fallback path works on member names relative to target_dir
         os.chdir(target_dir)
 
         uid = os.getuid()
         gid = os.getgid()
 
-        for tarinfo in self.tar:
-            if callback:
-                callback(tarinfo, extracted=False)
-
-            startservices = []
-            if tarinfo.issym() and \
-                    os.path.isdir(tarinfo.name) and \
-                    not os.path.islink(tarinfo.name):
-                # Changing a directory with a symlink. tarfile module
-                # cannot handle this case.
-
-                if os.path.isdir(tarinfo.linkname):
-                    # Symlink target is a directory. Move old directory's
-                    # content to this directory.
-                    for filename in os.listdir(tarinfo.name):
-                        old_path = util.join_path(tarinfo.name, filename)
-                        new_path = util.join_path(tarinfo.linkname, filename)
-
-                        if os.path.lexists(new_path):
-                            if not os.path.isdir(new_path):
-                                # A file with the same name exists in the
-                                # target. Remove the one in the old directory.
-                                os.remove(old_path)
-                            continue
-
-                        # try as up to this time
-                        try:
-                            os.renames(old_path, new_path)
-                        except OSError as e:
-                            # something gone wrong? [Errno 18] Invalid cross-device link?
-                            # try in other way
-                            if e.errno == errno.EXDEV:
-                                if tarinfo.linkname.startswith(".."):
-                                    new_path = util.join_path(os.path.normpath(os.path.join(os.path.dirname(tarinfo.name), tarinfo.linkname)), filename)
-                                if not old_path.startswith("/"):
-                                    old_path = "/" + old_path
-                                if not new_path.startswith("/"):
-                                    new_path = "/" + new_path
-                                print("Moving:", old_path, " -> ", new_path)
-                                os.system(f"mv -f {old_path} {new_path}")
-                            else:
-                                raise
-                    try:
-                        os.rmdir(tarinfo.name)
-                    except OSError as e:
-                        # hmmm, not empty dir? try rename it adding .old extension.
-                        if e.errno == errno.ENOTEMPTY:
-                            # if directory with dbus/pid file was moved we have to restart dbus
-                            for (path, dirs, files) in os.walk(tarinfo.name):
-                                if path.endswith("dbus") and "pid" in files:
-                                    startservices.append("dbus")
-                                    for service in ("NetworkManager", "connman", "wicd"):
-                                        if os.path.isfile(f"/etc/mudur/services/enabled/{service}"):
-                                            startservices.append(service)
-                                            os.system(f"service {service} stop")
-                                    os.system("service dbus stop")
-                                    break
-                            os.system(f"mv -f {tarinfo.name} {tarinfo.name}.old")
-                        else:
-                            raise
-
-                elif not os.path.lexists(tarinfo.linkname):
-                    # Symlink target does not exist. Assume the old
-                    # directory is moved to another place in package.
-                    os.renames(tarinfo.name, tarinfo.linkname)
-
-                else:
-                    # This should not happen. Probably a packaging error.
-                    # Try to rename directory
-                    try:
-                        os.rename(tarinfo.name, f"{tarinfo.name}.renamed-by-pisi")
-                    except:
-                        # If fails, try to remove it
-                        shutil.rmtree(tarinfo.name)
-
+        extractor = pisi.extractor.TarExtractor(
+                target_dir,
+                same_permissions=not self.no_same_permissions,
+                same_owner=not self.no_same_owner,
+                umask=ctx.const.umask,
+                fallback=lambda tarinfo: self.unpack_member(tarinfo, uid, gid))
+        try:
+            if dirs:
+                extractor.make_dirs(dirs)
+            extractor.extract_all(self.tar, callback)
+        finally:
             try:
-                self.tar.extract(tarinfo)
-                for service in startservices: 
-                    os.system(f"service {service} start")
-            except OSError as e:
-                # Handle the case where an upper directory cannot
-                # be created because of a conflict with an existing
-                # regular file or symlink. In this case, remove
-                # the old file and retry extracting.
-
-                if e.errno != errno.EEXIST:
-                    raise
+                if oldwd:
+                    os.chdir(oldwd)
+            # Bug #6748
+            except OSError:
+                pass
+            self.close()
 
-                # For the path "a/b/c", upper_dirs will be ["a", "a/b"].
-                upper_dirs = []
-                head, tail = os.path.split(tarinfo.name)
+        return extractor
 
-                while head and tail:
-                    upper_dirs.insert(0, head)
-                    head, tail = os.path.split(head)
+    def unpack_dir_by_member(self, target_dir, callback=None):
+        """Unpack the archive into target_dir with one tarfile.extract call
+        per member. This is the slower, pre-extraction-engine path."""
 
-                for path in upper_dirs:
-                    if not os.path.lexists(path):
-                        break
+        self.open_tar()
 
-                    if not os.path.isdir(path):
-                        # A file with the same name exists.
-                        # Remove the existing file.
-                        os.remove(path)
-                        break
-                else:
-                    # No conflicts detected! This is probably not the case
-                    # mentioned here. Raise the same exception.
-                    raise
+        oldwd = None
+        try:
+            # Don't fail if CWD doesn't exist (#6748)
+            oldwd = os.getcwd()
+        except OSError:
+            pass
+        os.chdir(target_dir)
 
-                # Try to extract again.
-                self.tar.extract(tarinfo)
+        uid = os.getuid()
+        gid = os.getgid()
 
-            except IOError as e:
-                # Handle the case where new path is file, but old path is directory
-                # due to not possible touch file c in /a/b if directory /a/b/c exists.
-                if not e.errno == errno.EISDIR:
-                    path = tarinfo.name
-                    found = False
-                    while path:
-                        if os.path.isfile(path):
-                            os.unlink(path)
-                            found = True
-                            break
-                        else:
-                            path = "/".join(path.split("/")[:-1])
-                    if not found: 
-                        raise
-                    # Try to extract again.
-                    self.tar.extract(tarinfo)
-                else:
-                    shutil.rmtree(tarinfo.name)
-                    # Try to extract again.
-                    self.tar.extract(tarinfo)
-
-            # tarfile.extract does not honor umask. It must be honored
-            # explicitly. See --no-same-permissions option of tar(1),
-            # which is the default behaviour.
-            #
-            # Note: This is no good while installing a pisi package.
-            # That's why this is optional.
-            if self.no_same_permissions and not os.path.islink(tarinfo.name):
-                os.chmod(tarinfo.name, tarinfo.mode & ~ctx.const.umask)
-
-            if self.no_same_owner:
-                if not os.path.islink(tarinfo.name):
-                    os.chown(tarinfo.name, uid, gid)
-                else:
-                    os.lchown(tarinfo.name, uid, gid)
+        for tarinfo in self.tar:
+            if callback:
+                callback(tarinfo, extracted=False)
+
+            self.unpack_member(tarinfo, uid, gid)
 
             if callback:
                 callback(tarinfo, extracted=True)
@@ -447,18 +399,193 @@ class ArchiveTar(ArchiveBase):
             pass
         self.close()
 
+    def unpack_member(self, tarinfo, uid, gid):
+        """Extract a single member relative to the current directory,
+        handling path type changes between the old and new files"""
+
+        startservices = []
+        if tarinfo.issym() and \
+                os.path.isdir(tarinfo.name) and \
+                not os.path.islink(tarinfo.name):
+            # Changing a directory with a symlink. tarfile module
+            # cannot handle this case.
+
+            if os.path.isdir(tarinfo.linkname):
+                # Symlink target is a directory. Move old directory's
+                # content to this directory.
+                for filename in os.listdir(tarinfo.name):
+                    old_path = util.join_path(tarinfo.name, filename)
+                    new_path = util.join_path(tarinfo.linkname, filename)
+
+                    if os.path.lexists(new_path):
+                        if not os.path.isdir(new_path):
+                            # A file with the same name exists in the
+                            # target. Remove the one in the old directory.
+                            os.remove(old_path)
+                        continue
+
+                    # try as up to this time
+                    try:
+                        os.renames(old_path, new_path)
+                    except OSError as e:
+                        # something gone wrong? [Errno 18] Invalid cross-device link?
+                        # try in other way
+                        if e.errno == errno.EXDEV:
+                            if tarinfo.linkname.startswith(".."):
+                                new_path = util.join_path(os.path.normpath(os.path.join(os.path.dirname(tarinfo.name), tarinfo.linkname)), filename)
+                            if not old_path.startswith("/"):
+                                old_path = "/" + old_path
+                            if not new_path.startswith("/"):
+                                new_path = "/" + new_path
+                            print("Moving:", old_path, " -> ", new_path)
+                            os.system(f"mv -f {old_path} {new_path}")
+                        else:
+                            raise
+                try:
+                    os.rmdir(tarinfo.name)
+                except OSError as e:
+                    # hmmm, not empty dir? try rename it adding .old extension.
+                    if e.errno == errno.ENOTEMPTY:
+                        # if directory with dbus/pid file was moved we have to restart dbus
+                        for (path, dirs, files) in os.walk(tarinfo.name):
+                            if path.endswith("dbus") and "pid" in files:
+                                startservices.append("dbus")
+                                for service in ("NetworkManager", "connman", "wicd"):
+                                    if os.path.isfile(f"/etc/mudur/services/enabled/{service}"):
+                                        startservices.append(service)
+                                        os.system(f"service {service} stop")
+                                os.system("service dbus stop")
+                                break
+                        os.system(f"mv -f {tarinfo.name} {tarinfo.name}.old")
+                    else:
+                        raise
+
+            elif not os.path.lexists(tarinfo.linkname):
+                # Symlink target does not exist. Assume the old
+                # directory is moved to another place in package.
+                os.renames(tarinfo.name, tarinfo.linkname)
+
+            else:
+                # This should not happen. Probably a packaging error.
+                # Try to rename directory
+                try:
+                    os.rename(tarinfo.name, f"{tarinfo.name}.renamed-by-pisi")
+                except:
+                    # If fails, try to remove it
+                    shutil.rmtree(tarinfo.name)
+
+        try:
+            self.tar.extract(tarinfo)
+            for service in startservices: 
+                os.system(f"service {service} start")
+        except OSError as e:
+            # Handle the case where an upper directory cannot
+            # be created because of a conflict with an existing
+            # regular file or symlink. In this case, remove
+            # the old file and retry extracting.
+
+            if e.errno != errno.EEXIST:
+                raise
+
+            # For the path "a/b/c", upper_dirs will be ["a", "a/b"].
+            upper_dirs = []
+            head, tail = os.path.split(tarinfo.name)
+
+            while head and tail:
+                upper_dirs.insert(0, head)
+                head, tail = os.path.split(head)
+
+            for path in upper_dirs:
+                if not os.path.lexists(path):
+                    break
+
+                if not os.path.isdir(path):
+                    # A file with the same name exists.
+                    # Remove the existing file.
+                    os.remove(path)
+                    break
+            else:
+                # No conflicts detected! This is probably not the case
+                # mentioned here. Raise the same exception.
+                raise
+
+            # Try to extract again.
+            self.tar.extract(tarinfo)
+
+        except IOError as e:
+            # Handle the case where new path is file, but old path is directory
+            # due to not possible touch file c in /a/b if directory /a/b/c exists.
+            if not e.errno == errno.EISDIR:
+                path = tarinfo.name
+                found = False
+                while path:
+                    if os.path.isfile(path):
+                        os.unlink(path)
+                        found = True
+                        break
+                    else:
+                        path = "/".join(path.split("/")[:-1])
+                if not found: 
+                    raise
+                # Try to extract again.
+                self.tar.extract(tarinfo)
+            else:
+                shutil.rmtree(tarinfo.name)
+                # Try to extract again.
+                self.tar.extract(tarinfo)
+
+        # tarfile.extract does not honor umask. It must be honored
+        # explicitly. See --no-same-permissions option of tar(1),
+        # which is the default behaviour.
+        #
+        # Note: This is no good while installing a pisi package.
+        # That's why this is optional.
+        if self.no_same_permissions and not os.path.islink(tarinfo.name):
+            os.chmod(tarinfo.name, tarinfo.mode & ~ctx.const.umask)
+
+        if self.no_same_owner:
+            if not os.path.islink(tarinfo.name):
+                os.chown(tarinfo.name, uid, gid)
+            else:
+                os.lchown(tarinfo.name, uid, gid)
+
+    def get_preset(self):
+        level = self.compresslevel
+        if level is None:
+            level = ctx.config.values.build.compressionlevel
+        return pisi.xzblock.parse_preset(level)
+
+    def get_threads(self):
+        threads = self.threads or int(ctx.config.values.build.compressionthreads or 0)
+        threads = threads or multiprocessing.cpu_count()
+        # An xz encoder needs up to 674 MiB at preset 9
+        return min(threads, pisi.xzblock.max_jobs(self.get_preset()))
+
     def add_to_archive(self, file_name, arc_name=None):
         """Add file or directory path to the tar archive"""
         if not self.tar:
+            wmode = None
             if self.type == 'tar':
                 wmode = 'w:'
             elif self.type == 'targz':
                 wmode = 'w:gz'
             elif self.type == 'tarbz2':
                 wmode = 'w:bz2'
+            elif self.type == 'tarlzma':
+                self.tar = TarFile.lzmaopen(self.file_path, "w",
+                                            compressformat="lzma",
+                                            compresslevel=self.get_preset())
+            elif self.type == 'tarxz':
+                # Multi-block xz is compressed in parallel and read by
+                # any xz decoder
+                self.tar = TarFile.xzblockopen(self.file_path, "w",
+                                               compresslevel=self.get_preset(),
+                                               threads=self.get_threads())
             else:
                 raise UnknownArchiveType()
-            self.tar = tarfile.open(self.file_path, wmode)
+
+            if wmode:
+                self.tar = tarfile.open(self.file_path, wmode)
 
         # Add file or directory to the archive
         self.tar.add(file_name, arcname=arc_name)
@@ -501,6 +628,37 @@ class ArchiveZip(ArchiveBase):
             if callback:
                 callback(zipinfo, extracted=True)
 
+    def get_zip(self):
+        if self.zip is None:
+            self.zip = zipfile.ZipFile(self.file_path, 'r')
+        return self.zip
+
+    def has_file(self, path):
+        """Returns true if the archive has a member with the given path"""
+        return path in self.get_zip().namelist()
+
+    def read_file(self, path):
+        return self.get_zip().read(path)
+
+    def open(self, path):
+        return self.get_zip().open(path)
+
+    def stored_member(self, path):
+        """Return the offset and size of the data of a member which is
+        stored without compression, or None"""
+        zipinfo = self.get_zip().getinfo(path)
+        if zipinfo.compress_type != zipfile.ZIP_STORED:
+            return None
+
+        # The local header may have another extra field than the
+        # central directory entry
+        with open(self.file_path, "rb") as f:
+            f.seek(zipinfo.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+
+        offset = zipinfo.header_offset + 30 + name_length + extra_length
+        return offset, zipinfo.file_size
+
     def add_to_archive(self, file_name, arc_name=None):
         """Add file or directory path to the zip archive"""
         if self.zip is None:
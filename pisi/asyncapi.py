@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""asyncio facade of pisi.api.
+
+The blocking API calls run one at a time in a worker thread, the pisi
+databases and the context are not thread safe. Packages are downloaded
+concurrently into the package cache before they are installed. The
+messages and notifications of the operations are posted as Event objects
+instead of being sent to a UI object:
+
+    api = pisi.asyncapi.AsyncAPI()
+
+    async def show_events():
+        async for event in api.events():
+            print(event.kind, event.data)
+
+    await api.install(["bash"])
+
+A cancelled operation stops at the next progress report or package
+notification, before the next package is installed or removed."""
+
+import os
+import asyncio
+import threading
+import concurrent.futures
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+import pisi.ui
+import pisi.api
+import pisi.uri
+import pisi.util as util
+import pisi.fetcher
+import pisi.context as ctx
+import pisi.db
+
+class Cancelled(pisi.Error):
+    pass
+
+NOTIFICATIONS = {
+    pisi.ui.installed: "installed",
+    pisi.ui.upgraded: "upgraded",
+    pisi.ui.removed: "removed",
+    pisi.ui.installing: "installing",
+    pisi.ui.removing: "removing",
+    pisi.ui.configuring: "configuring",
+    pisi.ui.configured: "configured",
+    pisi.ui.extracting: "extracting",
+    pisi.ui.downloading: "downloading",
+    pisi.ui.packagestogo: "packagestogo",
+    pisi.ui.updatingrepo: "updatingrepo",
+    pisi.ui.cached: "cached",
+    pisi.ui.desktopfile: "desktopfile",
+}
+
+# Notifications sent before a package is changed
+CANCEL_POINTS = (pisi.ui.installing, pisi.ui.removing, pisi.ui.downloading)
+
+# Queries run in the worker thread without changing the system
+QUERIES = ("list_installed", "list_available", "list_upgradable", "list_pending",
+           "list_sources", "list_repos", "list_newest", "list_obsoleted",
+           "search_package", "search_installed", "search_source", "search_component",
+           "search_file", "get_install_order", "get_remove_order", "get_upgrade_order")
+
+class Event(object):
+    """A message, notification or progress report of an operation"""
+
+    def __init__(self, kind, **data):
+        self.kind = kind
+        self.data = data
+
+    def __repr__(self):
+        return "Event(%s, %r)" % (self.kind, self.data)
+
+def event_value(value):
+    # Package and file objects do not cross to the event loop
+    if hasattr(value, "name") and not isinstance(value, (str, bytes)):
+        return str(value.name)
+    return value
+
+class EventUI(pisi.ui.UI):
+    """UI posting everything as events and raising Cancelled at the
+    cancellation points after cancel() is called"""
+
+    def __init__(self, post, debuggy=False, verbose=False):
+        pisi.ui.UI.__init__(self, debuggy, verbose)
+        self.post = post
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise Cancelled(_("Operation cancelled"))
+
+    def info(self, msg, verbose=False, noln=False):
+        if verbose and not self.show_verbose:
+            return
+        self.post(Event("info", message=msg))
+
+    def warning(self, msg):
+        self.warnings += 1
+        self.post(Event("warning", message=msg))
+
+    def error(self, msg):
+        self.errors += 1
+        self.post(Event("error", message=msg))
+
+    def action(self, msg):
+        self.post(Event("action", message=msg))
+
+    def status(self, msg=None):
+        self.post(Event("status", message=msg))
+
+    def display_progress(self, **ka):
+        self.check_cancelled()
+        self.post(Event("progress", **ka))
+
+    def notify(self, event, **keywords):
+        if event in CANCEL_POINTS:
+            self.check_cancelled()
+        data = dict((key, event_value(value)) for key, value in keywords.items()
+                    if key != "files")
+        self.post(Event(NOTIFICATIONS.get(event, str(event)), **data))
+
+def package_downloads(names, dest_dir, for_install=False):
+    """Return (url, hash) tuples of the packages of names which are not
+    in dest_dir yet. If for_install is set, packages which will be
+    upgraded with a delta and packages which are not remote files are
+    left to the installer."""
+    packagedb = pisi.db.packagedb.PackageDB()
+    installdb = pisi.db.installdb.InstallDB()
+    repodb = pisi.db.repodb.RepoDB()
+    ignore_delta = ctx.config.values.general.ignore_delta
+
+    downloads = []
+    for name in names:
+        package, repo = packagedb.get_package_repo(name)
+        if for_install and not ignore_delta and installdb.has_package(name):
+            (version, release, build, distro, distro_release) = \
+                    installdb.get_version_and_distro_release(name)
+            if distro == package.distribution and \
+                    distro_release == package.distributionRelease and \
+                    package.get_delta(release):
+                continue
+
+        uri = pisi.uri.URI(package.packageURI)
+        if uri.is_absolute_path():
+            url = str(uri)
+        else:
+            url = os.path.join(os.path.dirname(repodb.get_repo_url(repo)), str(uri.path()))
+
+        if for_install and not pisi.uri.URI(url).is_remote_file():
+            continue
+
+        path = os.path.join(dest_dir, pisi.uri.URI(url).filename())
+        if os.path.exists(path) and util.sha1_file(path, cache=True) == package.packageHash:
+            continue
+        downloads.append((url, package.packageHash))
+    return downloads
+
+class AsyncAPI(object):
+    """Awaitable versions of the pisi.api functions"""
+
+    def __init__(self, downloads=4, debug=False, verbose=False):
+        self.worker = concurrent.futures.ThreadPoolExecutor(1)
+        self.downloader = concurrent.futures.ThreadPoolExecutor(downloads)
+        self.loop = None
+        self.listeners = []
+        self.ui = EventUI(self.post, debug, verbose)
+        pisi.api.set_userinterface(self.ui)
+
+    def post(self, event):
+        """Called from the worker threads"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.dispatch, event)
+
+    def dispatch(self, event):
+        for queue in self.listeners:
+            queue.put_nowait(event)
+
+    async def events(self):
+        """Yield the events of the operations"""
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        self.listeners.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.listeners.remove(queue)
+
+    async def run(self, executor, func, *args, **kw):
+        """Run func in executor. If the awaiting task is cancelled, the
+        operation is stopped at its next cancellation point."""
+        self.loop = asyncio.get_running_loop()
+        future = self.loop.run_in_executor(executor, lambda: func(*args, **kw))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.ui.cancel()
+            try:
+                await future
+            except Exception:
+                pass
+            raise
+
+    async def call(self, func, *args, **kw):
+        self.ui.cancelled.clear()
+        return await self.run(self.worker, func, *args, **kw)
+
+    async def download(self, downloads, dest_dir):
+        """Fetch the (url, hash) tuples of downloads to dest_dir concurrently.
+        A downloaded file not matching its hash is removed."""
+        def fetch(url, pkg_hash):
+            self.ui.check_cancelled()
+            pisi.fetcher.fetch_url(url, dest_dir, ctx.ui.Progress)
+            path = os.path.join(dest_dir, pisi.uri.URI(url).filename())
+            if util.sha1_file(path, cache=True) != pkg_hash:
+                os.unlink(path)
+                raise pisi.Error(_("Download Error: Package does not match the repository package."))
+            self.ui.post(Event("fetched", url=url))
+
+        jobs = [self.run(self.downloader, fetch, url, pkg_hash)
+                for url, pkg_hash in downloads]
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def prefetch(self, names):
+        dest_dir = ctx.config.cached_packages_dir()
+        downloads = await self.call(package_downloads, names, dest_dir, True)
+        if downloads:
+            await self.download(downloads, dest_dir)
+
+    async def update_repos(self, repos=None, force=False):
+        """
+        Update the given repositories, all active repositories if None
+        @param repos: list of repository names -> list_of_strings
+        @param force: update the repositories even if they are up to date
+        """
+        if repos is None:
+            repos = await self.call(pisi.api.list_repos)
+        return await self.call(pisi.api.update_repos, repos, force)
+
+    async def fetch(self, packages, path=os.path.curdir):
+        """
+        Download the given packages to path concurrently
+        @param packages: list of package names -> list_of_strings
+        """
+        downloads = await self.call(package_downloads, packages, path)
+        await self.download(downloads, path)
+
+    async def install(self, packages, reinstall=False, ignore_file_conflicts=False,
+                      ignore_package_conflicts=False):
+        """
+        Download the given packages and their dependencies concurrently
+        and install them
+        @param packages: list of package names or package files -> list_of_strings
+        """
+        names = [name for name in packages if not name.endswith(ctx.const.package_suffix)]
+        if names:
+            await self.prefetch(await self.call(pisi.api.get_install_order, names))
+        return await self.call(pisi.api.install, packages, reinstall,
+                               ignore_file_conflicts, ignore_package_conflicts)
+
+    async def upgrade(self, packages=[], repo=None):
+        """
+        Download the upgrades of the given packages, all upgradable
+        packages if empty, concurrently and upgrade them
+        @param packages: list of package names -> list_of_strings
+        """
+        names = packages or await self.call(pisi.api.list_upgradable)
+        if names:
+            await self.prefetch(await self.call(pisi.api.get_upgrade_order, names))
+        return await self.call(pisi.api.upgrade, packages, repo)
+
+    def __getattr__(self, name):
+        if name not in QUERIES:
+            raise AttributeError(name)
+
+        func = getattr(pisi.api, name)
+
+        async def query(*args, **kw):
+            return await self.call(func, *args, **kw)
+        query.__name__ = name
+        query.__doc__ = func.__doc__
+        return query
+
+    def close(self):
+        self.worker.shutdown()
+        self.downloader.shutdown()
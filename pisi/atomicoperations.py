@@ -17,6 +17,7 @@ _ = __trans.gettext  # Python 3'te ugettext yerine gettext kullanılmalıdır
 
 import os
 import shutil
+import concurrent.futures
 import zipfile
 
 import pisi
@@ -28,6 +29,7 @@ import pisi.uri
 import pisi.ui
 import pisi.version
 import pisi.operations.delta
+import pisi.streampackage
 import pisi.db
 
 class Error(pisi.Error):
@@ -67,7 +69,7 @@ class Install(AtomicOperation):
     "Install class, provides install routines for pisi packages"
 
     @staticmethod
-    def from_name(name, ignore_dep=None):
+    def from_name(name, ignore_dep=None, stream=False):
         packagedb = pisi.db.packagedb.PackageDB()
         # download package and return an installer object
         # find package in repository
@@ -90,41 +92,60 @@ class Install(AtomicOperation):
 
             ignore_delta = ctx.config.values.general.ignore_delta
 
-            # If delta exists then use the delta uri.
-            if delta and not ignore_delta:
-                pkg_uri = delta.packageURI
-                pkg_hash = delta.packageHash
-            else:
-                pkg_uri = pkg.packageURI
-                pkg_hash = pkg.packageHash
+            def get_install_op(pkg_uri, pkg_hash, stream=False):
+                uri = pisi.uri.URI(pkg_uri)
+                if uri.is_absolute_path():
+                    pkg_path = str(pkg_uri)
+                else:
+                    pkg_path = os.path.join(os.path.dirname(repo.indexuri.get_uri()), str(uri.path()))
 
-            uri = pisi.uri.URI(pkg_uri)
-            if uri.is_absolute_path():
-                pkg_path = str(pkg_uri)
-            else:
-                pkg_path = os.path.join(os.path.dirname(repo.indexuri.get_uri()), str(uri.path()))
+                ctx.ui.info(_("Package URI: %s") % pkg_path, verbose=True)
+
+                # Bug 4113
+                cached_file = pisi.package.Package.is_cached(pkg_path)
+                if cached_file and util.sha1_file(cached_file, cache=True) != pkg_hash:
+                    os.unlink(cached_file)
+                    cached_file = None
+
+                if stream and not cached_file and pisi.uri.URI(pkg_path).is_remote_file():
+                    # Install while downloading, the hash is checked
+                    # before the files are moved into place
+                    try:
+                        package = pisi.streampackage.StreamPackage(pkg_path, pkg_hash)
+                    except pisi.streampackage.NotStreamable as e:
+                        ctx.ui.debug(_("Cannot stream %s: %s") % (pkg_path, e))
+                    else:
+                        return Install(pkg_path, ignore_dep, package=package)
+
+                install_op = Install(pkg_path, ignore_dep)
+
+                # Bug 4113
+                if not cached_file:
+                    downloaded_file = install_op.package.filepath
+                    if pisi.util.sha1_file(downloaded_file, cache=True) != pkg_hash:
+                        raise pisi.Error(_("Download Error: Package does not match the repository package."))
 
-            ctx.ui.info(_("Package URI: %s") % pkg_path, verbose=True)
+                return install_op
 
-            # Bug 4113
-            cached_file = pisi.package.Package.is_cached(pkg_path)
-            if cached_file and util.sha1_file(cached_file) != pkg_hash:
-                os.unlink(cached_file)
-                cached_file = None
+            # If delta exists then use the delta uri.
+            if delta and not ignore_delta:
+                install_op = get_install_op(delta.packageURI, delta.packageHash)
 
-            install_op = Install(pkg_path, ignore_dep)
+                # Binary patches of a delta can only be applied to the
+                # exact files they were created against.
+                if not pisi.operations.delta.check_patches(install_op.package,
+                                                           ctx.config.dest_dir()):
+                    return install_op
 
-            # Bug 4113
-            if not cached_file:
-                downloaded_file = install_op.package.filepath
-                if pisi.util.sha1_file(downloaded_file) != pkg_hash:
-                    raise pisi.Error(_("Download Error: Package does not match the repository package."))
+                ctx.ui.warning(_("Installed files of %s have been changed, "
+                                 "using the full package instead of the delta.") % name)
 
-            return install_op
+            return get_install_op(pkg.packageURI, pkg.packageHash, stream)
         else:
             raise Error(_("Package %s not found in any active repository.") % name)
 
-    def __init__(self, package_fname, ignore_dep=None, ignore_file_conflicts=None):
+    def __init__(self, package_fname, ignore_dep=None, ignore_file_conflicts=None,
+                 package=None):
         if not ctx.filesdb:
             ctx.filesdb = pisi.db.filesldb.FilesLDB()
         "initialize from a file name"
@@ -134,7 +155,7 @@ class Install(AtomicOperation):
         self.ignore_file_conflicts = ignore_file_conflicts
         self.package_fname = package_fname
         try:
-            self.package = pisi.package.Package(package_fname)
+            self.package = package or pisi.package.Package(package_fname)
             self.package.read()
         except zipfile.BadZipFile:
             raise zipfile.BadZipFile(self.package_fname)
@@ -160,6 +181,7 @@ class Install(AtomicOperation):
         self.check_versioning(self.pkginfo.version, self.pkginfo.release)
         self.check_relations()
         self.check_operation()
+        self.check_patches()
 
         ctx.disable_keyboard_interrupts()
 
@@ -264,6 +286,15 @@ class Install(AtomicOperation):
         else:
             self.operation = INSTALL
 
+    def check_patches(self):
+        """check that binary patches of a delta package can be applied"""
+        mismatched = pisi.operations.delta.check_patches(self.package,
+                                                         ctx.config.dest_dir())
+        if mismatched:
+            raise Error(_("Delta package %s cannot be installed, these files "
+                          "have been changed:\n%s") %
+                        (self.package_fname, "\n".join("/" + path for path in mismatched)))
+
     def postinstall(self):
         "runs post-install commands"
         try:
@@ -275,8 +306,8 @@ class Install(AtomicOperation):
     def extract_install(self):
         "extracts files from the package"
         dest_dir = ctx.config.dest_dir()
-        # print("DESTDIR: %s" % dest_dir)
-        self.package.extract(dest_dir)
+        self.package.extract_install(dest_dir)
+        pisi.operations.delta.apply_patches(self.package, dest_dir)
 
     def store_pisi_files(self):
         """stores new package files in database"""
@@ -314,6 +345,70 @@ def install_single_name(name, upgrade):
     """install by name"""
     install_single(name, upgrade)
 
+# Number of workers unlinking the files of a removed package
+remove_jobs = 4
+
+def unlink_files(paths):
+    """Unlink the files at paths in parallel. Return the lists of the
+    unlinked paths, the directories and the paths that do not exist."""
+    def unlink(chunk):
+        result = []
+        for fpath in chunk:
+            try:
+                os.unlink(fpath)
+                result.append(True)
+            except FileNotFoundError:
+                result.append(False)
+            except OSError:
+                if not os.path.isdir(fpath) or os.path.islink(fpath):
+                    raise
+                result.append(None)
+        return result
+
+    jobs = min(remove_jobs, len(paths) // 256 + 1)
+    chunks = [paths[i::jobs] for i in range(jobs)]
+    if jobs > 1:
+        with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+            results = list(executor.map(unlink, chunks))
+    else:
+        results = [unlink(chunk) for chunk in chunks]
+
+    unlinked, directories, missing = [], [], []
+    for chunk, result in zip(chunks, results):
+        for fpath, status in zip(chunk, result):
+            if status:
+                unlinked.append(fpath)
+            elif status is None:
+                directories.append(fpath)
+            else:
+                missing.append(fpath)
+    return unlinked, directories, missing
+
+def remove_empty_dirs(paths, directories, top="/"):
+    """Remove the given directories and the parent directories of paths
+    if they are empty, deepest first, up to top"""
+    top = os.path.normpath(top)
+    dirs = set()
+    for dpath in [os.path.dirname(p) for p in paths] + directories:
+        dpath = os.path.normpath(dpath)
+        while dpath not in dirs and dpath not in (top, "/") \
+                and dpath.startswith(top.rstrip("/") + "/"):
+            dirs.add(dpath)
+            dpath = os.path.dirname(dpath)
+
+    # A directory can not be empty if one of its subdirectories is kept
+    kept = set()
+    for dpath in sorted(dirs, key=lambda d: d.count("/"), reverse=True):
+        if dpath not in kept:
+            try:
+                os.rmdir(dpath)
+                continue
+            except FileNotFoundError:
+                continue
+            except OSError:
+                pass
+        kept.add(os.path.dirname(dpath))
+
 class Remove(AtomicOperation):
 
     def __init__(self, package_name, ignore_dep=None, store_old_paths=None):
@@ -343,8 +438,7 @@ class Remove(AtomicOperation):
         self.check_dependencies()
 
         self.run_preremove()
-        for fileinfo in self.files.list:
-            self.remove_file(fileinfo, self.package_name, True)
+        self.remove_files(self.files.list, self.package_name, True)
 
         self.run_postremove()
 
@@ -363,23 +457,41 @@ class Remove(AtomicOperation):
 
     @staticmethod
     def remove_file(fileinfo, package_name, remove_permanent=False, store_old_paths=None):
+        Remove.remove_files([fileinfo], package_name, remove_permanent, store_old_paths)
 
-        if fileinfo.permanent and not remove_permanent:
-            return
+    @staticmethod
+    def remove_files(files, package_name, remove_permanent=False, store_old_paths=None):
+        """Remove the given files of a package. The owners of all paths are
+        looked up at once, the files are unlinked by a pool of workers and
+        the emptied directories are removed at the end, deepest first."""
 
-        fpath = pisi.util.join_path(ctx.config.dest_dir(), fileinfo.path)
+        files = [f for f in files if remove_permanent or not f.permanent]
+        if not files:
+            return
 
-        historydb = pisi.db.historydb.HistoryDB()
         # we should check if the file belongs to another
         # package (this can legitimately occur while upgrading
         # two packages such that a file has moved from one package to
         # another as in #2911)
-        pkg, existing_file = ctx.filesdb.get_file(fileinfo.path)
-        if pkg and pkg != package_name:
-            ctx.ui.warning(_('Not removing conflicted file : %s') % fpath)
-            return
+        owners = ctx.filesdb.get_packages([f.path for f in files])
 
-        if fileinfo.type == ctx.const.conf:
+        dest_dir = ctx.config.dest_dir()
+        config_files = []
+        paths = []
+        for fileinfo in files:
+            fpath = pisi.util.join_path(dest_dir, fileinfo.path)
+            pkg = owners.get(fileinfo.path)
+            if pkg and pkg != package_name:
+                ctx.ui.warning(_('Not removing conflicted file : %s') % fpath)
+            elif fileinfo.type == ctx.const.conf:
+                config_files.append((fileinfo, fpath))
+            else:
+                paths.append(fpath)
+
+        removed = []
+        if config_files:
+            historydb = pisi.db.historydb.HistoryDB()
+        for fileinfo, fpath in config_files:
             # config files are precious, leave them as they are
             # unless they are the same as provided by package.
             # remove symlinks as they are, cause if the hash of the
@@ -398,23 +510,18 @@ class Remove(AtomicOperation):
                         os.unlink(fpath)
             except pisi.util.FileError:
                 pass
-        else:
-            if os.path.isfile(fpath) or os.path.islink(fpath):
-                os.unlink(fpath)
-                if store_old_paths:
-                    with open(store_old_paths, "a") as f:
-                        f.write("%s\n" % fpath)
-            elif os.path.isdir(fpath) and not os.listdir(fpath):
-                os.rmdir(fpath)
-            else:
-                ctx.ui.warning(_('Installed file %s does not exist on system [Probably you manually deleted]') % fpath)
-                return
+            removed.append(fpath)
 
-        # remove emptied directories
-        dpath = os.path.dirname(fpath)
-        while dpath != '/' and not os.listdir(dpath):
-            os.rmdir(dpath)
-            dpath = os.path.dirname(dpath)
+        unlinked, directories, missing = unlink_files(paths)
+        if store_old_paths and unlinked:
+            with open(store_old_paths, "a") as f:
+                f.writelines("%s\n" % fpath for fpath in unlinked)
+
+        for fpath in missing:
+            ctx.ui.warning(_('Installed file %s does not exist on system [Probably you manually deleted]') % fpath)
+
+        removed.extend(unlinked)
+        remove_empty_dirs(removed, directories, dest_dir)
 
     def run_preremove(self):
         if ctx.comar:
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Binary diff and patch of file contents.
+
+A patch is a VCDIFF-like list of COPY (offset and length in the old data)
+and ADD (literal bytes) instructions, compressed with xz. The encoder
+splits both inputs into content defined chunks, which end after a marker
+byte chosen from the old data, and greedily extends every chunk of the
+new data found in the old one. Chunk boundaries are found with
+bytes.find and compared as whole slices, so the Python code runs once
+per chunk, not once per byte, and inputs may be mmap objects. This is
+good enough for the common case of small changes in large binaries and
+needs only the standard library."""
+
+import lzma
+import struct
+import collections
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+
+MAGIC = b"PISIBDF1"
+
+OP_COPY = b"C"
+OP_ADD = b"A"
+
+_header = struct.Struct(">Q")
+_copy = struct.Struct(">QQ")
+_add = struct.Struct(">Q")
+
+# Give up if nothing matched after scanning this much of the new data
+_probe_size = 1024 * 1024
+
+# Chunk sizes: the marker byte is chosen to give chunks of about
+# _chunk_size bytes, chunks without a marker are cut at _max_chunk_size
+_min_chunk_size = 64
+_chunk_size = 512
+_max_chunk_size = 8192
+
+# The marker byte is chosen from this much of the old data
+_sample_size = 1024 * 1024
+
+class Error(pisi.Error):
+    pass
+
+def _marker(data):
+    """Return the byte whose frequency in data is closest to one per
+    _chunk_size bytes"""
+    sample = bytes(data[:_sample_size])
+    counts = collections.Counter(sample)
+    wanted = len(sample) // _chunk_size
+    return bytes([min(range(256), key=lambda byte: (abs(counts[byte] - wanted), byte))])
+
+def _chunks(data, marker):
+    """Yield the (start, end) offsets of the content defined chunks of data"""
+    size = len(data)
+    start = 0
+    while start < size:
+        end = data.find(marker, start + _min_chunk_size, start + _max_chunk_size)
+        end = min(size, start + _max_chunk_size if end < 0 else end + 1)
+        yield start, end
+        start = end
+
+def _match_length(old, old_offset, new, new_offset):
+    """Return the length of the common run of old and new at given offsets"""
+    limit = min(len(old) - old_offset, len(new) - new_offset)
+    length = 0
+    step = 1 << 16
+    while length < limit and step:
+        size = min(step, limit - length)
+        if old[old_offset + length:old_offset + length + size] == \
+                new[new_offset + length:new_offset + length + size]:
+            length += size
+        else:
+            step = size // 2
+    return length
+
+def _match_length_back(old, old_end, new, new_end, limit):
+    """Return the length of the common run of old and new ending at given
+    offsets, at most limit bytes"""
+    limit = min(limit, old_end, new_end)
+    length = 0
+    step = _max_chunk_size
+    while length < limit and step:
+        size = min(step, limit - length)
+        if old[old_end - length - size:old_end - length] == \
+                new[new_end - length - size:new_end - length]:
+            length += size
+        else:
+            step = size // 2
+    return length
+
+def diff(old, new):
+    """Return a patch which turns old into new, bytes or other buffers
+    like mmap objects.
+
+    None is returned if the data are so different that the patch would
+    not be smaller than the new data itself."""
+
+    marker = _marker(old)
+    index = {}
+    for start, end in _chunks(old, marker):
+        index.setdefault(hash(old[start:end]), start)
+
+    ops = [MAGIC, _header.pack(len(new))]
+    matched = 0
+    add_start = 0
+
+    for start, end in _chunks(new, marker):
+        if start < add_start:
+            # Already covered by the previous copy
+            continue
+
+        if start > _probe_size and not matched:
+            return None
+
+        chunk = new[start:end]
+        offset = index.get(hash(chunk))
+        if offset is None or old[offset:offset + len(chunk)] != chunk:
+            continue
+
+        # Extend the match backwards into the pending literal bytes
+        back = _match_length_back(old, offset, new, start, start - add_start)
+        start -= back
+        offset -= back
+
+        length = _match_length(old, offset, new, start)
+
+        if start > add_start:
+            ops.append(OP_ADD + _add.pack(start - add_start))
+            ops.append(new[add_start:start])
+        ops.append(OP_COPY + _copy.pack(offset, length))
+
+        matched += length
+        add_start = start + length
+
+    if add_start < len(new):
+        ops.append(OP_ADD + _add.pack(len(new) - add_start))
+        ops.append(new[add_start:])
+
+    if matched * 2 < len(new):
+        return None
+
+    return lzma.compress(b"".join(ops))
+
+def patch(old, data):
+    """Apply patch data to bytes old and return the new bytes"""
+    try:
+        data = lzma.decompress(data)
+    except lzma.LZMAError as e:
+        raise Error(_("Invalid binary patch: %s") % e)
+
+    if not data.startswith(MAGIC):
+        raise Error(_("Invalid binary patch: bad magic"))
+
+    pos = len(MAGIC)
+    size, = _header.unpack_from(data, pos)
+    pos += _header.size
+
+    out = []
+    while pos < len(data):
+        op = data[pos:pos + 1]
+        pos += 1
+        if op == OP_COPY:
+            offset, length = _copy.unpack_from(data, pos)
+            pos += _copy.size
+            if offset + length > len(old):
+                raise Error(_("Invalid binary patch: copy out of range"))
+            out.append(old[offset:offset + length])
+        elif op == OP_ADD:
+            length, = _add.unpack_from(data, pos)
+            pos += _add.size
+            out.append(data[pos:pos + length])
+            pos += length
+        else:
+            raise Error(_("Invalid binary patch: unknown instruction"))
+
+    new = b"".join(out)
+    if len(new) != size:
+        raise Error(_("Invalid binary patch: size mismatch"))
+
+    return new
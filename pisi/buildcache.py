@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Content addressed cache of build results.
+
+The key of a build is a hash of everything the produced packages depend
+on: the files of the source package (pspec.xml, actions.py, patches,
+additional files, COMAR scripts, translations), the source archive
+hashes given in the pspec, the installed versions of the build
+dependencies and the configuration used for building. The packages of a
+build are stored under its key and copied to the output directory when
+the same build is requested again. The least recently used entries are
+removed when the cache grows beyond its size limit."""
+
+import os
+import shutil
+import pickle
+import hashlib
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+import pisi.util as util
+import pisi.context as ctx
+
+MANIFEST = "manifest"
+STATS = "stats"
+
+def hash_file(sha, path, name):
+    sha.update(("file %s\n" % name).encode("utf-8"))
+    if os.path.exists(path):
+        sha.update(util.sha1_file(path).encode("utf-8"))
+    else:
+        sha.update(b"missing")
+    sha.update(b"\n")
+
+def build_inputs(builder):
+    """Yield (name, path) tuples of the source package files of a build"""
+    specdir = builder.specdir
+    yield ctx.const.pspec_file, builder.specuri.get_uri() \
+            if not builder.specuri.is_remote_file() \
+            else os.path.join(specdir, ctx.const.pspec_file)
+    yield ctx.const.actions_file, os.path.join(specdir, ctx.const.actions_file)
+    yield ctx.const.translations_file, os.path.join(specdir, ctx.const.translations_file)
+
+    files_dir = os.path.join(specdir, ctx.const.files_dir)
+    for patch in builder.spec.source.patches:
+        yield os.path.join(ctx.const.files_dir, patch.filename), \
+                os.path.join(files_dir, patch.filename)
+
+    for package in builder.spec.packages + [builder.spec.source]:
+        for afile in package.additionalFiles:
+            yield os.path.join(ctx.const.files_dir, afile.filename), \
+                    os.path.join(files_dir, afile.filename)
+
+    for package in builder.spec.packages:
+        for pcomar in package.providesComar:
+            yield os.path.join(ctx.const.comar_dir, pcomar.script), \
+                    os.path.join(specdir, ctx.const.comar_dir, pcomar.script)
+
+def build_key(builder):
+    """Return the cache key of the build of builder"""
+    sha = hashlib.sha256()
+    sha.update(("pisi %s\n" % pisi.__version__).encode("utf-8"))
+
+    for name, path in build_inputs(builder):
+        hash_file(sha, path, name)
+
+    for archive in builder.spec.source.archive:
+        sha.update(("archive %s %s\n" % (archive.uri, archive.sha1sum)).encode("utf-8"))
+
+    build_deps = set(dep.package for dep in builder.spec.source.buildDependencies)
+    for package in builder.spec.packages:
+        build_deps.update(dep.package for dep in package.buildDependencies)
+    for name in sorted(build_deps):
+        if builder.installdb.has_package(name):
+            version = " ".join(str(x) for x in builder.installdb.get_version(name))
+        else:
+            version = "none"
+        sha.update(("dependency %s %s\n" % (name, version)).encode("utf-8"))
+
+    general = ctx.config.values.general
+    build = ctx.config.values.build
+    settings = (general.architecture, general.distribution,
+                general.distribution_release, general.distribution_id,
+                build.host, build.cflags, build.cxxflags, build.ldflags,
+                build.generateDebug, build.compressionlevel,
+                builder.target_package_format,
+                ctx.get_option("create_static"), ctx.get_option("ignore_check"),
+                ctx.get_option("use_quilt"))
+    sha.update(("settings %r\n" % (settings,)).encode("utf-8"))
+
+    return sha.hexdigest()
+
+class BuildCache(object):
+
+    def __init__(self, cache_dir=None, limit=None):
+        self.cache_dir = cache_dir or ctx.config.build_cache_dir()
+        if limit is None:
+            limit = int(ctx.config.values.build.buildcachelimit or 0) * 1024 * 1024
+        self.limit = limit
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key, output_dir):
+        """Copy the packages of key to output_dir and return the lists of
+        their paths and of the debug package paths, or None"""
+        entry = self.entry_dir(key)
+        manifest = os.path.join(entry, MANIFEST)
+        try:
+            with open(manifest, "rb") as f:
+                packages, debug_packages = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            self.count("misses")
+            return None
+
+        util.ensure_dirs(output_dir)
+        paths = ([], [])
+        for names, copied in zip((packages, debug_packages), paths):
+            for name in names:
+                dest = os.path.join(output_dir, name)
+                shutil.copy2(os.path.join(entry, name), dest)
+                copied.append(dest)
+
+        # The manifest time orders the entries for eviction
+        os.utime(manifest, None)
+        self.count("hits")
+        return paths
+
+    def put(self, key, packages, debug_packages):
+        """Store the package files of the build of key"""
+        entry = self.entry_dir(key)
+        tmp = "%s.%d%s" % (entry, os.getpid(), ctx.const.temporary_suffix)
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        util.ensure_dirs(tmp)
+        try:
+            for path in packages + debug_packages:
+                # Not a hard link, the output file may be rewritten in place
+                shutil.copy2(path, os.path.join(tmp, os.path.basename(path)))
+
+            with open(os.path.join(tmp, MANIFEST), "wb") as f:
+                pickle.dump(([os.path.basename(path) for path in packages],
+                             [os.path.basename(path) for path in debug_packages]),
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            if os.path.exists(entry):
+                shutil.rmtree(entry)
+            os.rename(tmp, entry)
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        self.evict()
+
+    def entries(self):
+        """Return (last use, size, key) tuples of the cached builds"""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry = os.path.join(prefix_dir, key)
+                manifest = os.path.join(entry, MANIFEST)
+                if not os.path.exists(manifest):
+                    continue
+                size = sum(os.path.getsize(os.path.join(entry, name))
+                           for name in os.listdir(entry))
+                entries.append((os.path.getmtime(manifest), size, key))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used builds beyond the size limit"""
+        if not self.limit:
+            return
+
+        entries = sorted(self.entries())
+        total = sum(size for used, size, key in entries)
+        for used, size, key in entries:
+            if total <= self.limit:
+                break
+            ctx.ui.debug(_("Removing build %s from the build cache") % key)
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        try:
+            with open(os.path.join(self.cache_dir, STATS), "rb") as f:
+                return pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return {"hits": 0, "misses": 0}
+
+    def count(self, name):
+        stats = self.stats()
+        stats[name] = stats.get(name, 0) + 1
+        path = os.path.join(self.cache_dir, STATS)
+        tmp = "%s.%d%s" % (path, os.getpid(), ctx.const.temporary_suffix)
+        try:
+            util.ensure_dirs(self.cache_dir)
+            with open(tmp, "wb") as f:
+                pickle.dump(stats, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except (IOError, OSError) as e:
+            ctx.ui.debug(_("Cannot write build cache statistics: %s") % e)
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
@@ -105,6 +105,12 @@ class Build(command.Command, metaclass=command.autocommand):
                          help=_("Do not constrain build process inside "
                                 "the build folder"))
 
+        group.add_option("--ignore-build-cache",
+                         action="store_true",
+                         default=False,
+                         help=_("Build the package even if the same build "
+                                "is in the build cache"))
+
     def add_steps_options(self):
         group = optparse.OptionGroup(self.parser, _("build steps"))
 
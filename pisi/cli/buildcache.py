@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import optparse
+import gettext
+
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi.cli.command as command
+import pisi.context as ctx
+import pisi.util as util
+import pisi.api
+
+class BuildCache(command.Command, metaclass=command.autocommand):
+    __doc__ = _("""Show build cache statistics
+
+Usage: build-cache
+
+Shows the number and size of the builds in the build cache and how
+often builds were taken from it. The build cache is used by build
+and emerge if buildcache is enabled in the [build] section of
+pisi.conf.
+""")
+
+    def __init__(self, args):
+        super(BuildCache, self).__init__(args)
+
+    name = ("build-cache", "bc")
+
+    def options(self):
+        group = optparse.OptionGroup(self.parser, _("build-cache options"))
+        group.add_option("--clear", action="store_true",
+                         default=False, help=_("Remove all builds from the build cache"))
+        self.parser.add_option_group(group)
+
+    def run(self):
+        if ctx.get_option("clear"):
+            self.init(database=False, write=True)
+            pisi.api.clear_build_cache()
+            return
+
+        self.init(database=False, write=False)
+        info = pisi.api.build_cache_info()
+
+        size, symbol = util.human_readable_size(info["size"])
+        ctx.ui.info(_("Builds: %d") % info["builds"])
+        ctx.ui.info(_("Size: %.1f %s") % (size, symbol))
+        if info["limit"]:
+            limit, symbol = util.human_readable_size(info["limit"])
+            ctx.ui.info(_("Size limit: %.1f %s") % (limit, symbol))
+
+        requests = info["hits"] + info["misses"]
+        ratio = 100.0 * info["hits"] / requests if requests else 0
+        ctx.ui.info(_("Hits: %d, misses: %d (%.0f%% hit ratio)") %
+                    (info["hits"], info["misses"], ratio))
@@ -35,6 +35,9 @@ file. Check command uses the checksums to verify a package.
 Just give the names of packages.
 
 If no packages are given, checks all installed packages.
+
+With --verify-package, the arguments are package files and the
+files in their install archives are checked against their files.xml.
 """)
 
 
@@ -64,11 +67,21 @@ class Check(command.Command, metaclass=command.autocommand):
                          help=_("Checks only changed config files of "
                                 "the packages"))
 
+        group.add_option("--verify-package",
+                         action="store_true",
+                         default=False,
+                         help=_("Verify the contents of the given "
+                                "package files"))
+
         self.parser.add_option_group(group)
 
     def run(self):
         self.init(database=True, write=False)
 
+        if ctx.get_option('verify_package'):
+            self.verify_packages()
+            return
+
         component = ctx.get_option('component')
         if component:
             installed = pisi.api.list_installed()
@@ -140,3 +153,31 @@ class Check(command.Command, metaclass=command.autocommand):
                              "have read access.\n"
                              "Running the check under a privileged user "
                              "may help fixing this problem."))
+
+    def verify_packages(self):
+        if not self.args:
+            self.help()
+            return
+
+        prefix = _('Verifying %s')
+        maxlen = max([len(path) for path in self.args])
+
+        for path in self.args:
+            check_results = pisi.api.verify_package(path)
+            ctx.ui.info("%s    %s" % ((prefix % path),
+                                      ' ' * (maxlen - len(path))),
+                        noln=True)
+
+            if not check_results['missing'] and not check_results['corrupted']:
+                ctx.ui.info(util.colorize(_("OK"), 'green'))
+                continue
+
+            ctx.ui.info(util.colorize(_("Broken"), 'brightred'))
+
+            for fpath in check_results['missing']:
+                ctx.ui.info(util.colorize(
+                    _("Missing file: /%s") % fpath, 'brightred'))
+
+            for fpath in check_results['corrupted']:
+                ctx.ui.info(util.colorize(
+                    _("Corrupted file: /%s") % fpath, 'brightyellow'))
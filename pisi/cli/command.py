@@ -161,6 +161,9 @@ class Command(object):
         pisi.api.set_options(self.options)
         pisi.api.set_comar(self.comar and not ctx.get_option('ignore_comar'))
 
+        # The daemon serves the queries of the system root only
+        pisi.api.set_daemon(database and not write and not ctx.get_option('destdir'))
+
     def get_name(self):
         return self.__class__.name
 
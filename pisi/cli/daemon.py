@@ -0,0 +1,46 @@
+# -*- coding:utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import optparse
+import gettext
+
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi.cli.command as command
+import pisi.context as ctx
+import pisi.api
+
+class Daemon(command.Command, metaclass=command.autocommand):
+    __doc__ = _("""Serve package queries to other pisi commands
+
+Usage: daemon
+
+Keeps the package databases in memory and answers the read-only
+queries of the pisi commands, like listing and searching packages,
+over a Unix socket. The commands use the daemon when it is running.
+The databases are reloaded after repository updates and package
+operations.
+""")
+
+    def __init__(self, args):
+        super(Daemon, self).__init__(args)
+
+    name = ("daemon", None)
+
+    def options(self):
+        group = optparse.OptionGroup(self.parser, _("daemon options"))
+        group.add_option("-s", "--socket", action="store",
+                         default=None, help=_("Path of the Unix socket"))
+        self.parser.add_option_group(group)
+
+    def run(self):
+        self.init(database=True, write=True)
+        pisi.api.run_daemon(ctx.get_option("socket"))
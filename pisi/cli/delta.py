@@ -25,10 +25,20 @@ usage = _("""Creates delta packages
 
 Usage: delta oldpackage1 oldpackage2 ... newpackage
        delta -t newpackage oldpackage1 oldpackage2 ...
+       delta -r repodirectory
 
 Delta command finds the changed files between the given
 packages by comparing the sha1sum of files and creates
 a delta package with the changed files.
+
+With --binary-diff, changed files which also exist in the old
+package are stored as binary patches against the old files
+when that is smaller than storing the whole file.
+
+With --repo-dir, the newest package of every package in the
+given directory tree gets delta packages from its previous
+releases found in the same tree. Deltas against several old
+packages are created in parallel.
 """)
 
 
@@ -64,6 +74,25 @@ class Delta(command.Command, metaclass=command.autocommand):
                                 "format. Use '-F help' to see a list of "
                                 "supported formats."))
 
+        group.add_option("-b", "--binary-diff",
+                         action="store_true",
+                         default=False,
+                         help=_("Store changed files as binary patches "
+                                "against the files of the old package."))
+
+        group.add_option("-r", "--repo-dir",
+                         action="store",
+                         default=None,
+                         help=_("Create delta packages for all packages in "
+                                "the given repository directory."))
+
+        group.add_option("--releases",
+                         action="store",
+                         type="int",
+                         default=5,
+                         help=_("Number of previous releases to create "
+                                "delta packages from in --repo-dir mode."))
+
     def run(self):
         self.init(database=False, write=False)
 
@@ -76,6 +105,12 @@ class Delta(command.Command, metaclass=command.autocommand):
                     ctx.ui.info("  %s" % format)
             return
 
+        if self.options.repo_dir:
+            from pisi.operations.delta import create_repo_delta_packages
+            create_repo_delta_packages(self.options.repo_dir,
+                                       self.options.releases)
+            return
+
         new_package = self.options.newest_package  # Değiştirildi
         if new_package:
             old_packages = self.args
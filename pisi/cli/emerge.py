@@ -49,6 +49,10 @@ You can also give the name of a component.
                          default=False, help=_("Ignore package conflicts"))
         group.add_option("--ignore-comar", action="store_true",
                          default=False, help=_("Bypass comar configuration agent"))
+        group.add_option("-j", "--jobs", action="store", type="int",
+                         default=None, help=_("Number of source packages to build at the same time"))
+        group.add_option("-l", "--load-average", action="store", type="float",
+                         default=None, help=_("Do not start new builds while the load average is above this value"))
         self.parser.add_option_group(group)
 
     def run(self):
@@ -60,6 +60,14 @@ Lists previous operations.""")
                          help=_("Take snapshot of the current system"))
         group.add_option("-t", "--takeback", action="store", type="int", default=-1,
                          help=_("Takeback to the state after the given operation finished"))
+        group.add_option("--package", action="store", default=None,
+                         help=_("Output only the operations changing the given package"))
+        group.add_option("--type", action="store", default=None,
+                         help=_("Output only the operations of the given type"))
+        group.add_option("--since", action="store", default=None,
+                         help=_("Output only the operations since the given date (yyyy-mm-dd)"))
+        group.add_option("--until", action="store", default=None,
+                         help=_("Output only the operations until the given date (yyyy-mm-dd)"))
 
     def take_snapshot(self):
         pisi.api.snapshot()
@@ -67,8 +75,14 @@ Lists previous operations.""")
     def takeback(self, operation):
         pisi.api.takeback(operation)
 
+    def operations(self):
+        filters = [ctx.get_option(option) for option in ("package", "type", "since", "until")]
+        if any(filters):
+            return self.historydb.search_operations(*filters, count=ctx.get_option('last'))
+        return self.historydb.get_last(ctx.get_option('last'))
+
     def print_history(self):
-        for operation in self.historydb.get_last(ctx.get_option('last')):
+        for operation in self.operations():
             print(_("Operation #%d: %s") % (operation.no, opttrans[operation.type]))
             print(_("Date: %s %s") % (operation.date, operation.time))
             print()
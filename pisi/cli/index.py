@@ -31,6 +31,10 @@ source and binary packages.
 
 If you give multiple directories, the command still works, but puts
 everything in a single index file.
+
+Metadata and hashes of packages which have not changed since the last
+run are reused from a cache file kept in each directory. Use --full to
+process every package again.
 """)
 
 
@@ -72,6 +76,12 @@ class Index(command.Command, metaclass=command.autocommand):
                          default=False,
                          help=_("Do not sign index."))
 
+        group.add_option("--full",
+                         action="store_true",
+                         default=False,
+                         help=_("Ignore the index cache and process all "
+                                "packages."))
+
         self.parser.add_option_group(group)
 
     def run(self):
@@ -92,4 +102,5 @@ class Index(command.Command, metaclass=command.autocommand):
               ctx.get_option('output'),
               skip_sources=ctx.get_option('skip_sources'),
               skip_signing=ctx.get_option('skip_signing'),
-              compression=compression)
+              compression=compression,
+              full=ctx.get_option('full'))
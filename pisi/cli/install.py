@@ -67,6 +67,8 @@ expanded to package names.
                                 "any pattern contained in file."))
         group.add_option("-s", "--store-lib-info", action="store_true",
                          default=False, help=_("Store previous libraries info when package is updating to newer version."))
+        group.add_option("--stream", action="store_true",
+                         default=False, help=_("Install packages while they are being downloaded"))
         self.parser.add_option_group(group)
 
     def run(self):
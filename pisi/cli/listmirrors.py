@@ -0,0 +1,62 @@
+# -*- coding:utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import optparse
+import gettext
+
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi.cli.command as command
+import pisi.context as ctx
+import pisi.util as util
+import pisi.api
+
+class ListMirrors(command.Command, metaclass=command.autocommand):
+    __doc__ = _("""List mirrors ranked by their speed
+
+Usage: list-mirrors [ <name1> <name2> ... namen ]
+
+Lists the mirrors used for mirrors://<name>/ urls, best mirror first,
+with their measured latency, throughput and recent failures. If no
+name is specified, all mirrors are listed.
+""")
+
+    def __init__(self, args):
+        super(ListMirrors, self).__init__(args)
+
+    name = ("list-mirrors", "lm")
+
+    def options(self):
+        group = optparse.OptionGroup(self.parser, _("list-mirrors options"))
+        group.add_option("-p", "--probe", action="store_true",
+                         default=False, help=_("Measure the latency of the mirrors before listing them"))
+        self.parser.add_option_group(group)
+
+    def run(self):
+        self.init(database=False, write=False)
+
+        ranking = pisi.api.list_mirrors(self.args or None,
+                                        ctx.get_option("probe"))
+        for name in sorted(ranking):
+            ctx.ui.info(util.colorize(name, 'green'))
+            for url, stat in ranking[name]:
+                if stat is None:
+                    ctx.ui.info("  %-50s %s" % (url, _("not measured")))
+                    continue
+
+                latency = "%.0f ms" % (stat.latency * 1000) if stat.latency is not None else "-"
+                if stat.throughput:
+                    rate, symbol = util.human_readable_rate(stat.throughput)
+                    throughput = "%.1f %s" % (rate, symbol)
+                else:
+                    throughput = "-"
+                ctx.ui.info("  %-50s %10s %14s %6.1f" % (url, latency, throughput, stat.failures))
+            print()
@@ -23,9 +23,11 @@ import pisi.cli.command as command
 import pisi.cli.addrepo
 import pisi.cli.blame
 import pisi.cli.build
+import pisi.cli.buildcache
 import pisi.cli.check
 import pisi.cli.clean
 import pisi.cli.configurepending
+import pisi.cli.daemon
 import pisi.cli.deletecache
 import pisi.cli.delta
 import pisi.cli.emerge
@@ -40,6 +42,7 @@ import pisi.cli.listnewest
 import pisi.cli.listavailable
 import pisi.cli.listcomponents
 import pisi.cli.listinstalled
+import pisi.cli.listmirrors
 import pisi.cli.listorphaned
 import pisi.cli.listpending
 import pisi.cli.listrepo
@@ -72,6 +72,8 @@ expanded to package names.
                                 "any pattern contained in file."))
         group.add_option("-s", "--compare-sha1sum", action="store_true",
                          default=False, help=_("Compare sha1sum repo and installed packages"))
+        group.add_option("--stream", action="store_true",
+                         default=False, help=_("Install packages while they are being downloaded"))
 
         self.parser.add_option_group(group)
 
@@ -14,8 +14,11 @@ import gettext
 import os
 import string
 import time
+import threading
+import concurrent.futures
 
 import pisi
+import pisi.ui
 import pisi.context as ctx
 
 __trans = gettext.translation('pisi', fallback=True)
@@ -31,6 +34,9 @@ try:
 except ImportError:
     raise Error(_("comar-api package is not fully installed"))
 
+# Number of post install scripts of independent packages run at the same time
+script_jobs = 4
+
 
 def is_char_valid(char):
     """Test if char is valid object path character."""
@@ -56,24 +62,24 @@ def safe_script_name(package):
     return object_name
 
 
-def get_link():
-    """Connect to the COMAR daemon and return the link."""
+class CachedLink(object):
+    """COMAR link kept in ctx.comar_link during an operation together with
+    the names of the package handlers"""
 
-    sockname = "/var/run/dbus/system_bus_socket"
-    # YALI starts comar chrooted in the install target, but uses PiSi
-    # outside of the chroot environment, so Pisi needs to use a different
-    # socket path to be able to connect true dbus (and comar).
-    # (usually /var/run/dbus/system_bus_socket)
-    if ctx.dbus_sockname:
-        sockname = ctx.dbus_sockname
+    def __init__(self, key, link):
+        self.key = key
+        self.link = link
+        self.handlers = None
+        # Handlers without a setupPackages method
+        self.unbatched = set()
+
+    def package_handlers(self):
+        if self.handlers is None:
+            self.handlers = list(self.link.System.PackageHandler)
+        return self.handlers
 
-    alternate = False
-    # If COMAR package is updated, all new configuration requests should be
-    # made through new COMAR service. Passing alternate=True to Link() class
-    # will ensure this.
-    if ctx.comar_updated:
-        alternate = True
 
+def connect(sockname, alternate):
     # This function is sometimes called when comar has recently started
     # or restarting after an update. So we give comar a chance to become
     # active in a reasonable time.
@@ -94,29 +100,51 @@ def get_link():
                 % "\n  ".join(exceptions))
 
 
-def post_install(package_name, provided_scripts,
-                 scriptpath, metapath, filepath,
-                 fromVersion, fromRelease, toVersion, toRelease):
-    """Do package's post install operations"""
+def get_cached_link():
+    """Return the CachedLink of the current operation, connecting to the
+    COMAR daemon if there is none"""
 
-    ctx.ui.info(_("Configuring %s package") % package_name)
-    self_post = False
+    sockname = "/var/run/dbus/system_bus_socket"
+    # YALI starts comar chrooted in the install target, but uses PiSi
+    # outside of the chroot environment, so Pisi needs to use a different
+    # socket path to be able to connect true dbus (and comar).
+    # (usually /var/run/dbus/system_bus_socket)
+    if ctx.dbus_sockname:
+        sockname = ctx.dbus_sockname
 
-    package_name = safe_script_name(package_name)
+    alternate = False
+    # If COMAR package is updated, all new configuration requests should be
+    # made through new COMAR service. Passing alternate=True to Link() class
+    # will ensure this.
+    if ctx.comar_updated:
+        alternate = True
 
-    if package_name == 'comar':
-        ctx.ui.debug(_("COMAR package updated. From now on,"
-                       " using new COMAR daemon."))
-        pisi.api.set_comar_updated(True)
+    key = (sockname, alternate)
+    if ctx.comar_link is None or ctx.comar_link.key != key:
+        ctx.comar_link = CachedLink(key, connect(sockname, alternate))
+    return ctx.comar_link
+
+
+def get_link():
+    """Connect to the COMAR daemon and return the link. The link is reused
+    until the end of the current locked operation."""
+    return get_cached_link().link
 
-    link = get_link()
 
+def register_scripts(cached, package_name, provided_scripts, scriptpath):
+    """Register the COMAR scripts of the package. Return True if it has
+    a System.Package script."""
+    link = cached.link
+    self_post = False
     for script in provided_scripts:
         ctx.ui.debug(_("Registering %s comar script") % script.om)
         script_name = safe_script_name(script.name) \
             if script.name else package_name
         if script.om == "System.Package":
             self_post = True
+        elif script.om == "System.PackageHandler":
+            cached.handlers = None
+            cached.unbatched.discard(script_name)
         try:
             link.register(script_name, script.om,
                           os.path.join(scriptpath, script.script))
@@ -127,42 +155,159 @@ def post_install(package_name, provided_scripts,
                 link.System.Service[script_name].registerState()
             except dbus.DBusException as exception:
                 raise Error(_("Script error: %s") % exception)
+    return self_post
+
+
+def setup_packages(cached, paths):
+    """Call the post install handlers for the (metapath, filepath) pairs
+    in paths. Handlers having a setupPackages method get all packages in
+    one call."""
+    link = cached.link
+    for handler in cached.package_handlers():
+        handler_object = link.System.PackageHandler[handler]
+        if handler not in cached.unbatched:
+            try:
+                handler_object.setupPackages(
+                    [metapath for metapath, filepath in paths],
+                    [filepath for metapath, filepath in paths],
+                    timeout=ctx.dbus_timeout)
+                continue
+            except dbus.DBusException as exception:
+                if not is_method_missing(exception):
+                    raise Error(_("Script error: %s") % exception)
+                cached.unbatched.add(handler)
+
+        for metapath, filepath in paths:
+            try:
+                handler_object.setupPackage(
+                    metapath,
+                    filepath,
+                    timeout=ctx.dbus_timeout)
+            except dbus.DBusException as exception:
+                # Do nothing if setupPackage method is not defined
+                # in package script
+                if not is_method_missing(exception):
+                    raise Error(_("Script error: %s") % exception)
+                break
+
+
+def run_post_install(links, key, package_name, fromVersion, fromRelease,
+                     toVersion, toRelease):
+    """Run package's post install script, return its duration. The dbus
+    proxies of a link are not thread safe, so each worker thread calls
+    the script over its own link kept in links, a threading.local."""
+    link = getattr(links, "link", None)
+    if link is None:
+        link = links.link = connect(*key)
+    start = time.time()
+    try:
+        link.System.Package[package_name].postInstall(
+            fromVersion or "", fromRelease or "", toVersion, toRelease,
+            timeout=ctx.dbus_timeout)
+    except dbus.DBusException as exception:
+        # Do nothing if postInstall method is not defined in package script
+        if not is_method_missing(exception):
+            raise Error(_("Script error: %s") % exception)
+    return time.time() - start
+
+
+def script_levels(names, deps):
+    """Group names so that the packages of a group depend only on the
+    packages of the previous groups. deps is a dictionary of the names
+    each package depends on."""
+    levels = {}
+
+    def level(name, visiting):
+        if name not in levels:
+            visiting.add(name)
+            levels[name] = 1 + max([level(dep, visiting) for dep in deps.get(name, ())
+                                    if dep in names and dep not in visiting] or [-1])
+            visiting.discard(name)
+        return levels[name]
+
+    groups = []
+    for name in names:
+        index = level(name, set())
+        while len(groups) <= index:
+            groups.append([])
+        groups[index].append(name)
+    return groups
+
+
+def post_install_packages(packages, deps=None, notify=None):
+    """Do the post install operations of many packages. packages is a list
+    of the argument tuples of post_install. The package handlers are
+    called once for all packages and the post install scripts of packages
+    not depending on each other are run concurrently. notify is called
+    with pisi.ui.configuring and pisi.ui.configured and the package name
+    around the configuration of each package."""
+
+    if any(safe_script_name(args[0]) == 'comar' for args in packages):
+        ctx.ui.debug(_("COMAR package updated. From now on,"
+                       " using new COMAR daemon."))
+        pisi.api.set_comar_updated(True)
+
+    if notify is None:
+        notify = lambda event, package_name: None
+
+    cached = get_cached_link()
+
+    scripts = {}
+    for (package_name, provided_scripts, scriptpath, metapath, filepath,
+            fromVersion, fromRelease, toVersion, toRelease) in packages:
+        notify(pisi.ui.configuring, package_name)
+        ctx.ui.info(_("Configuring %s package") % package_name)
+        name = safe_script_name(package_name)
+        if register_scripts(cached, name, provided_scripts, scriptpath):
+            scripts[package_name] = (name, fromVersion, fromRelease, toVersion, toRelease)
 
     ctx.ui.debug(_("Calling post install handlers"))
-    for handler in link.System.PackageHandler:
-        try:
-            link.System.PackageHandler[handler].setupPackage(
-                metapath,
-                filepath,
-                timeout=ctx.dbus_timeout)
-        except dbus.DBusException as exception:
-            # Do nothing if setupPackage method is not defined
-            # in package script
-            if not is_method_missing(exception):
-                raise Error(_("Script error: %s") % exception)
+    setup_packages(cached, [(args[3], args[4]) for args in packages])
+
+    for args in packages:
+        if args[0] not in scripts:
+            notify(pisi.ui.configured, args[0])
+
+    if not scripts:
+        return
+
+    ctx.ui.debug(_("Running packages' post install scripts"))
+    names = [args[0] for args in packages if args[0] in scripts]
+    links = threading.local()
+    with concurrent.futures.ThreadPoolExecutor(min(script_jobs, len(names))) as executor:
+        for group in script_levels(names, deps or {}):
+            jobs = [(name, executor.submit(run_post_install, links, cached.key,
+                                           *scripts[name]))
+                    for name in group]
+            # Scripts depending on a failed one are not run
+            errors = []
+            for name, job in jobs:
+                try:
+                    duration = job.result()
+                except Error as error:
+                    errors.append(error)
+                    continue
+                ctx.ui.info(_("Post install script of %s finished in %.2f seconds")
+                            % (name, duration))
+                notify(pisi.ui.configured, name)
+            if errors:
+                raise errors[0]
 
-    if self_post:
-        if not fromVersion:
-            fromVersion = ""
-        if not fromRelease:
-            fromRelease = ""
 
-        ctx.ui.debug(_("Running package's post install script"))
-        try:
-            link.System.Package[package_name].postInstall(
-                fromVersion, fromRelease, toVersion, toRelease,
-                timeout=ctx.dbus_timeout)
-        except dbus.DBusException as exception:
-            # Do nothing if postInstall method is not defined in package script
-            if not is_method_missing(exception):
-                raise Error(_("Script error: %s") % exception)
+def post_install(package_name, provided_scripts,
+                 scriptpath, metapath, filepath,
+                 fromVersion, fromRelease, toVersion, toRelease):
+    """Do package's post install operations"""
+    post_install_packages([(package_name, provided_scripts, scriptpath, metapath, filepath,
+                            fromVersion, fromRelease, toVersion, toRelease)])
 
 
 def pre_remove(package_name, metapath, filepath):
     """Do package's pre removal operations"""
 
     ctx.ui.info(_("Running pre removal operations for %s") % package_name)
-    link = get_link()
+    cached = get_cached_link()
+    link = cached.link
 
     package_name = safe_script_name(package_name)
 
@@ -177,7 +322,7 @@ def pre_remove(package_name, metapath, filepath):
                 raise Error(_("Script error: %s") % exception)
 
     ctx.ui.debug(_("Calling pre remove handlers"))
-    for handler in list(link.System.PackageHandler):
+    for handler in cached.package_handlers():
         try:
             link.System.PackageHandler[handler].cleanupPackage(
                 metapath, filepath, timeout=ctx.dbus_timeout)
@@ -192,7 +337,8 @@ def post_remove(package_name, metapath, filepath, provided_scripts=[]):
     """Do package's post removal operations"""
 
     ctx.ui.info(_("Running post removal operations for %s") % package_name)
-    link = get_link()
+    cached = get_cached_link()
+    link = cached.link
 
     package_name = safe_script_name(package_name)
     scripts = set([safe_script_name(s.name) for s in provided_scripts if s.name])
@@ -209,7 +355,7 @@ def post_remove(package_name, metapath, filepath, provided_scripts=[]):
                 raise Error(_("Script error: %s") % exception)
 
     ctx.ui.debug(_("Calling post remove handlers"))
-    for handler in list(link.System.PackageHandler):
+    for handler in cached.package_handlers():
         try:
             link.System.PackageHandler[handler].postCleanupPackage(
                 metapath, filepath, timeout=ctx.dbus_timeout)
@@ -220,6 +366,8 @@ def post_remove(package_name, metapath, filepath, provided_scripts=[]):
                 raise Error(_("Script error: %s") % exception)
 
     ctx.ui.debug(_("Unregistering comar scripts"))
+    # The package may have provided a package handler
+    cached.handlers = None
     for scr in scripts:
         try:
             link.remove(scr, timeout=ctx.dbus_timeout)
@@ -124,6 +124,12 @@ class Config(object):
     def cached_packages_dir(self):
         return self.subdir(self.values.dirs.cached_packages_dir)
 
+    def build_cache_dir(self):
+        return self.subdir(self.values.dirs.build_cache_dir)
+
+    def source_cache_dir(self):
+        return self.subdir(self.values.dirs.source_cache_dir)
+
     def compiled_packages_dir(self):
         return self.subdir(self.values.dirs.compiled_packages_dir)
 
@@ -21,6 +21,7 @@
 #destinationdirectory = /
 #autoclean = False
 #bandwidth_limit = 0
+#download_segments = 4
 #
 #[build]
 #host = i686-pc-linux-gnu
@@ -32,6 +33,13 @@
 #LDFLAGS= -Wl,-O1 -Wl,-z,relro -Wl,--hash-style=gnu -Wl,--as-needed -Wl,--sort-common
 #buildhelper = None / ccache / icecream
 #compressionlevel = 1
+#compressionthreads = 0
+#stripjobs = 0
+#buildcache = False
+#buildcachelimit = 4096
+#sourcecache = False
+#emergejobs = 1
+#emergeload = 0
 #fallback = "ftp://ftp.pardus.org.tr/pub/source/2009"
 #
 #[directories]
@@ -40,6 +48,8 @@
 #history_dir = /var/lib/pisi/history
 #archives_dir = /var/cache/pisi/archives
 #cached_packages_dir = /var/cache/pisi/packages
+#build_cache_dir = /var/cache/pisi/build
+#source_cache_dir = /var/cache/pisi/sources
 #compiled_packages_dir = "/var/cache/pisi/packages"
 #index_dir = /var/cache/pisi/index
 #packages_dir = /var/cache/pisi/package
@@ -75,8 +85,10 @@ class GeneralDefaults:
     package_cache = False
     package_cache_limit = 0
     bandwidth_limit = 0
+    download_segments = 4
     ignore_safety = False
     ignore_delta = False
+    stream_install = False
 
 class BuildDefaults:
     """Default values for [build] section"""
@@ -90,6 +102,13 @@ class BuildDefaults:
     ldflags = "-Wl,-O1 -Wl,-z,relro -Wl,--hash-style=gnu -Wl,--as-needed -Wl,--sort-common"
     buildhelper = None
     compressionlevel = 1
+    compressionthreads = 0
+    stripjobs = 0
+    buildcache = False
+    buildcachelimit = 4096
+    sourcecache = False
+    emergejobs = 1
+    emergeload = 0
     fallback = "ftp://ftp.pardus.org.tr/pub/source/2009"
     ignored_build_types = ""
 
@@ -102,6 +121,8 @@ class DirectoriesDefaults:
     archives_dir = "/var/cache/pisi/archives"
     cache_root_dir = "/var/cache/pisi"
     cached_packages_dir = "/var/cache/pisi/packages"
+    build_cache_dir = "/var/cache/pisi/build"
+    source_cache_dir = "/var/cache/pisi/sources"
     compiled_packages_dir = "/var/cache/pisi/packages"
     debug_packages_dir = "/var/cache/pisi/packages-debug"
     old_paths_cache_dir = "/var/cache/pisi/old-paths"
@@ -80,9 +80,15 @@ class Constants(metaclass=Singleton):  # __metaclass__ kullanımı yerine metacl
         self.__c.translations_file = "translations.xml"
         self.__c.comar_dir = "comar"
         self.__c.files_xml = "files.xml"
+        self.__c.patches_xml = "patches.xml"
+        self.__c.patches_dir = "patches"
         self.__c.metadata_xml = "metadata.xml"
         self.__c.install_tar = "install.tar"
         self.__c.mirrors_conf = "/etc/pisi/mirrors.conf"
+        self.__c.mirror_stats = "mirror-stats.cache"
+        self.__c.hash_cache = "sha1sums.cache"
+        self.__c.daemon_socket = "pisi-daemon.sock"
+        self.__c.history_index = "history.db"
         self.__c.sandbox_conf = "/etc/pisi/sandbox.conf"
         self.__c.blacklist = "/etc/pisi/blacklist"
         self.__c.config_pending = "configpending"
@@ -98,6 +104,7 @@ class Constants(metaclass=Singleton):  # __metaclass__ kullanımı yerine metacl
         self.__c.devels_component = "programming.devel"
         self.__c.docs_component = "programming.docs"
         self.__c.installed_extra = "installedextra"
+        self.__c.index_cache = ".pisi-index.cache"
 
         # file/directory permissions
         self.__c.umask = 0o022  # 0o ile oktal gösterim
@@ -43,6 +43,7 @@ stderr = None
 
 comar = True
 comar_updated = False
+comar_link = None  # COMAR link of the running operation
 dbus_sockname = None
 dbus_timeout = 60 * 60  # In seconds
 
@@ -67,3 +68,6 @@ def keyboard_interrupt_pending():
     return sig and sig.signal_pending(signal.SIGINT)
 
 filesdb = None
+
+# Connection to the pisi daemon answering read-only queries
+daemon = None
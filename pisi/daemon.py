@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Local daemon serving read-only pisi.api queries over a Unix socket.
+
+The daemon keeps the databases initialized between queries. They are
+invalidated when another pisi process changes the installed packages or
+the repositories: the locked API operations notify the daemon, and the
+daemon also checks the modification times of the database directories
+before each query.
+
+Each message is a 4 byte big endian length followed by a compact JSON
+document. A request is {"call": name, "args": [...], "kw": {...}, "lang":
+language} and the reply is {"result": value, "messages": [...]} or
+{"error": message, "type": class, "args": [...], "messages": [...]}.
+Queries with a lang argument which is not given use the language of the
+client. The messages are the ones the query sent to the user interface,
+replayed by the client, and errors are raised again with their class
+when it is found in pisi. Tuples and sets in the results become lists.
+
+The databases can only be invalidated by root or the user running the
+daemon, the socket is writable by every user."""
+
+import os
+import json
+import time
+import socket
+import struct
+import inspect
+import importlib
+import threading
+import socketserver
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+import pisi.errors
+import pisi.context as ctx
+import pisi.pxml.autoxml as autoxml
+
+class Error(pisi.Error):
+    pass
+
+class RemoteError(Error):
+    pass
+
+class ConnectionError(Error):
+    pass
+
+# API functions answered by the daemon
+QUERIES = ("list_pending", "list_installed", "list_obsoleted", "list_replaces",
+           "list_available", "list_sources", "list_newest", "list_upgradable",
+           "list_repos", "search_package", "search_installed", "search_source",
+           "search_component", "search_file", "get_install_order",
+           "get_remove_order", "get_upgrade_order", "get_base_upgrade_order")
+
+HEADER = struct.Struct(">I")
+MAX_MESSAGE = 64 * 1024 * 1024
+
+def encode(obj):
+    data = json.dumps(obj, separators=(",", ":"), ensure_ascii=False,
+                      default=lambda o: sorted(o) if isinstance(o, (set, frozenset)) else str(o))
+    return data.encode("utf-8")
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+def send_message(sock, obj):
+    data = encode(obj)
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+def recv_message(sock):
+    """Return the next message from sock, or None at the end of stream"""
+    header = recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    size = HEADER.unpack(header)[0]
+    if size > MAX_MESSAGE:
+        raise Error(_("Message of %d bytes is too large") % size)
+    data = recv_exactly(sock, size)
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+def socket_path():
+    return os.path.join(ctx.config.lock_dir(), ctx.const.daemon_socket)
+
+def watched_paths():
+    """Return the directories whose changes invalidate the databases"""
+    paths = [ctx.config.packages_dir(), ctx.config.info_dir(),
+             ctx.config.history_dir(), ctx.config.index_dir()]
+    index_dir = ctx.config.index_dir()
+    if os.path.isdir(index_dir):
+        paths.extend(os.path.join(index_dir, repo) for repo in sorted(os.listdir(index_dir)))
+    return paths
+
+def signature(paths):
+    stamps = []
+    for path in paths:
+        try:
+            stamps.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+def peer_uid(sock):
+    """Return the user id of the process at the other end of the Unix
+    socket sock, None if it is not known"""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    pid, uid, gid = struct.unpack("3i", creds)
+    return uid
+
+def with_lang(func, args, kw, lang):
+    """Return the arguments of func with lang as its lang argument, if it
+    has one which is not given"""
+    sig = inspect.signature(func)
+    if "lang" not in sig.parameters:
+        return args, kw
+    try:
+        bound = sig.bind_partial(*args, **kw)
+    except TypeError:
+        return args, kw
+    if bound.arguments.get("lang") is None:
+        bound.arguments["lang"] = lang
+    return bound.args, bound.kwargs
+
+def error_reply(e):
+    cls = e.__class__
+    return {"error": str(e) or cls.__name__,
+            "type": "%s.%s" % (cls.__module__, cls.__name__),
+            "args": list(e.args)}
+
+def remote_exception(reply):
+    """Return the exception of an error reply, of the same class as on
+    the server if it is a pisi or built-in exception"""
+    module, dot, name = reply.get("type", "").rpartition(".")
+    cls = None
+    if module in ("builtins", "pisi") or module.startswith("pisi."):
+        try:
+            cls = getattr(importlib.import_module(module), name)
+        except (ImportError, AttributeError):
+            pass
+
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        try:
+            return cls(*reply.get("args", []))
+        except Exception:
+            pass
+    return RemoteError(reply["error"])
+
+class MessageRecorder(object):
+    """User interface recording the messages of a query for the client,
+    other calls go to the user interface of the daemon"""
+
+    def __init__(self, ui):
+        self.ui = ui
+        self.messages = []
+
+    def __getattr__(self, name):
+        return getattr(self.ui, name)
+
+    def info(self, msg, verbose=False, noln=False):
+        self.messages.append(("info", msg, {"verbose": verbose, "noln": noln}))
+
+    def warning(self, msg):
+        self.messages.append(("warning", msg, {}))
+
+    def error(self, msg):
+        self.messages.append(("error", msg, {}))
+
+def replay(messages):
+    for kind, msg, kw in messages:
+        getattr(ctx.ui, kind)(msg, **kw)
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        uid = peer_uid(self.connection)
+        while True:
+            try:
+                request = recv_message(self.connection)
+            except (Error, ValueError) as e:
+                send_message(self.connection, error_reply(e))
+                return
+            if request is None:
+                return
+            send_message(self.connection, self.server.dispatch(request, uid))
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves the queries of the clients. The queries run one at a time,
+    the database objects are not thread safe."""
+
+    daemon_threads = True
+
+    def __init__(self, path, watch=None):
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+        os.chmod(path, 0o666)
+
+        import pisi.api
+        self.queries = dict((name, getattr(pisi.api, name).__wrapped__) for name in QUERIES)
+        self.watch = watch if watch is not None else watched_paths
+        self.lock = threading.Lock()
+        self.signature = signature(self.watch())
+
+    def invalidate(self):
+        import pisi.db
+        pisi.db.invalidate_caches()
+
+    def check_changes(self):
+        current = signature(self.watch())
+        if current != self.signature:
+            ctx.ui.debug(_("Databases changed, invalidating"))
+            self.signature = current
+            self.invalidate()
+
+    def dispatch(self, request, uid=None):
+        """Answer request of a client running as uid, None for the
+        daemon itself"""
+        name = request.get("call")
+        with self.lock:
+            if name == "invalidate":
+                if uid not in (None, 0, os.getuid()):
+                    return error_reply(pisi.errors.PrivilegeError(
+                        _("Only root can invalidate the databases of the pisi daemon")))
+                self.signature = signature(self.watch())
+                self.invalidate()
+                return {"result": None}
+
+            if name not in self.queries:
+                return {"error": _("Unknown query: %s") % name}
+
+            self.check_changes()
+            func = self.queries[name]
+            args = request.get("args", [])
+            kw = request.get("kw", {})
+            if request.get("lang"):
+                args, kw = with_lang(func, args, kw, request["lang"])
+
+            ui = ctx.ui
+            recorder = ctx.ui = MessageRecorder(ui)
+            start = time.time()
+            try:
+                reply = {"result": func(*args, **kw)}
+            except Exception as e:
+                reply = error_reply(e)
+            finally:
+                ctx.ui = ui
+            reply["messages"] = recorder.messages
+            ctx.ui.debug("%s answered in %.4f seconds" % (name, time.time() - start))
+            return reply
+
+    def warm(self):
+        """Initialize the databases before the first query"""
+        for name in ("list_installed", "list_available", "list_sources"):
+            self.dispatch({"call": name})
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class Client(object):
+    """Connection to the daemon. Queries are sent over one connection,
+    which is opened on the first call."""
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except (socket.error, OSError) as e:
+            sock.close()
+            raise ConnectionError(_("Cannot connect to pisi daemon: %s") % e)
+        self.sock = sock
+
+    def call(self, name, args=(), kw=None):
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self.connect()
+                send_message(self.sock, {"call": name, "args": list(args), "kw": kw or {},
+                                         "lang": autoxml.LocalText.get_lang()})
+                reply = recv_message(self.sock)
+            except (socket.error, OSError) as e:
+                self.close()
+                raise ConnectionError(_("Connection to pisi daemon failed: %s") % e)
+
+        if reply is None:
+            self.close()
+            raise ConnectionError(_("Connection to pisi daemon closed"))
+        replay(reply.get("messages", []))
+        if "error" in reply:
+            raise remote_exception(reply)
+        return reply["result"]
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+def connect():
+    """Return a client of the running daemon, or None"""
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+    client = Client(path)
+    try:
+        client.connect()
+    except ConnectionError as e:
+        ctx.ui.debug(str(e))
+        return None
+    return client
+
+def notify():
+    """Tell the running daemon that the databases have changed"""
+    path = socket_path()
+    if not os.path.exists(path):
+        return
+    client = Client(path, timeout=5)
+    try:
+        client.call("invalidate")
+    except Error as e:
+        ctx.ui.debug(str(e))
+    finally:
+        client.close()
+
+def serve(path=None):
+    server = Server(path or socket_path())
+    try:
+        server.warm()
+        ctx.ui.info(_("Serving queries on %s") % server.path)
+        server.serve_forever()
+    finally:
+        server.server_close()
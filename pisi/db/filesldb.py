@@ -57,6 +57,17 @@ class FilesLDB():
         pkg = self.filesdb.get(hashlib.md5(path.encode('utf-8')).digest())
         return pkg, path
 
+    def get_packages(self, paths):
+        """Return a dictionary of the packages owning the given paths. All
+        paths are looked up in the same snapshot of the database."""
+        owners = {}
+        with self.filesdb.snapshot() as snapshot:
+            for path in paths:
+                pkg = snapshot.get(hashlib.md5(path.encode('utf-8')).digest())
+                if pkg:
+                    owners[path] = pkg.decode('utf-8')
+        return owners
+
     def search_file(self, term):
         pkg, path = self.get_file(term)
         if pkg:
@@ -77,8 +88,9 @@ class FilesLDB():
             self.filesdb.put(hashlib.md5(f.path.encode('utf-8')).digest(), pkg.encode('utf-8'))  # Python 3'te string'leri encode et
 
     def remove_files(self, files):
-        for f in files:
-            self.filesdb.delete(hashlib.md5(f.path.encode('utf-8')).digest())
+        with self.filesdb.write_batch() as batch:
+            for f in files:
+                batch.delete(hashlib.md5(f.path.encode('utf-8')).digest())
 
     def destroy(self):
         ctx.ui.info(pisi.util.colorize(_('Cleaning files database folder... '), 'green'), noln=True)
@@ -14,18 +14,15 @@ import os
 import pisi.context as ctx
 import pisi.db.lazydb as lazydb
 import pisi.history
+import pisi.db.historyindex
 
 class HistoryDB(lazydb.LazyDB):
 
     def init(self):
-        self.__logs = self.__generate_history()
         self.history = pisi.history.History()
-
-    def __generate_history(self):
-        logs = [x for x in os.listdir(ctx.config.history_dir()) if x.endswith(".xml")]  # Liste oluşturma
-        logs.sort(key=lambda x: int(x.split("_")[0]))  # Sıralama
-        logs.reverse()  # Ters çevirme
-        return logs
+        self.index = pisi.db.historyindex.HistoryIndex()
+        if not self.index.is_imported():
+            self.index.import_xml(ctx.config.history_dir())
 
     def create_history(self, operation):
         self.history.create(operation)
@@ -60,12 +57,7 @@ class HistoryDB(lazydb.LazyDB):
         self.history.update()
 
     def get_operation(self, operation):
-        for log in self.__logs:
-            if log.startswith(f"{operation:03d}_"):
-                hist = pisi.history.History(os.path.join(ctx.config.history_dir(), log))
-                hist.operation.no = int(log.split("_")[0])
-                return hist.operation
-        return None
+        return self.index.get(operation)
 
     def get_package_config_files(self, operation, package):
         package_path = os.path.join(ctx.config.history_dir(), f"{operation:03d}", package)
@@ -92,32 +84,30 @@ class HistoryDB(lazydb.LazyDB):
         return allconfigs
 
     def get_till_operation(self, operation):
-        if not any(log.startswith(f"{operation:03d}_") for log in self.__logs):
+        if self.index.get(operation) is None:
             return
 
-        for log in self.__logs:
-            if log.startswith(f"{operation:03d}_"):
-                return
-
-            hist = pisi.history.History(os.path.join(ctx.config.history_dir(), log))
-            hist.operation.no = int(log.split("_")[0])
-            yield hist.operation
+        for op in self.index.operations("no > ?", (operation,)):
+            yield op
 
     def get_last(self, count=0):
-        count = count or len(self.__logs)
-        for log in self.__logs[:count]:
-            hist = pisi.history.History(os.path.join(ctx.config.history_dir(), log))
-            hist.operation.no = int(log.split("_")[0])
-            yield hist.operation
+        for op in self.index.operations(limit=count):
+            yield op
+
+    def search_operations(self, package=None, otype=None, since=None, until=None, count=0):
+        """Return the operations of package, of type otype and in the date
+        range since-until (yyyy-mm-dd), newest first"""
+        return self.index.search(package, otype, since, until, count)
 
     def get_last_repo_update(self, last=1):
-        repoupdates = [l for l in self.__logs if l.endswith("repoupdate.xml")]
-        repoupdates.reverse()
+        repoupdates = self.index.repo_update_dates()
         if len(repoupdates) < 2:
             return None
 
         if last != 1 and len(repoupdates) <= last:
             return None
 
-        hist = pisi.history.History(os.path.join(ctx.config.history_dir(), repoupdates[-last]))
-        return hist.operation.date
+        return repoupdates[-last]
+
+    def reindex(self):
+        self.index.reindex(ctx.config.history_dir())
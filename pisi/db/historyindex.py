@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""SQLite index of the operation history.
+
+The NNN_operation.xml files in the history directory stay the primary
+record. Every operation written by History.update is also added to the
+index, so queries by operation number, date, package name and type do not
+parse the XML files. Existing history is imported once, when the index is
+created."""
+
+import os
+import sqlite3
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+import pisi.context as ctx
+import pisi.history
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    no INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS operations_date ON operations (date);
+CREATE INDEX IF NOT EXISTS operations_type ON operations (type);
+CREATE TABLE IF NOT EXISTS packages (
+    no INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    type TEXT,
+    before_version TEXT,
+    before_release TEXT,
+    after_version TEXT,
+    after_release TEXT,
+    PRIMARY KEY (no, seq)
+);
+CREATE INDEX IF NOT EXISTS packages_name ON packages (name);
+CREATE TABLE IF NOT EXISTS repos (
+    no INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    operation TEXT,
+    PRIMARY KEY (no, seq)
+);
+"""
+
+def history_files(history_dir):
+    """Return a dictionary of the operation numbers and the operation files
+    in history_dir"""
+    files = {}
+    for name in os.listdir(history_dir):
+        if name.endswith(".xml"):
+            try:
+                files[int(name.split("_")[0])] = name
+            except ValueError:
+                continue
+    return files
+
+def package_info(version, release):
+    if version is None:
+        return None
+    info = pisi.history.PackageInfo()
+    info.version = version
+    info.release = release
+    return info
+
+class HistoryIndex(object):
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(ctx.config.history_dir(), ctx.const.history_index)
+        self.db = self.connect()
+
+    def connect(self):
+        try:
+            db = sqlite3.connect(self.path)
+            if db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                db.executescript(SCHEMA)
+            return db
+        except sqlite3.Error as e:
+            # Users without write access to the history directory
+            # query a temporary index
+            ctx.ui.debug(_("Cannot open history index %s: %s") % (self.path, e))
+            db = sqlite3.connect(":memory:")
+            db.executescript(SCHEMA)
+            return db
+
+    def close(self):
+        self.db.close()
+
+    def is_imported(self):
+        return self.db.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION
+
+    def add(self, no, operation):
+        """Add or replace operation no, a pisi.history.Operation object"""
+        with self.db:
+            self.__add(no, operation)
+
+    def __add(self, no, operation):
+        self.db.execute("DELETE FROM packages WHERE no = ?", (no,))
+        self.db.execute("DELETE FROM repos WHERE no = ?", (no,))
+        self.db.execute("INSERT OR REPLACE INTO operations VALUES (?, ?, ?, ?)",
+                        (no, operation.type, operation.date, operation.time))
+
+        rows = []
+        for seq, package in enumerate(operation.packages):
+            before = package.before
+            after = package.after
+            rows.append((no, seq, package.name, package.operation, package.type,
+                         before and before.version, before and before.release,
+                         after and after.version, after and after.release))
+        self.db.executemany("INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+        self.db.executemany("INSERT INTO repos VALUES (?, ?, ?, ?, ?)",
+                            [(no, seq, repo.name, repo.uri, repo.operation)
+                             for seq, repo in enumerate(operation.repos)])
+
+    def import_xml(self, history_dir=None):
+        """Add the operations in history_dir which are not in the index"""
+        history_dir = history_dir or ctx.config.history_dir()
+        indexed = set(no for no, in self.db.execute("SELECT no FROM operations"))
+        files = history_files(history_dir) if os.path.isdir(history_dir) else {}
+
+        missing = sorted(set(files) - indexed)
+        if missing:
+            ctx.ui.info(_("Indexing %d history operations...") % len(missing))
+
+        with self.db:
+            for no in missing:
+                hist = pisi.history.History()
+                hist.read(os.path.join(history_dir, files[no]))
+                self.__add(no, hist.operation)
+            self.db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+    def reindex(self, history_dir=None):
+        with self.db:
+            for table in ("operations", "packages", "repos"):
+                self.db.execute("DELETE FROM %s" % table)
+        self.import_xml(history_dir)
+
+    def operations(self, where="", params=(), limit=None):
+        """Return the operations matching the where clause, newest first"""
+        sql = "SELECT no, type, date, time FROM operations"
+        if where:
+            sql += " WHERE " + where
+        sql += " ORDER BY no DESC"
+        if limit:
+            sql += " LIMIT %d" % limit
+
+        operations = []
+        by_no = {}
+        for no, otype, date, time in self.db.execute(sql, params):
+            operation = pisi.history.Operation()
+            operation.no = no
+            operation.type = otype
+            operation.date = date
+            operation.time = time
+            operation.packages = []
+            operation.repos = []
+            operations.append(operation)
+            by_no[no] = operation
+
+        if not operations:
+            return operations
+
+        # The rows of all operations are read with one query per table
+        low, high = operations[-1].no, operations[0].no
+        for row in self.db.execute("SELECT no, name, operation, type, before_version, "
+                                   "before_release, after_version, after_release "
+                                   "FROM packages WHERE no BETWEEN ? AND ? ORDER BY no, seq",
+                                   (low, high)):
+            operation = by_no.get(row[0])
+            if operation is None:
+                continue
+            package = pisi.history.Package()
+            package.name = row[1]
+            package.operation = row[2]
+            package.type = row[3]
+            package.before = package_info(row[4], row[5])
+            package.after = package_info(row[6], row[7])
+            operation.packages.append(package)
+
+        for no, name, uri, roperation in self.db.execute(
+                "SELECT no, name, uri, operation FROM repos "
+                "WHERE no BETWEEN ? AND ? ORDER BY no, seq", (low, high)):
+            operation = by_no.get(no)
+            if operation is None:
+                continue
+            repo = pisi.history.Repo()
+            repo.name = name
+            repo.uri = uri
+            repo.operation = roperation
+            operation.repos.append(repo)
+
+        return operations
+
+    def get(self, no):
+        operations = self.operations("no = ?", (no,))
+        return operations[0] if operations else None
+
+    def search(self, package=None, otype=None, since=None, until=None, limit=None):
+        """Return the operations of the given package, type and date range
+        (yyyy-mm-dd, inclusive), newest first"""
+        clauses = []
+        params = []
+        if package:
+            clauses.append("no IN (SELECT no FROM packages WHERE name = ?)")
+            params.append(package)
+        if otype:
+            clauses.append("type = ?")
+            params.append(otype)
+        if since:
+            clauses.append("date >= ?")
+            params.append(since)
+        if until:
+            clauses.append("date <= ?")
+            params.append(until)
+        return self.operations(" AND ".join(clauses), params, limit)
+
+    def repo_update_dates(self):
+        """Return the dates of the repository updates, oldest first"""
+        return [date for date, in self.db.execute(
+            "SELECT date FROM operations WHERE type = 'repoupdate' ORDER BY no")]
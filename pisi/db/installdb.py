@@ -24,6 +24,8 @@ import pisi.dependency
 import pisi.files
 import pisi.util
 import pisi.db.lazydb as lazydb
+import pisi.db.versiontable as versiontable
+import pisi.db.tagindex as tagindex
 
 __trans = gettext.translation('pisi', fallback=True)
 _ = __trans.gettext
@@ -60,6 +62,8 @@ class InstallDB(lazydb.LazyDB):
 
     def init(self):
         self.installed_db = self.__generate_installed_pkgs()
+        self.version_table = versiontable.VersionTable()
+        self.tag_index = tagindex.TagIndex()
         self.rev_deps_db = self.__generate_revdeps()
         self.installed_extra = self.__generate_installed_extra()
 
@@ -101,6 +105,11 @@ class InstallDB(lazydb.LazyDB):
             del self.installed_db[package]
             return
 
+        # The metadata is parsed here once for the version table and
+        # the tag index too
+        self.version_table.add_package(package, pkg)
+        self.tag_index.add_package(package, pkg)
+
         deps = pkg.find('RuntimeDependencies')
         if deps is not None:
             for dep in deps.findall("Dependency"):
@@ -128,22 +137,10 @@ class InstallDB(lazydb.LazyDB):
         return package in self.installed_db
 
     def list_installed_with_build_host(self, build_host):
-        build_host_re = re.compile("<BuildHost>(.*?)</BuildHost>")
-        found = []
-        for name in self.list_installed():
-            xml_path = os.path.join(self.package_path(name), ctx.const.metadata_xml)
-            with open(xml_path) as xml_file:
-                xml = xml_file.read()
-                matched = build_host_re.search(xml)
-                if matched:
-                    if build_host != matched.groups()[0]:
-                        continue
-                elif build_host:
-                    continue
+        return sorted(self.tag_index.get("BuildHost", build_host or None))
 
-                found.append(name)
-
-        return found
+    def get_partof_packages(self, component):
+        return sorted(self.tag_index.get("PartOf", component))
 
     def __get_version(self, meta_doc):
         pkg = meta_doc.find("Package")
@@ -173,6 +170,11 @@ class InstallDB(lazydb.LazyDB):
         root = tree.getroot()
         return self.__get_version(root) + self.__get_distro_release(root)
 
+    def get_version_release(self, package):
+        """Return the version and release of the installed package without
+        reading its metadata"""
+        return tuple(self.installed_db[package].rsplit("-", 1))
+
     def get_version(self, package):
         metadata_xml = os.path.join(self.package_path(package), ctx.const.metadata_xml)
         tree = ET.parse(metadata_xml)
@@ -216,15 +218,7 @@ class InstallDB(lazydb.LazyDB):
         return found
 
     def get_isa_packages(self, isa):
-        risa = f'<IsA>{isa}</IsA>'
-        packages = []
-        for name in self.list_installed():
-            xml_path = os.path.join(self.package_path(name), ctx.const.metadata_xml)
-            with open(xml_path) as xml_file:
-                xml = xml_file.read()
-                if re.compile(risa).search(xml):
-                    packages.append(name)
-        return packages
+        return sorted(self.tag_index.get("IsA", isa))
 
     def get_info(self, package):
         files_xml = os.path.join(self.package_path(package), ctx.const.files_xml)
@@ -306,6 +300,8 @@ class InstallDB(lazydb.LazyDB):
     def remove_package(self, package_name):
         if package_name in self.installed_db:
             del self.installed_db[package_name]
+        self.version_table.remove(package_name)
+        self.tag_index.remove(package_name)
 
         # Cleanup revdep info
         for revdep_info in self.rev_deps_db.values():
@@ -25,6 +25,9 @@ import pisi.db
 import pisi.metadata
 import pisi.dependency
 import pisi.db.itembyrepo
+import pisi.db.versiontable
+import pisi.db.tagindex
+import pisi.replace
 import pisi.db.lazydb as lazydb
 
 def get_lang():
@@ -49,6 +52,8 @@ class PackageDB(lazydb.LazyDB):
         self.__revdeps = {}        # Reverse dependencies
         self.__obsoletes = {}      # Obsoletes
         self.__replaces = {}       # Replaces
+        self.__versions = {}       # Version tables
+        self.__tags = {}           # IsA, BuildHost and PartOf indexes
 
         repodb = pisi.db.repodb.RepoDB()
 
@@ -58,6 +63,10 @@ class PackageDB(lazydb.LazyDB):
             self.__revdeps[repo] = self.__generate_revdeps(doc)
             self.__obsoletes[repo] = self.__generate_obsoletes(doc)
             self.__replaces[repo] = self.__generate_replaces(doc)
+            self.__versions[repo] = self.__generate_versions(doc)
+            self.__tags[repo] = self.__generate_tags(doc)
+
+        self.__replacing_repos = self.__generate_replacing_repos(repodb.list_repos())
 
         self.pdb = pisi.db.itembyrepo.ItemByRepo(self.__package_nodes, compressed=True)
         self.rvdb = pisi.db.itembyrepo.ItemByRepo(self.__revdeps)
@@ -65,7 +74,44 @@ class PackageDB(lazydb.LazyDB):
         self.rpdb = pisi.db.itembyrepo.ItemByRepo(self.__replaces)
 
     def __generate_replaces(self, doc):
-        return [pkg.findtext("Name") for pkg in doc.findall("Package") if pkg.find("Replaces") is not None]
+        """Return a dictionary of the replaced package names and lists of
+        their (replacing package, Replace relation) tuples"""
+        replaces = {}
+        for pkg in doc.findall("Package"):
+            replaces_tag = pkg.find("Replaces")
+            if replaces_tag is None:
+                continue
+            name = pkg.findtext("Name")
+            for node in replaces_tag.findall("Package"):
+                relation = pisi.replace.parse_replace(node)
+                replaces.setdefault(relation.package, []).append((name, relation))
+        return replaces
+
+    def __generate_replacing_repos(self, repos):
+        """Return a dictionary of the replacing packages and the first
+        repository that has them"""
+        replacing = set()
+        for repo in repos:
+            for pairs in self.__replaces[repo].values():
+                replacing.update(pkg_name for pkg_name, relation in pairs)
+
+        first_repos = {}
+        for repo in repos:
+            for name in replacing.intersection(self.__package_nodes[repo]):
+                first_repos.setdefault(name, repo)
+        return first_repos
+
+    def __generate_versions(self, doc):
+        table = pisi.db.versiontable.VersionTable()
+        for pkg in doc.findall("Package"):
+            table.add_package(pkg.findtext("Name"), pkg)
+        return table
+
+    def __generate_tags(self, doc):
+        index = pisi.db.tagindex.TagIndex()
+        for pkg in doc.findall("Package"):
+            index.add_package(pkg.findtext("Name"), pkg)
+        return index
 
     def __generate_obsoletes(self, doc):
         distribution = doc.find("Distribution")
@@ -177,18 +223,21 @@ class PackageDB(lazydb.LazyDB):
     def get_obsoletes(self, repo=None):
         return self.odb.get_list_item(repo)
 
-    def get_isa_packages(self, isa):
-        repodb = pisi.db.repodb.RepoDB()
-
+    def __get_tag_packages(self, tag, value, repo=None):
         packages = set()
-        for repo in repodb.list_repos():
-            doc = repodb.get_repo_doc(repo)
-            for package in doc.tags("Package"):
-                if package.getTagData("IsA"):
-                    for node in package.tags("IsA"):
-                        if node.firstChild().data() == isa:
-                            packages.add(package.getTagData("Name"))
-        return list(packages)
+        for r in self.pdb.item_repos(repo):
+            if r in self.__tags:
+                packages.update(self.__tags[r].get(tag, value))
+        return sorted(packages)
+
+    def get_isa_packages(self, isa, repo=None):
+        return self.__get_tag_packages("IsA", isa, repo)
+
+    def get_partof_packages(self, component, repo=None):
+        return self.__get_tag_packages("PartOf", component, repo)
+
+    def get_build_host_packages(self, build_host, repo=None):
+        return self.__get_tag_packages("BuildHost", build_host or None, repo)
 
     def get_rev_deps(self, name, repo=None):
         try:
@@ -209,21 +258,35 @@ class PackageDB(lazydb.LazyDB):
 
     # replacesdb holds the info about the replaced packages (ex. gaim -> pidgin)
     def get_replaces(self, repo=None):
+        installdb = pisi.db.installdb.InstallDB()
         pairs = {}
 
-        for pkg_name in self.rpdb.get_list_item():
-            xml = self.pdb.get_item(pkg_name, repo)
-            package = ET.fromstring(xml.decode('utf-8'))
-            replaces_tag = package.find("Replaces")
-            if replaces_tag is not None:
-                for node in replaces_tag.findall("Package"):
-                    r = pisi.relation.Relation()
-                    r.decode(node, [])
-                    if pisi.replace.installed_package_replaced(r):
-                        pairs.setdefault(r.package, []).append(pkg_name)
+        for r in self.rpdb.item_repos(repo):
+            replaces = self.__replaces.get(r, {})
+            for name in filter(installdb.has_package, replaces):
+                for pkg_name, relation in replaces[name]:
+                    # The replacing package of the first repository is used
+                    if not repo and self.__replacing_repos.get(pkg_name) != r:
+                        continue
+                    if pkg_name in pairs.get(name, ()):
+                        continue
+                    if pisi.replace.installed_package_replaced(relation):
+                        pairs.setdefault(name, []).append(pkg_name)
 
         return pairs
 
+    def get_version_table(self, repo=None):
+        """Return the version table of repo, of all repositories in their
+        order if None"""
+        if repo:
+            return self.__versions[repo]
+
+        table = pisi.db.versiontable.VersionTable()
+        for repo in pisi.db.repodb.RepoDB().list_repos():
+            if repo in self.__versions:
+                table.update(self.__versions[repo])
+        return table
+
     def list_packages(self, repo):
         return self.pdb.get_item_keys(repo)
 
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Secondary indexes of the IsA, BuildHost and PartOf tags of packages.
+
+InstallDB and PackageDB fill them while parsing the package metadata and
+keep them in their caches, so the packages of a type, build host or
+component are found without reading any metadata."""
+
+TAGS = ("IsA", "BuildHost", "PartOf")
+
+
+def tag_values(node):
+    """Return the indexed tag values of the metadata.xml or repository
+    index Package element node"""
+    return {
+        "IsA": tuple(isa.text for isa in node.findall("IsA")),
+        "BuildHost": (node.findtext("BuildHost") or None,),
+        "PartOf": (node.findtext("PartOf") or None,),
+    }
+
+
+class TagIndex(object):
+
+    def __init__(self):
+        self.values = {}
+        self.index = dict((tag, {}) for tag in TAGS)
+
+    def add_package(self, name, node):
+        self.remove(name)
+        values = tag_values(node)
+        for tag, tag_items in values.items():
+            for value in tag_items:
+                self.index[tag].setdefault(value, set()).add(name)
+        self.values[name] = values
+
+    def remove(self, name):
+        values = self.values.pop(name, None)
+        if values is None:
+            return
+
+        for tag, tag_items in values.items():
+            for value in tag_items:
+                names = self.index[tag].get(value)
+                if names is not None:
+                    names.discard(name)
+                    if not names:
+                        del self.index[tag][value]
+
+    def get(self, tag, value):
+        """Return the names of the packages whose tag has value, None
+        meaning packages without the tag"""
+        return set(self.index[tag].get(value, ()))
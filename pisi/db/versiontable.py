@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Compact version tables of the installed and the available packages.
+
+A table has one row per package, stored in parallel columns: version,
+release, distribution, distribution release, install tar hash and the
+newest release of a security update. InstallDB and PackageDB fill their
+tables while they parse the package metadata for their other indexes and
+keep them in their caches, so upgrades are found by joining two tables
+instead of parsing the metadata of every installed package."""
+
+import pisi.version
+
+
+def release_number(release):
+    try:
+        return int(release)
+    except (TypeError, ValueError):
+        return 0
+
+
+def version_key(version):
+    if not version:
+        return None
+    try:
+        return pisi.version.make_version(version)
+    except Exception:
+        return None
+
+
+def package_row(node):
+    """Return the row of the metadata.xml or repository index Package
+    element node"""
+    version = release = None
+    security = 0
+    history = node.find("History")
+    if history is not None:
+        updates = history.findall("Update")
+        if updates:
+            version = updates[0].findtext("Version")
+            release = release_number(updates[0].get("release"))
+        for update in updates:
+            if update.get("type") == "security":
+                security = max(security, release_number(update.get("release")))
+
+    distro_release = node.findtext("DistributionRelease")
+    return (version, release, node.findtext("Distribution"), distro_release,
+            version_key(distro_release), node.findtext("InstallTarHash"), security)
+
+
+class VersionTable(object):
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+        self.versions = []
+        self.releases = []
+        self.distributions = []
+        self.distro_releases = []
+        self.distro_keys = []
+        self.hashes = []
+        self.security = []
+
+    def columns(self):
+        return (self.versions, self.releases, self.distributions, self.distro_releases,
+                self.distro_keys, self.hashes, self.security)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def add(self, name, row):
+        index = self.index.get(name)
+        if index is None:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+            for column, value in zip(self.columns(), row):
+                column.append(value)
+        else:
+            for column, value in zip(self.columns(), row):
+                column[index] = value
+
+    def add_package(self, name, node):
+        self.add(name, package_row(node))
+
+    def remove(self, name):
+        index = self.index.pop(name, None)
+        if index is None:
+            return
+
+        # The last row takes the place of the removed one
+        last = len(self.names) - 1
+        for column in (self.names,) + self.columns():
+            column[index] = column[last]
+            column.pop()
+        if index != last:
+            self.index[self.names[index]] = index
+
+    def row(self, name):
+        index = self.index[name]
+        return tuple(column[index] for column in self.columns())
+
+    def update(self, other):
+        """Add the rows of the packages of other which are not in this table"""
+        for name in other.names:
+            if name not in self.index:
+                self.add(name, other.row(name))
+
+
+def find_upgrades(installed, available, names=None, security_only=False,
+                  compare_sha1sum=False):
+    """Join the installed and available tables on the names of the
+    installed packages, all of them if names is None. Return the upgradable
+    packages, the ones of them with only a different install tar hash and
+    the ones already at the latest release."""
+    if names is None:
+        names = installed.names
+
+    i_index = installed.index
+    a_index = available.index
+    i_releases, i_distros, i_keys, i_hashes = \
+        installed.releases, installed.distributions, installed.distro_keys, installed.hashes
+    a_releases, a_distros, a_keys, a_hashes, a_security = \
+        available.releases, available.distributions, available.distro_keys, \
+        available.hashes, available.security
+
+    upgrades = []
+    different = []
+    latest = []
+    for name in names:
+        i = i_index.get(name)
+        a = a_index.get(name)
+        if i is None or a is None:
+            continue
+
+        release = i_releases[i]
+        if security_only and a_security[a] <= release:
+            continue
+
+        if a_distros[a] == i_distros[i] and a_keys[a] is not None and \
+                i_keys[i] is not None and a_keys[a] > i_keys[i]:
+            upgrades.append(name)
+        elif release < a_releases[a]:
+            upgrades.append(name)
+        elif compare_sha1sum and release == a_releases[a] and a_hashes[a] != i_hashes[i]:
+            upgrades.append(name)
+            different.append(name)
+        else:
+            latest.append(name)
+
+    return upgrades, different, latest
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Extraction engine for install archives.
+
+TarExtractor writes the members of a tar stream below a target directory
+with as few system calls per entry as possible: known directories are
+created once, file data is copied with large buffers, ownership, mode and
+times are set through the open file descriptor and every file or symlink
+is written to a temporary name and renamed over the old one, so running
+programs keep their old inode. Entries it cannot handle in this way (a
+directory replaced by a symlink, device nodes, path conflicts) are given
+to a fallback function."""
+
+import os
+import grp
+import pwd
+import errno
+import shutil
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+
+BUFFER_SIZE = 1024 * 1024
+TMP_PREFIX = ".pisi-new."
+
+# Errors of path conflicts between the archive and the target directory,
+# the fallback resolves them. Other errors (ENOSPC, EIO, ...) are raised.
+CONFLICT_ERRNOS = (errno.EISDIR, errno.ENOTEMPTY, errno.ENOTDIR, errno.EEXIST,
+                   errno.ELOOP)
+
+class Error(pisi.Error):
+    pass
+
+class Fallback(Exception):
+    """Raised internally for entries which need the fallback path"""
+    pass
+
+class TarExtractor(object):
+
+    def __init__(self, target_dir, same_permissions=True, same_owner=True,
+                 umask=0o022, fallback=None):
+        self.target_dir = os.path.abspath(target_dir)
+        self.same_permissions = same_permissions
+        self.same_owner = same_owner
+        self.umask = umask
+        self.fallback = fallback
+
+        self.uid = os.getuid()
+        self.gid = os.getgid()
+        self.is_root = os.geteuid() == 0
+
+        self.known_dirs = set([self.target_dir])
+        self.dir_entries = []
+        self.owners = {}
+
+        self.files = 0
+        self.bytes = 0
+        self.fallbacks = 0
+
+    def path(self, name):
+        name = os.path.normpath(name)
+        if name.startswith("/") or name == ".." or name.startswith("../"):
+            raise Error(_("Archive member %s is outside of the target directory") % name)
+        return os.path.join(self.target_dir, name)
+
+    def make_dirs(self, names):
+        """Create the directory skeleton for the given relative paths"""
+        for name in sorted(set(names)):
+            path = self.path(name)
+            if path in self.known_dirs:
+                continue
+            try:
+                os.makedirs(path, exist_ok=True)
+            except OSError:
+                # A file is in the way, leave it to the member handling
+                continue
+            self.add_known_dir(path)
+
+    def add_known_dir(self, path):
+        while path not in self.known_dirs:
+            self.known_dirs.add(path)
+            path = os.path.dirname(path)
+
+    def ensure_parent(self, path):
+        parent = os.path.dirname(path)
+        if parent in self.known_dirs:
+            return
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        self.add_known_dir(parent)
+
+    def owner(self, tarinfo):
+        if not self.same_owner:
+            return self.uid, self.gid
+        if not self.is_root:
+            return None
+
+        # Same lookup order as tarfile: names first, numeric ids otherwise
+        key = (tarinfo.uname, tarinfo.gname, tarinfo.uid, tarinfo.gid)
+        if key not in self.owners:
+            try:
+                uid = pwd.getpwnam(tarinfo.uname).pw_uid if tarinfo.uname else tarinfo.uid
+            except KeyError:
+                uid = tarinfo.uid
+            try:
+                gid = grp.getgrnam(tarinfo.gname).gr_gid if tarinfo.gname else tarinfo.gid
+            except KeyError:
+                gid = tarinfo.gid
+            self.owners[key] = (uid, gid)
+        return self.owners[key]
+
+    def mode(self, tarinfo):
+        if self.same_permissions:
+            return tarinfo.mode & 0o7777
+        return tarinfo.mode & 0o7777 & ~self.umask
+
+    def tmp_path(self, path):
+        head, tail = os.path.split(path)
+        return os.path.join(head, TMP_PREFIX + tail)
+
+    def replace(self, tmp, path):
+        try:
+            os.rename(tmp, path)
+        except OSError as e:
+            os.unlink(tmp)
+            if e.errno in CONFLICT_ERRNOS:
+                raise Fallback()
+            raise
+
+    def extract_file(self, tar, tarinfo, path):
+        tmp = self.tmp_path(path)
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+        except OSError as e:
+            if e.errno in (errno.ENOTDIR, errno.ENOENT, errno.ELOOP):
+                raise Fallback()
+            raise
+
+        try:
+            if tarinfo.issparse():
+                with os.fdopen(fd, "wb", closefd=False) as f:
+                    shutil.copyfileobj(tar.extractfile(tarinfo), f, BUFFER_SIZE)
+            else:
+                # Read straight from the archive stream, without the file
+                # object tarfile would create for every member
+                tar.fileobj.seek(tarinfo.offset_data)
+                left = tarinfo.size
+                while left:
+                    data = tar.fileobj.read(min(left, BUFFER_SIZE))
+                    if not data:
+                        raise Error(_("Unexpected end of archive in %s") % tarinfo.name)
+                    left -= len(data)
+                    view = memoryview(data)
+                    while view:
+                        view = view[os.write(fd, view):]
+            owner = self.owner(tarinfo)
+            if owner:
+                os.fchown(fd, *owner)
+            os.fchmod(fd, self.mode(tarinfo))
+            os.utime(fd, (tarinfo.mtime, tarinfo.mtime))
+        except:
+            os.close(fd)
+            os.unlink(tmp)
+            raise
+        os.close(fd)
+
+        self.replace(tmp, path)
+        self.bytes += tarinfo.size
+
+    def extract_symlink(self, tarinfo, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            # A directory becomes a symlink, needs content migration
+            raise Fallback()
+
+        tmp = self.tmp_path(path)
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.symlink(tarinfo.linkname, tmp)
+        owner = self.owner(tarinfo)
+        if owner:
+            os.lchown(tmp, *owner)
+        self.replace(tmp, path)
+
+    def extract_hardlink(self, tarinfo, path):
+        tmp = self.tmp_path(path)
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.link(self.path(tarinfo.linkname), tmp)
+        self.replace(tmp, path)
+
+    def extract_dir(self, tarinfo, path):
+        if os.path.islink(path) or os.path.lexists(path) and not os.path.isdir(path):
+            raise Fallback()
+        if path not in self.known_dirs:
+            try:
+                os.mkdir(path, 0o700)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            self.add_known_dir(path)
+
+        # Set modes of directories at the end, they may be read-only
+        self.dir_entries.append((path, tarinfo))
+
+    def extract(self, tar, tarinfo):
+        path = self.path(tarinfo.name)
+        self.files += 1
+        try:
+            if tarinfo.isdir():
+                self.extract_dir(tarinfo, path)
+                return
+
+            self.ensure_parent(path)
+            if tarinfo.isreg():
+                self.extract_file(tar, tarinfo, path)
+            elif tarinfo.issym():
+                self.extract_symlink(tarinfo, path)
+            elif tarinfo.islnk():
+                self.extract_hardlink(tarinfo, path)
+            else:
+                raise Fallback()
+        except OSError as e:
+            if not self.fallback or e.errno not in CONFLICT_ERRNOS:
+                raise
+            self.fallbacks += 1
+            self.fallback(tarinfo)
+        except Fallback:
+            if not self.fallback:
+                raise Error(_("Cannot extract %s") % tarinfo.name)
+            self.fallbacks += 1
+            self.fallback(tarinfo)
+
+    def finish(self):
+        """Set ownership, mode and times of the extracted directories"""
+        for path, tarinfo in sorted(self.dir_entries, reverse=True):
+            owner = self.owner(tarinfo)
+            if owner:
+                os.chown(path, *owner)
+            os.chmod(path, self.mode(tarinfo))
+            os.utime(path, (tarinfo.mtime, tarinfo.mtime))
+        self.dir_entries = []
+
+    def extract_all(self, tar, callback=None):
+        for tarinfo in tar:
+            if callback:
+                callback(tarinfo, extracted=False)
+            self.extract(tar, tarinfo)
+            if callback:
+                callback(tarinfo, extracted=True)
+        self.finish()
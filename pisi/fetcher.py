@@ -32,12 +32,27 @@ import pisi
 import pisi.util as util
 import pisi.context as ctx
 import pisi.uri
+import pisi.httpclient
+import pisi.mirrors
+
+# Keep-alive connections shared by all fetchers
+connection_pool = pisi.httpclient.ConnectionPool()
 
 
 class FetchError(pisi.Error):
     pass
 
 
+def http_proxies():
+    """Return the configured proxies of the http client by url scheme"""
+    proxies = {}
+    if ctx.config.values.general.http_proxy:
+        proxies["http"] = ctx.config.values.general.http_proxy
+    if ctx.config.values.general.https_proxy:
+        proxies["https"] = ctx.config.values.general.https_proxy
+    return proxies
+
+
 class UIHandler:
     def __init__(self, progress):
         self.filename = None
@@ -134,12 +149,6 @@ class Fetcher:
     def fetch(self):
         """Return value: Fetched file's full path.."""
 
-        # import urlgrabber module
-        try:
-            import urlgrabber
-        except ImportError:
-            raise FetchError(_('Urlgrabber needs to be installed to run this command'))
-
         if not self.url.filename():
             raise FetchError(_('Filename error'))
 
@@ -149,6 +158,76 @@ class Fetcher:
         if os.path.exists(self.archive_file) and not os.access(self.archive_file, os.W_OK):
             raise FetchError(_('Access denied to destination file: "%s"') % (self.archive_file))
 
+        if self.url.scheme() == "mirrors":
+            return self._fetch_from_mirrors()
+        elif self.url.scheme() in ("http", "https"):
+            self._fetch_http()
+        else:
+            self._fetch_urlgrabber()
+
+        if os.stat(self.partial_file).st_size == 0:
+            os.remove(self.partial_file)
+            raise FetchError(_('A problem occurred. Please check the archive address and/or permissions again.'))
+
+        shutil.move(self.partial_file, self.archive_file)
+
+        return self.archive_file
+
+    def _fetch_http(self):
+        handler = UIHandler(self.progress)
+        handler.start(self.partial_file, self.url.get_uri(),
+                      os.path.basename(self.partial_file), None, None)
+
+        def progress(size, total):
+            handler.total_size = total or 0
+            handler.update(size)
+
+        try:
+            self._http_client().download(self.url.get_uri(), self.partial_file, progress)
+        except (pisi.httpclient.Error, IOError) as e:
+            raise FetchError(_('Could not fetch destination file "%s": %s') % (self.url.get_uri(), e))
+
+    def _rank_mirrors(self):
+        name, path = pisi.mirrors.split_url(self.url.get_uri())
+        mirrors = pisi.mirrors.Mirrors().get_mirrors(name)
+        if not mirrors:
+            raise FetchError(_("%s mirrors are not defined.") % name)
+
+        stats = pisi.mirrors.MirrorStats()
+        ranked = pisi.mirrors.rank_mirrors(mirrors, path, self._http_client(), stats)
+        return name, stats, [(mirror, os.path.join(mirror, path)) for mirror in ranked]
+
+    def _fetch_from_mirrors(self):
+        name, stats, urls = self._rank_mirrors()
+        try:
+            for mirror, url in urls:
+                ctx.ui.info(_("Fetching from mirror: %s") % url)
+                fetcher = Fetcher(url, self.destdir, os.path.basename(self.archive_file))
+                fetcher.progress = self.progress
+
+                start = time.time()
+                try:
+                    fetcher.fetch()
+                except FetchError as e:
+                    ctx.ui.debug(str(e))
+                    stats.record(mirror, failed=True)
+                    continue
+
+                elapsed = max(time.time() - start, 0.001)
+                stats.record(mirror, throughput=os.path.getsize(self.archive_file) / elapsed)
+                return self.archive_file
+        finally:
+            stats.save()
+
+        raise FetchError(_('Could not fetch %s from %s mirrors.') % (self.url.filename(), name))
+
+    def _fetch_urlgrabber(self):
+        # import urlgrabber module
+        try:
+            import urlgrabber
+        except ImportError:
+            raise FetchError(_('Urlgrabber needs to be installed to run this command'))
+
         try:
             urlgrabber.urlgrab(self.url.get_uri(),
                                self.partial_file,
@@ -163,13 +242,51 @@ class Fetcher:
         except urlgrabber.grabber.URLGrabError as e:
             raise FetchError(_('Could not fetch destination file "%s": %s') % (self.url.get_uri(), e))
 
-        if os.stat(self.partial_file).st_size == 0:
-            os.remove(self.partial_file)
-            raise FetchError(_('A problem occurred. Please check the archive address and/or permissions again.'))
+    def open(self):
+        """Open the url for sequential reading and return the response
+        object. The length attribute of http responses is the file size,
+        if known."""
 
-        shutil.move(self.partial_file, self.archive_file)
+        if self.url.scheme() == "mirrors":
+            name, stats, urls = self._rank_mirrors()
+            try:
+                for mirror, url in urls:
+                    try:
+                        return Fetcher(url, self.destdir).open()
+                    except FetchError as e:
+                        ctx.ui.debug(str(e))
+                        stats.record(mirror, failed=True)
+            finally:
+                stats.save()
+            raise FetchError(_('Could not fetch %s from %s mirrors.') % (self.url.filename(), name))
+
+        if self.url.scheme() in ("http", "https"):
+            try:
+                return self._http_client().open(self.url.get_uri())
+            except pisi.httpclient.Error as e:
+                raise FetchError(_('Could not fetch destination file "%s": %s') % (self.url.get_uri(), e))
 
-        return self.archive_file
+        request = urllib.request.Request(self.url.get_uri())
+        request.add_header('User-Agent', 'PiSi Fetcher/' + pisi.__version__)
+        for header, value in self._get_http_headers():
+            request.add_header(header, value)
+
+        opener = urllib.request.build_opener(
+            urllib.request.ProxyHandler(self._get_proxies() or None))
+
+        try:
+            return opener.open(request)
+        except (urllib.error.URLError, IOError) as e:
+            raise FetchError(_('Could not fetch destination file "%s": %s') % (self.url.get_uri(), e))
+
+    def _http_client(self):
+        headers = [('User-Agent', 'PiSi Fetcher/' + pisi.__version__)]
+        headers.extend(self._get_http_headers())
+        return pisi.httpclient.HTTPClient(connection_pool,
+                                          headers=headers,
+                                          proxies=http_proxies(),
+                                          bandwidth_limit=self._get_bandwidth_limit(),
+                                          segments=int(ctx.config.values.general.download_segments or 1))
 
     def _get_http_headers(self):
         headers = []
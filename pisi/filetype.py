@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""File type detection from magic bytes.
+
+Only the types the build post-processing acts on are detected: ELF
+objects, ar archives, libtool libraries, Python byte code and Perl POD
+documents. The descriptions returned follow the output of file(1), so
+they can be matched the same way."""
+
+import os
+import struct
+
+ELF_MAGIC = b"\x7fELF"
+AR_MAGIC = b"!<arch>\n"
+LIBTOOL_MARK = b"libtool library file"
+PYC_SUFFIXES = (".pyc", ".pyo")
+POD_COMMANDS = (b"=pod", b"=head1", b"=head2", b"=head3", b"=head4",
+                b"=over", b"=item", b"=begin", b"=for", b"=encoding")
+
+# Bytes read from the start of a file
+HEADER_SIZE = 512
+
+ELF_CLASSES = {1: "32-bit", 2: "64-bit"}
+ELF_DATA = {1: ("LSB", "<"), 2: ("MSB", ">")}
+ELF_TYPES = {1: "relocatable", 2: "executable", 3: "shared object", 4: "core file"}
+
+def elf_type(header):
+    if len(header) < 18:
+        return "ELF"
+
+    elf_class = ELF_CLASSES.get(header[4], "invalid class")
+    order, fmt = ELF_DATA.get(header[5], ("invalid byte order", "<"))
+    e_type = struct.unpack(fmt + "H", header[16:18])[0]
+    return "ELF %s %s %s" % (elf_class, order, ELF_TYPES.get(e_type, "unknown type"))
+
+def is_pod(header):
+    for line in header.split(b"\n"):
+        if line.startswith(POD_COMMANDS):
+            return True
+        if line.strip():
+            return False
+    return False
+
+def detect(path):
+    """Return the description of the type of the file at path, or None
+    if it is not one of the detected types"""
+    if os.path.islink(path):
+        return "symbolic link to %s" % os.readlink(path)
+
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+    except (IOError, OSError):
+        return None
+
+    if header.startswith(ELF_MAGIC):
+        return elf_type(header)
+
+    if header.startswith(AR_MAGIC):
+        return "current ar archive"
+
+    if path.endswith(PYC_SUFFIXES) and header[2:4] == b"\r\n":
+        magic = struct.unpack("<H", header[:2])[0]
+        # Python 3 magic numbers start at 3000
+        return "python %s byte-compiled" % ("3" if 3000 <= magic < 20000 else "2")
+
+    first_line = header.split(b"\n", 1)[0]
+    if first_line.startswith(b"#") and LIBTOOL_MARK in first_line:
+        return "libtool library file, ASCII text"
+
+    if is_pod(header):
+        return "Perl POD document text"
+
+    return None
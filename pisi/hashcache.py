@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Persistent cache of verified SHA1 hashes of large files, such as
+source archives and cached packages, so that each of them is hashed at
+most once per modification.
+
+An entry is used only while the (dev, inode, size, mtime_ns, ctime_ns)
+identity of the file is unchanged. Rewriting a file in place changes its
+ctime even when its size and mtime are restored, replacing it changes
+the inode. Hashes of files modified shortly before they were hashed are
+not stored, a later change within the timestamp granularity would go
+unnoticed otherwise.
+
+New hashes are kept in memory and the cache is written once per
+operation, by save() at the end of the locked API calls and at exit."""
+
+import os
+import time
+import atexit
+import pickle
+import threading
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+import pisi.context as ctx
+
+# Files modified less than this many seconds before hashing started
+# are not cached
+RACY_TIME = 2
+
+def file_key(path):
+    st = os.stat(path)
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns
+
+class HashCache(object):
+
+    cache_version = "1"
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(ctx.config.cache_root_dir(), ctx.const.hash_cache)
+        self.entries = self.__load()
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def __load(self):
+        try:
+            with open(self.path, "rb") as f:
+                version, entries = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError,
+                AttributeError, ImportError, pickle.UnpicklingError):
+            return {}
+
+        if version != HashCache.cache_version:
+            return {}
+
+        return entries
+
+    def get(self, path, key):
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1]
+
+    def set(self, path, key, value, start):
+        """Store the hash of path computed from start on, if the file
+        has not changed since"""
+        try:
+            if file_key(path) != key:
+                return
+        except OSError:
+            return
+
+        if key[3] >= (start - RACY_TIME) * 1e9:
+            return
+
+        with self.lock:
+            self.entries[os.path.abspath(path)] = (key, value)
+            self.dirty = True
+
+    def save(self):
+        """Write the cache if it has new entries, dropping the entries of
+        removed files"""
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+
+            for path in list(self.entries):
+                if not os.path.exists(path):
+                    del self.entries[path]
+            entries = dict(self.entries)
+
+        tmp = "%s.%d%s" % (self.path, os.getpid(), ctx.const.temporary_suffix)
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump((HashCache.cache_version, entries), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            # Not writable for users, the cache still works in memory
+            ctx.ui.debug(_("Cannot write hash cache %s: %s") % (self.path, e))
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+_cache = None
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = HashCache()
+    return _cache
+
+@atexit.register
+def save():
+    """Write the new entries of the cache, if it has been used"""
+    if _cache is not None:
+        _cache.save()
+
+def sha1_file(path, hash_file):
+    """Return the SHA1 hash of path from the cache or by calling
+    hash_file(path) and caching its result"""
+    try:
+        key = file_key(path)
+    except OSError:
+        return hash_file(path)
+
+    cache = get_cache()
+    value = cache.get(path, key)
+    if value is None:
+        start = time.time()
+        value = hash_file(path)
+        cache.set(path, key, value, start)
+    return value
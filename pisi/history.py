@@ -143,6 +143,14 @@ class History(xmlfile.XmlFile):
     def update(self):
         self.write(os.path.join(ctx.config.history_dir(), self.histfile))
 
+        # pisi.db imports this module
+        import pisi.db.historyindex
+        index = pisi.db.historyindex.HistoryIndex()
+        try:
+            index.add(int(self.operation.no), self.operation)
+        finally:
+            index.close()
+
     def _get_latest(self):
 
         files = list(filter(lambda h: h.endswith(".xml"), os.listdir(ctx.config.history_dir())))
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""HTTP client with persistent connections.
+
+Connections are kept open after a response has been read completely and
+are reused for the next request to the same host, so fetching many small
+files does not pay for a TCP and TLS handshake each time. Downloads are
+resumed with Range and If-Range requests and large files can be fetched
+in several ranges over parallel connections."""
+
+import os
+import re
+import time
+import socket
+import threading
+import http.client
+import urllib.parse
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+
+BUFFER_SIZE = 64 * 1024
+SEGMENT_SIZE = 8 * 1024 * 1024
+MAX_REDIRECTS = 5
+
+# Headers which are not sent to another origin after a redirect
+CREDENTIAL_HEADERS = ("authorization", "cookie")
+VALIDATOR_SUFFIX = ".validator"
+
+class Error(pisi.Error):
+    pass
+
+class HTTPError(Error):
+    def __init__(self, url, status, reason):
+        Error.__init__(self, _("%s: HTTP error %d %s") % (url, status, reason))
+        self.status = status
+
+# Errors on a reused connection, which the server may have closed since
+RETRY_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+class ConnectionPool(object):
+    """Idle keep-alive connections, per scheme, host, port and proxy"""
+
+    def __init__(self, max_idle=4, timeout=30):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.connections = 0
+
+    def connect(self, key):
+        scheme, host, port, proxy = key
+        if proxy:
+            proxy = urllib.parse.urlsplit(proxy)
+            connect_host, connect_port = proxy.hostname, proxy.port
+        else:
+            connect_host, connect_port = host, port
+
+        if scheme == "https" and not proxy:
+            conn = http.client.HTTPSConnection(connect_host, connect_port, timeout=self.timeout)
+        elif scheme == "https":
+            conn = http.client.HTTPSConnection(connect_host, connect_port or 8080, timeout=self.timeout)
+            conn.set_tunnel(host, port)
+        else:
+            conn = http.client.HTTPConnection(connect_host, connect_port, timeout=self.timeout)
+
+        with self.lock:
+            self.connections += 1
+        return conn
+
+    def get(self, key):
+        """Return an idle connection and whether it was reused"""
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self.connect(key), False
+
+    def put(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle = {}
+
+class Response(object):
+    """File object for a response body. The connection goes back to the
+    pool when the body has been read to its end."""
+
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+        length = response.getheader("Content-Length")
+        self.length = int(length) if length and length.isdigit() else None
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def info(self):
+        return self.headers
+
+    def read(self, size=-1):
+        if self.conn is None:
+            return b""
+        data = self.response.read(None if size is None or size < 0 else size)
+        if not data or self.response.isclosed():
+            self.release()
+        return data
+
+    def release(self):
+        if self.conn is None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put(self.key, self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
+
+    def close(self):
+        """Drop the connection unless the body was read completely"""
+        if self.conn is not None and not self.response.isclosed():
+            self.response.close()
+            self.conn.close()
+            self.conn = None
+        self.release()
+
+class Throttle(object):
+    """Keep the total rate of the calls to wait under limit bytes/s"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.start = time.time()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def wait(self, size):
+        with self.lock:
+            self.size += size
+            delay = self.size / float(self.limit) - (time.time() - self.start)
+        if delay > 0:
+            time.sleep(delay)
+
+def parse_content_range(value):
+    """Return (first, last, total) of a Content-Range header, first and
+    last are None for unsatisfied ranges and total is None if unknown"""
+    match = re.match(r"bytes\s+(?:(\d+)-(\d+)|\*)/(\d+|\*)", value or "")
+    if not match:
+        return None
+    first, last, total = match.groups()
+    return (int(first) if first else None,
+            int(last) if last else None,
+            int(total) if total != "*" else None)
+
+def response_validator(response):
+    """Return a validator usable in If-Range: a strong ETag or the
+    modification date"""
+    etag = response.getheader("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.getheader("Last-Modified")
+
+def read_validator(path):
+    try:
+        with open(path + VALIDATOR_SUFFIX) as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+def write_validator(path, validator):
+    if validator:
+        with open(path + VALIDATOR_SUFFIX, "w") as f:
+            f.write(validator)
+    else:
+        remove_validator(path)
+
+def remove_validator(path):
+    try:
+        os.unlink(path + VALIDATOR_SUFFIX)
+    except OSError:
+        pass
+
+def url_origin(url):
+    """Return the (scheme, host, port) origin of url"""
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or {"http": 80, "https": 443}.get(parts.scheme)
+    return parts.scheme, parts.hostname, port
+
+class Segment(object):
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.done = 0
+
+class HTTPClient(object):
+    """HTTP/1.1 client sharing a pool of persistent connections"""
+
+    def __init__(self, pool=None, headers=(), proxies=None, bandwidth_limit=0,
+                 segments=1, segment_size=SEGMENT_SIZE):
+        self.pool = pool or ConnectionPool()
+        self.headers = list(headers)
+        self.proxies = proxies or {}
+        self.bandwidth_limit = bandwidth_limit
+        self.segments = max(1, segments)
+        self.segment_size = segment_size
+
+    def request(self, url, headers=(), method="GET"):
+        """Send a request, following redirects, and return its Response.
+
+        The credentials are not sent any more once a redirect leads to
+        another scheme, host or port."""
+        origin = url_origin(url)
+        drop = ()
+        for i in range(MAX_REDIRECTS + 1):
+            response = self._request(url, headers, method, drop)
+            location = response.getheader("Location")
+            if response.status not in (301, 302, 303, 307, 308) or not location:
+                return response
+            response.read()
+            response.close()
+            url = urllib.parse.urljoin(url, location)
+            if url_origin(url) != origin:
+                drop = CREDENTIAL_HEADERS
+        raise Error(_("%s: Too many redirects") % url)
+
+    def _request(self, url, headers, method, drop=()):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise Error(_("Unsupported URL scheme: %s") % url)
+
+        proxy = self.proxies.get(parts.scheme)
+        key = (parts.scheme, parts.hostname, parts.port, proxy)
+
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        if proxy and parts.scheme == "http":
+            path = urllib.parse.urlunsplit(parts[:2] + (path, "", ""))
+
+        request_headers = dict(self.headers)
+        request_headers.update(headers)
+        for name in list(request_headers):
+            if name.lower() in drop:
+                del request_headers[name]
+
+        while True:
+            conn, reused = self.pool.get(key)
+            try:
+                conn.request(method, path, headers=request_headers)
+                response = conn.getresponse()
+            except RETRY_ERRORS:
+                conn.close()
+                if reused:
+                    continue
+                raise Error(_("%s: Connection closed by server") % url)
+            except (socket.error, http.client.HTTPException) as e:
+                conn.close()
+                raise Error("%s: %s" % (url, e))
+
+            return Response(self.pool, key, conn, response, url)
+
+    def open(self, url, headers=()):
+        response = self.request(url, headers)
+        if response.status != 200:
+            response.close()
+            raise HTTPError(url, response.status, response.response.reason)
+        return response
+
+    def download(self, url, path, progress=None, headers=(), ranges=True):
+        """Download url into path, resuming a partial file at path.
+
+        progress is called with the downloaded and total size, the latter
+        is None when the server does not send it. If ranges is False, the
+        whole file is fetched with a single request."""
+        offset = os.path.getsize(path) if ranges and os.path.exists(path) else 0
+        validator = read_validator(path) if offset else None
+        throttle = Throttle(self.bandwidth_limit) if self.bandwidth_limit else None
+
+        request_headers = list(headers)
+        if ranges and (offset or self.segments > 1):
+            # Ask for the first segment only, the response tells whether
+            # the server supports ranges and how large the file is
+            if self.segments > 1:
+                request_headers.append(("Range", "bytes=%d-%d" % (offset, offset + self.segment_size - 1)))
+            else:
+                request_headers.append(("Range", "bytes=%d-" % offset))
+            if validator:
+                request_headers.append(("If-Range", validator))
+
+        response = self.request(url, request_headers)
+        try:
+            if response.status == 416 and ranges:
+                content_range = parse_content_range(response.getheader("Content-Range"))
+                response.read()
+                if content_range and content_range[2] == offset:
+                    # Already complete
+                    open(path, "ab").close()
+                    remove_validator(path)
+                    return path
+                # The partial file does not belong to the remote file, or
+                # there is none and the server refuses the first segment
+                if os.path.exists(path):
+                    os.unlink(path)
+                remove_validator(path)
+                return self.download(url, path, progress, headers, ranges=bool(offset))
+
+            if response.status == 206:
+                content_range = parse_content_range(response.getheader("Content-Range"))
+                if not content_range or content_range[0] != offset:
+                    raise Error(_("%s: Server sent an unexpected range") % url)
+                first, last, total = content_range
+            elif response.status == 200:
+                # Range not supported or the file has changed
+                offset = 0
+                first, last, total = 0, None, response.length
+            else:
+                raise HTTPError(url, response.status, response.response.reason)
+
+            write_validator(path, response_validator(response))
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                if response.status == 200:
+                    os.ftruncate(fd, 0)
+
+                segments = [Segment(first, last + 1 if last is not None else None)]
+                if response.status == 206 and total is not None and last + 1 < total:
+                    segments.extend(self.split(last + 1, total))
+
+                self.fetch_segments(url, headers, validator or response_validator(response),
+                                    fd, response, segments, total, progress, throttle)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+        finally:
+            response.close()
+
+        if total is not None and size != total:
+            raise Error(_("%s: Download is incomplete") % url)
+        remove_validator(path)
+        return path
+
+    def split(self, start, end):
+        """Split the rest of the file into at most segments - 1 ranges,
+        the first segment is read from the first response"""
+        count = max(1, self.segments - 1)
+        size = max(self.segment_size, -(-(end - start) // count))
+        return [Segment(offset, min(offset + size, end))
+                for offset in range(start, end, size)]
+
+    def fetch_segments(self, url, headers, validator, fd, response, segments,
+                       total, progress, throttle):
+        lock = threading.Lock()
+        errors = []
+        base = segments[0].start
+
+        def report():
+            if progress:
+                with lock:
+                    progress(base + sum(segment.done for segment in segments), total)
+
+        def copy(segment, response):
+            position = segment.start
+            while segment.end is None or position < segment.end:
+                size = BUFFER_SIZE
+                if segment.end is not None:
+                    size = min(size, segment.end - position)
+                data = response.read(size)
+                if not data:
+                    break
+                os.pwrite(fd, data, position)
+                position += len(data)
+                segment.done += len(data)
+                if throttle:
+                    throttle.wait(len(data))
+                report()
+
+        def worker(segment):
+            try:
+                ranged = list(headers) + [("Range", "bytes=%d-%d" % (segment.start, segment.end - 1))]
+                if validator:
+                    ranged.append(("If-Range", validator))
+                response = self.request(url, ranged)
+                try:
+                    content_range = parse_content_range(response.getheader("Content-Range"))
+                    if response.status != 206 or not content_range or \
+                            content_range[0] != segment.start or content_range[2] != total:
+                        raise Error(_("%s: File changed during download") % url)
+                    copy(segment, response)
+                finally:
+                    response.close()
+            except Exception as e:
+                errors.append(e)
+
+        threads = []
+        for segment in segments[1:]:
+            thread = threading.Thread(target=worker, args=(segment,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            copy(segments[0], response)
+        finally:
+            for thread in threads:
+                thread.join()
+
+            # Keep the contiguous downloaded part for resuming later
+            complete = segments[0].start
+            for segment in segments:
+                complete = segment.start + segment.done
+                if segment.end is None or complete < segment.end:
+                    break
+            os.ftruncate(fd, complete)
+
+        if errors:
+            raise errors[0]
@@ -13,8 +13,13 @@
 """PiSi source/package index"""
 
 import os
-import re
+import bz2
+import lzma
+import time
+import pickle
+import hashlib
 import shutil
+import collections
 import multiprocessing
 
 import gettext
@@ -34,10 +39,230 @@ import pisi.component as component
 import pisi.group as group
 import pisi.operations.build
 
+import xml.etree.ElementTree as ET
+
 
 class Error(pisi.Error):
     pass
 
+class IndexCache(object):
+    """Sidecar cache of the index entries written by previous index runs.
+
+    The serialised Package elements are kept in a data file next to the
+    cache, only small records of the packages (file identity, name, delta
+    identity, URI and the place of the entry in the data file) are loaded.
+    Entries are reused only while the (size, mtime_ns, inode) identity of
+    the package and of its delta packages is unchanged. The entries of
+    this run are appended to a new data file as soon as they are finished
+    and the data file of the previous run is removed by save()."""
+
+    cache_version = "2"
+
+    def __init__(self, repo_uri, full=False):
+        self.repo_uri = repo_uri
+        self.path = os.path.join(repo_uri, ctx.const.index_cache)
+        self.data_name, self.records = (None, {}) if full else self.__load()
+        self.data = None
+        self.new_records = {}
+        self.new_data_name = "%s.%d.%d.data" % (ctx.const.index_cache, os.getpid(),
+                                                time.time_ns())
+        self.new_data = None
+        self.hits = 0
+
+    def __load(self):
+        try:
+            with open(self.path, "rb") as f:
+                version, data_name, records = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError,
+                AttributeError, ImportError, pickle.UnpicklingError):
+            return None, {}
+
+        if version != IndexCache.cache_version or \
+                not os.path.exists(os.path.join(self.repo_uri, data_name)):
+            return None, {}
+
+        return data_name, records
+
+    @staticmethod
+    def file_key(path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def __deltas_key(self, name, deltas):
+        return tuple(sorted((os.path.basename(path), self.file_key(path))
+                            for path in deltas.get(name, [])))
+
+    def lookup(self, path, deltas):
+        """Return the record of the cached entry of path or None if the
+        package has changed"""
+        record = self.records.get(util.removepathprefix(self.repo_uri, path))
+        if record is None:
+            return None
+
+        file_key, name, deltas_key, uri, offset, length = record
+        try:
+            if file_key != self.file_key(path) or \
+                    deltas_key != self.__deltas_key(name, deltas) or \
+                    uri != package_uri(self.repo_uri, path):
+                return None
+        except OSError:
+            return None
+
+        return record
+
+    def reuse(self, path, record):
+        """Return the cached entry of a record returned by lookup and carry
+        it over to the new data file"""
+        file_key, name, deltas_key, uri, offset, length = record
+        if self.data is None:
+            self.data = open(os.path.join(self.repo_uri, self.data_name), "rb")
+        self.data.seek(offset)
+        xml = self.data.read(length)
+        if len(xml) != length:
+            raise Error(_("Index cache %s is truncated") % self.path)
+
+        self.__append(path, (file_key, name, deltas_key, uri), xml)
+        self.hits += 1
+        return xml
+
+    def set(self, path, deltas, name, xml):
+        """Append the serialised entry xml of the package name at path"""
+        self.__append(path, (self.file_key(path), name,
+                             self.__deltas_key(name, deltas),
+                             package_uri(self.repo_uri, path)), xml)
+
+    def __append(self, path, key, xml):
+        if self.new_data is None:
+            self.new_data = open(os.path.join(self.repo_uri, self.new_data_name), "wb")
+        offset = self.new_data.tell()
+        self.new_data.write(xml)
+        self.new_records[util.removepathprefix(self.repo_uri, path)] = \
+                key + (offset, len(xml))
+
+    def __close(self):
+        for f in (self.data, self.new_data):
+            if f is not None:
+                f.close()
+        self.data = self.new_data = None
+
+    def __remove(self, data_name):
+        try:
+            os.unlink(os.path.join(self.repo_uri, data_name))
+        except OSError:
+            pass
+
+    def save(self):
+        """Write the records of the entries of this run, dropping the
+        removed packages and the data file of the previous run"""
+        self.__close()
+        tmp = self.path + ctx.const.temporary_suffix
+        try:
+            if not self.new_records:
+                open(os.path.join(self.repo_uri, self.new_data_name), "wb").close()
+            with open(tmp, "wb") as f:
+                pickle.dump((IndexCache.cache_version, self.new_data_name,
+                             self.new_records), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            ctx.ui.warning(_("Cannot write index cache %s: %s") % (self.path, e))
+            self.__remove(self.new_data_name)
+            return
+
+        if self.data_name and self.data_name != self.new_data_name:
+            self.__remove(self.data_name)
+
+    def discard(self):
+        """Remove the entries of an interrupted run, keeping the cache of
+        the previous one"""
+        self.__close()
+        self.__remove(self.new_data_name)
+
+def element_xml(tag, obj):
+    """Return the UTF-8 serialisation of autoxml object obj as a tag element"""
+    errs = []
+    node = ET.Element(tag)
+    obj.encode(node, errs)
+    if errs:
+        errs.append(_("Index element %s cannot be encoded") % tag)
+        raise Error(*errs)
+    return ET.tostring(node, encoding="unicode").encode("utf-8")
+
+class IndexWriter(object):
+    """Write an index document one element at a time.
+
+    Every element is serialised as soon as it is produced and fed to the
+    plain index file, to incremental compressors and to SHA1 hashers, so
+    the memory used does not depend on the size of the repository."""
+
+    def __init__(self, path, sha1sum=False, compress=0, sign=None):
+        self.path = path
+        self.sha1sum = sha1sum
+        self.sign = sign
+
+        compress = compress or 0
+        self.outputs = [(path, None)]
+        if compress & pisi.file.File.COMPRESSION_TYPE_XZ:
+            self.outputs.append((path + ".xz", lzma.LZMACompressor(preset=9)))
+        if compress & pisi.file.File.COMPRESSION_TYPE_BZ2:
+            self.outputs.append((path + ".bz2", bz2.BZ2Compressor()))
+
+        self.files = [open(filename, "wb") for filename, compressor in self.outputs]
+        self.hashes = [hashlib.sha1() for output in self.outputs]
+        self.write("<%s>" % Index.tag)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        for (filename, compressor), f, h in zip(self.outputs, self.files, self.hashes):
+            chunk = compressor.compress(data) if compressor else data
+            if chunk:
+                f.write(chunk)
+                h.update(chunk)
+
+    def write_element(self, tag, obj):
+        """Encode an autoxml object as a child element of the index"""
+        self.write(element_xml(tag, obj))
+
+    def write_index(self, index):
+        """Write the parts of index which are not streamed"""
+        if index.distribution:
+            self.write_element("Distribution", index.distribution)
+        for spec in index.specs:
+            self.write_element("SpecFile", spec)
+        for package in index.packages:
+            self.write_element("Package", package)
+        for component in index.components:
+            self.write_element("Component", component)
+        for group in index.groups:
+            self.write_element("Group", group)
+
+    def close(self):
+        self.write("</%s>" % Index.tag)
+        for (filename, compressor), f, h in zip(self.outputs, self.files, self.hashes):
+            if compressor:
+                chunk = compressor.flush()
+                f.write(chunk)
+                h.update(chunk)
+            f.close()
+
+        for (filename, compressor), h in zip(self.outputs, self.hashes):
+            if self.sha1sum:
+                with open(filename + ".sha1sum", "w") as cs:
+                    cs.write(h.hexdigest())
+
+            if self.sign == pisi.file.File.detached:
+                if util.run_batch("gpg --detach-sig " + filename)[0]:
+                    raise Error(_("ERROR: gpg --detach-sig %s failed") % filename)
+
+    def abort(self):
+        """Close and remove the partially written index files"""
+        for (filename, compressor), f in zip(self.outputs, self.files):
+            f.close()
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+
 class Index(xmlfile.XmlFile):
     __metaclass__ = autoxml.autoxml
 
@@ -85,8 +310,14 @@ class Index(xmlfile.XmlFile):
         tmpdir = os.path.join(ctx.config.index_dir(), repo)
         pisi.file.File.check_signature(filename, tmpdir)
 
-    def index(self, repo_uri, skip_sources=False):
+    def index(self, repo_uri, skip_sources=False, full=False, writer=None):
+        """Index the packages, specs and repository files under repo_uri.
+
+        If an IndexWriter is given, binary packages are written to it as
+        they are added instead of being kept in self.packages."""
+
         self.repo_dir = repo_uri
+        cache = IndexCache(repo_uri, full)
 
         packages = []
         specs = []
@@ -100,8 +331,9 @@ class Index(xmlfile.XmlFile):
                 if not os.path.isdir(pkgpath): os.makedirs(pkgpath)
                 ctx.ui.info("%-80.80s\r" % (_('Sorting: %s ') %
                     fn), noln = False if ctx.config.get_option("verbose") else True)
-                shutil.copy2(os.path.join(repo_uri, fn), pkgpath)
-                os.remove(os.path.join(repo_uri, fn))
+                # Sorted directories are on the same filesystem, a rename
+                # keeps the inode and does not copy the package data.
+                os.rename(os.path.join(repo_uri, fn), os.path.join(pkgpath, fn))
                 pkgs_sorted = True
         if pkgs_sorted:
             ctx.ui.info("%-80.80s\r" % '')
@@ -159,43 +391,101 @@ class Index(xmlfile.XmlFile):
 
         for pkg in util.filter_latest_packages(packages):
             pkg_name = util.parse_package_name(os.path.basename(pkg))[0]
+            # Workers only need the delta packages of their own package,
+            # do not pickle the whole deltas dictionary for every task.
+            pkg_deltas = {pkg_name: deltas[pkg_name]} if pkg_name in deltas else {}
             if pkg_name.endswith(ctx.const.debug_name_suffix):
                 pkg_name = util.remove_suffix(ctx.const.debug_name_suffix,
                                               pkg_name)
             if pkg_name not in obsoletes_list:
-                # Currently, multiprocessing.Pool.map method accepts methods
-                # with single parameters only. So we have to send our
-                # parameters as a tuple to workaround that
+                latest_packages.append((pkg, pkg_deltas, repo_uri))
 
-                latest_packages.append((pkg, deltas, repo_uri))
-
-        # Before calling pool.map check if list is empty or not: python#12157
         if latest_packages:
-            sorted_pkgs = {}
-            for pkg in latest_packages:
-                key = re.search(r"\/((lib)?[\d\w])\/", pkg[0])
-                key = key.group(1) if key else os.path.dirname(pkg[0]) 
-                try:
-                    sorted_pkgs[key].append(pkg)
-                except KeyError:
-                    sorted_pkgs[key] = [pkg]
-            self.packages = []
-            for key, pkgs in sorted(sorted_pkgs.items()):
-                ctx.ui.info("%-80.80s\r" % (_("Adding packages from directory %s... " % key)), noln=True)
-                try:
-                    # Add binary packages to index using a process pool
-                    self.packages.extend(pool.map(add_package, pkgs))
-                except:
-                    pool.terminate()
-                    pool.join()
-                    ctx.ui.info("")
-                    raise
-                ctx.ui.info("%-80.80s\r" % (_("Adding packages from directory %s... done." % key)))
+            try:
+                latest_packages.sort(key=lambda pkg: pkg[0])
+                entries = add_packages(pool, latest_packages, cache)
+                if writer:
+                    for xml in entries:
+                        writer.write(xml)
+                else:
+                    self.packages = [parse_package(xml) for xml in entries]
+            except:
+                pool.terminate()
+                pool.join()
+                cache.discard()
+                ctx.ui.info("")
+                raise
 
         ctx.ui.info("")
         pool.close()
         pool.join()
 
+        if cache.hits:
+            ctx.ui.info(_("Reused %d unchanged packages from index cache.") % cache.hits)
+        cache.save()
+
+def add_packages(pool, packages, cache):
+    """Yield the serialised index entries of packages in the given order.
+
+    Packages are looked up in the cache as they are reached. Changed
+    packages are submitted to the pool, at most window of them ahead of
+    the entry being yielded, so workers never idle between batches. Only
+    the cache records of the packages waiting behind a running task and
+    the entries of at most window finished tasks are held in memory."""
+
+    window = multiprocessing.cpu_count() * 16
+    queue = collections.deque()
+
+    start = time.time()
+    count = len(packages)
+    stats = {"done": 0, "running": 0, "hashed": 0}
+
+    def finish():
+        pkg, record, result = queue.popleft()
+        if result is None:
+            xml = cache.reuse(pkg[0], record)
+        else:
+            name, size, xml = result.get()
+            stats["running"] -= 1
+            stats["hashed"] += size
+            cache.set(pkg[0], pkg[1], name, xml)
+
+        stats["done"] += 1
+        elapsed = max(time.time() - start, 0.001)
+        ctx.ui.info("%-80.80s\r" % (_("Adding packages: %d/%d, %.1f packages/s, %.1f MB/s hashed") %
+                    (stats["done"], count, stats["done"] / elapsed,
+                     stats["hashed"] / elapsed / 1048576.0)), noln=True)
+        return xml
+
+    for pkg in packages:
+        record = cache.lookup(pkg[0], pkg[1])
+        if record is None:
+            queue.append((pkg, None, pool.apply_async(add_package_task, (pkg,))))
+            stats["running"] += 1
+        else:
+            queue.append((pkg, record, None))
+
+        # Yield the entries which are ready, wait for the oldest task only
+        # when the window is full
+        while queue and (queue[0][2] is None or queue[0][2].ready() or
+                         stats["running"] >= window):
+            yield finish()
+
+    while queue:
+        yield finish()
+
+    elapsed = max(time.time() - start, 0.001)
+    ctx.ui.info("%-80.80s" % (_("Added %d packages in %.1f seconds (%.1f packages/s, %.1f MB/s hashed)") %
+                (count, elapsed, count / elapsed, stats["hashed"] / elapsed / 1048576.0)))
+
+def add_package_task(pkg):
+    """Add a package in a worker and return its name, the bytes hashed and
+    its serialised index entry"""
+    package = add_package(pkg)
+    size = package.packageSize + \
+            sum(delta.packageSize for delta in package.deltaPackages)
+    return package.name, size, element_xml("Package", package)
+
 def add_package(params):
     try:
         path, deltas, repo_uri = params
@@ -207,10 +497,7 @@ def add_package(params):
         md = package.get_metadata()
         md.package.packageSize = int(os.path.getsize(path))  # long yerine int
         md.package.packageHash = util.sha1_file(path)
-        if ctx.config.options and ctx.config.options.absolute_urls:
-            md.package.packageURI = os.path.realpath(path)
-        else:
-            md.package.packageURI = util.removepathprefix(repo_uri, path)
+        md.package.packageURI = package_uri(repo_uri, path)
 
         # check package semantics
         errs = md.errors()
@@ -249,6 +536,16 @@ def add_package(params):
     except KeyboardInterrupt:
         raise Exception
 
+def parse_package(xml):
+    package = metadata.Package()
+    package.parse(xml.decode("utf-8"))
+    return package
+
+def package_uri(repo_uri, path):
+    if ctx.config.options and ctx.config.options.absolute_urls:
+        return os.path.realpath(path)
+    return util.removepathprefix(repo_uri, path)
+
 def add_groups(path):
     ctx.ui.info(_('Adding groups.xml to index'))
     groups_xml = group.Groups()
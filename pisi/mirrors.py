@@ -10,7 +10,12 @@
 # Please read the COPYING file.
 
 import os.path
+import time
+import queue
+import pickle
+import threading
 import pisi
+import pisi.util as util
 import pisi.context as ctx
 import gettext
 
@@ -45,3 +50,176 @@ class Mirrors:
                             self._add_mirror(name, url)
         else:
             raise pisi.Error(_('Mirrors file %s does not exist. Could not resolve mirrors://') % config)
+
+# Measurements lose half of their weight in a week
+HALF_LIFE = 7 * 24 * 3600
+# Mirrors not measured for a day are probed again before they are ranked
+STALE_TIME = 24 * 3600
+# Weight of a new measurement against the previous ones
+SAMPLE_WEIGHT = 0.3
+# Mirrors are ranked by the expected time to fetch this much data
+REFERENCE_SIZE = 1024 * 1024
+DEFAULT_THROUGHPUT = 256 * 1024
+PROBE_TIMEOUT = 5
+# Number of the best mirrors racing for the first bytes of a file
+RACE_COUNT = 3
+
+def split_url(uri):
+    """Return the mirror name and the path of a mirrors:// url"""
+    name, sep, path = uri[len("mirrors://"):].partition("/")
+    return name, path
+
+def probeable(url):
+    return url.startswith("http://") or url.startswith("https://")
+
+class MirrorStat(object):
+    """Decaying averages of the latency and throughput of a mirror"""
+
+    def __init__(self):
+        self.latency = None
+        self.throughput = None
+        self.failures = 0.0
+        self.updated = 0
+
+    def decay(self, now):
+        return 0.5 ** (max(0, now - self.updated) / float(HALF_LIFE))
+
+    def record(self, now, latency=None, throughput=None, failed=False):
+        decay = self.decay(now)
+        weight = (1 - SAMPLE_WEIGHT) * decay
+        if latency is not None:
+            self.latency = latency if self.latency is None else \
+                    weight * self.latency + (1 - weight) * latency
+        if throughput is not None:
+            self.throughput = throughput if self.throughput is None else \
+                    weight * self.throughput + (1 - weight) * throughput
+        self.failures = self.failures * decay + (1 if failed else 0)
+        self.updated = now
+
+    def score(self, now):
+        """Expected seconds to fetch REFERENCE_SIZE bytes, lower is better"""
+        latency = PROBE_TIMEOUT if self.latency is None else self.latency
+        throughput = self.throughput or DEFAULT_THROUGHPUT
+        return (latency + REFERENCE_SIZE / throughput) * \
+                (1 + self.failures * self.decay(now))
+
+class MirrorStats(object):
+    """Per mirror statistics, kept under the cache directory"""
+
+    cache_version = "1"
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(ctx.config.cache_root_dir(), ctx.const.mirror_stats)
+        self.stats = self.__load()
+        self.lock = threading.Lock()
+
+    def __load(self):
+        try:
+            with open(self.path, "rb") as f:
+                version, stats = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError,
+                AttributeError, ImportError, pickle.UnpicklingError):
+            return {}
+
+        if version != MirrorStats.cache_version:
+            return {}
+
+        return stats
+
+    def get(self, mirror):
+        return self.stats.get(mirror)
+
+    def record(self, mirror, **measurement):
+        with self.lock:
+            stat = self.stats.setdefault(mirror, MirrorStat())
+            stat.record(time.time(), **measurement)
+
+    def is_stale(self, mirror, now=None):
+        stat = self.stats.get(mirror)
+        return stat is None or (now or time.time()) - stat.updated > STALE_TIME
+
+    def score(self, mirror, now=None):
+        stat = self.stats.get(mirror) or MirrorStat()
+        return stat.score(now or time.time())
+
+    def rank(self, mirrors):
+        now = time.time()
+        return sorted(mirrors, key=lambda mirror: self.score(mirror, now))
+
+    def save(self):
+        tmp = self.path + ctx.const.temporary_suffix
+        try:
+            util.ensure_dirs(os.path.dirname(self.path))
+            with open(tmp, "wb") as f:
+                pickle.dump((MirrorStats.cache_version, self.stats), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            ctx.ui.warning(_("Cannot write mirror statistics %s: %s") % (self.path, e))
+
+def probe(client, candidates, stats, first=False, timeout=PROBE_TIMEOUT):
+    """Request the first byte of (mirror, url) candidates concurrently,
+    recording the latencies. Return the mirrors which answered in the
+    order of their answers, only the first one if first is set."""
+    answers = queue.Queue()
+
+    def request(mirror, url):
+        start = time.time()
+        try:
+            response = client.request(url, [("Range", "bytes=0-0")])
+            latency = time.time() - start
+            if response.status in (200, 206):
+                if response.status == 206:
+                    # Leave the connection warm in the pool for the download
+                    response.read()
+                response.close()
+                stats.record(mirror, latency=latency)
+                answers.put(mirror)
+                return
+            response.close()
+        except pisi.Error:
+            pass
+        stats.record(mirror, failed=True)
+        answers.put(None)
+
+    for mirror, url in candidates:
+        thread = threading.Thread(target=request, args=(mirror, url))
+        thread.daemon = True
+        thread.start()
+
+    answered = []
+    deadline = time.time() + timeout
+    for i in range(len(candidates)):
+        try:
+            mirror = answers.get(timeout=max(0, deadline - time.time()))
+        except queue.Empty:
+            break
+        if mirror is not None:
+            answered.append(mirror)
+            if first:
+                break
+
+    return answered
+
+def rank_mirrors(mirrors, path, client, stats):
+    """Return mirrors, the best one for fetching path first.
+
+    Mirrors without recent statistics are probed first. Then the best
+    RACE_COUNT mirrors race for the first byte of path, the winner is
+    tried first and the others follow in the order of their scores."""
+    now = time.time()
+    stale = [(mirror, os.path.join(mirror, path)) for mirror in mirrors
+             if probeable(mirror) and stats.is_stale(mirror, now)]
+    if stale:
+        probe(client, stale, stats)
+
+    ranked = stats.rank(mirrors)
+    top = [(mirror, os.path.join(mirror, path))
+           for mirror in ranked[:RACE_COUNT] if probeable(mirror)]
+    if len(top) > 1:
+        winner = probe(client, top, stats, first=True)
+        if winner:
+            ranked.remove(winner[0])
+            ranked.insert(0, winner[0])
+
+    return ranked
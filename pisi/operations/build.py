@@ -18,7 +18,9 @@ import glob
 import stat
 import pwd
 import grp
+import time
 import fnmatch
+import concurrent.futures
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -28,10 +30,13 @@ import pisi
 import pisi.specfile
 import pisi.util as util
 import pisi.file
+import pisi.filetype
 import pisi.context as ctx
 import pisi.dependency as dependency
 import pisi.api
 import pisi.sourcearchive
+import pisi.buildcache
+import pisi.sourcecache
 import pisi.files
 import pisi.fetcher
 import pisi.uri
@@ -136,6 +141,7 @@ def exclude_special_files(filepath, fileinfo, ag):
             ctx.ui.debug("Removing special %s file: %s" % (name, filepath))
             os.unlink(filepath)
             util.rmdirs(os.path.dirname(filepath))
+            return name
 
 def strip_debug_action(filepath, fileinfo, install_dir, ag):
     excludelist = tuple(ag.get("NoStrip", []))
@@ -143,7 +149,7 @@ def strip_debug_action(filepath, fileinfo, install_dir, ag):
     path = '/' + util.removepathprefix(install_dir, filepath)
 
     if path.startswith(excludelist):
-        return
+        return False
 
     outputpath = util.join_path(os.path.dirname(install_dir),
                                 ctx.const.debug_dir_suffix,
@@ -152,6 +158,11 @@ def strip_debug_action(filepath, fileinfo, install_dir, ag):
 
     if util.strip_file(filepath, fileinfo, outputpath):
         ctx.ui.debug("%s [%s]" % (path, "stripped"))
+        return True
+    return False
+
+def strip_jobs():
+    return int(ctx.config.values.build.stripjobs or 0) or os.cpu_count() or 1
 
 
 class Builder:
@@ -259,6 +270,13 @@ class Builder:
 
         return fn
 
+    def compression_level(self, package):
+        """Return the compression level of the install archive of package:
+        the pspec value of the package, then of the source, then the
+        configured default"""
+        return package.compressionLevel or self.spec.source.compressionLevel or \
+                ctx.config.values.build.compressionlevel
+
     def pkg_dir(self):
         packageDir = self.spec.source.name + '-' + \
                      self.spec.getSourceVersion() + '-' + \
@@ -304,6 +322,10 @@ class Builder:
         self.check_patches()
 
         self.check_build_dependencies()
+
+        if self.get_cached_build():
+            return
+
         self.fetch_component()
         self.fetch_source_archives()
 
@@ -324,6 +346,40 @@ class Builder:
             self.run_install_action()
 
         self.build_packages()
+        self.put_cached_build()
+
+    def use_build_cache(self):
+        return ctx.config.values.build.buildcache and \
+                not ctx.get_option("ignore_build_cache")
+
+    def get_cached_build(self):
+        """Take the packages from the build cache if the same build has
+        been done before. Return True on success."""
+        if not self.use_build_cache():
+            return False
+
+        self.build_cache = pisi.buildcache.BuildCache()
+        self.build_key = pisi.buildcache.build_key(self)
+        output_dir = ctx.get_option("output_dir") or "."
+        cached = self.build_cache.get(self.build_key, output_dir)
+        if cached is None:
+            ctx.ui.debug(_("Build %s is not in the build cache") % self.build_key)
+            return False
+
+        self.new_packages, self.new_debug_packages = cached
+        for path in self.new_packages + self.new_debug_packages:
+            ctx.ui.info(_("Using cached build result %s") % os.path.basename(path))
+        return True
+
+    def put_cached_build(self):
+        if not self.use_build_cache():
+            return
+
+        try:
+            self.build_cache.put(self.build_key, self.new_packages,
+                                 self.new_debug_packages)
+        except (IOError, OSError) as e:
+            ctx.ui.warning(_("Cannot store the build result in the build cache: %s") % e)
 
     def get_build_types(self):
         ignored_build_types = ctx.config.values.build.ignored_build_types.split(",")
@@ -473,6 +529,16 @@ class Builder:
         self.sourceArchives.fetch()
 
     def unpack_source_archives(self):
+        source_cache = None
+        if ctx.config.values.build.sourcecache:
+            source_cache = pisi.sourcecache.SourceCache()
+            tree_key = pisi.sourcecache.tree_key(self)
+            if source_cache.restore(self.spec.source.name, tree_key,
+                                    self.pkg_work_dir()):
+                ctx.ui.info(_(" restored from the source cache (%s)") % self.pkg_work_dir())
+                self.set_state("unpack")
+                return
+
         ctx.ui.action(_("Unpacking archive(s)..."))
         self.sourceArchives.unpack(self.pkg_work_dir())
 
@@ -482,6 +548,14 @@ class Builder:
             ctx.ui.info(_(" unpacked (%s)") % self.pkg_work_dir())
             self.set_state("unpack")
 
+            if source_cache:
+                try:
+                    source_cache.store(self.spec.source.name, tree_key,
+                                       self.pkg_work_dir(),
+                                       exclude=["pisiBuildState"])
+                except (IOError, OSError) as e:
+                    ctx.ui.warning(_("Cannot store the source tree in the source cache: %s") % e)
+
     def run_setup_action(self):
         ctx.ui.action(_("Setting up source..."))
         if self.run_action_function(ctx.const.setup_func):
@@ -504,6 +578,52 @@ class Builder:
         if self.run_action_function(ctx.const.install_func, True):
             self.set_state("installaction")
 
+    def file_actions(self):
+        """Strip the installed files and remove the special files not to
+        be packaged. File types are detected from their magic bytes and
+        the strip and debug split jobs run in parallel."""
+        install_dir = self.pkg_install_dir()
+        stats = {}
+
+        def count(action, start, n=1):
+            total = stats.setdefault(action, [0, 0.0])
+            total[0] += n
+            total[1] += time.time() - start
+
+        start = time.time()
+        files = []
+        for root, dirs, names in os.walk(install_dir):
+            for name in names:
+                filepath = util.join_path(root, name)
+                files.append((filepath, pisi.filetype.detect(filepath)))
+        count("detect", start, len(files))
+
+        def strip(filepath, fileinfo):
+            return strip_debug_action(filepath, fileinfo, install_dir, self.actionGlobals)
+
+        # Only ELF objects and ar archives are stripped, the other files
+        # are left to exclude_special_files
+        elf_types = ("ELF", "current ar archive")
+        strippable = [(filepath, fileinfo) for filepath, fileinfo in files
+                      if fileinfo and fileinfo.startswith(elf_types)]
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(strip_jobs()) as executor:
+            stripped = sum(executor.map(lambda job: strip(*job), strippable))
+        if stripped:
+            count("strip", start, stripped)
+
+        for filepath, fileinfo in files:
+            if fileinfo is None or fileinfo.startswith(elf_types):
+                continue
+            start = time.time()
+            removed = exclude_special_files(filepath, fileinfo, self.actionGlobals)
+            if removed:
+                count("remove %s" % removed, start)
+
+        for action in sorted(stats):
+            n, seconds = stats[action]
+            ctx.ui.info(_("File action %s: %d files in %.2fs") % (action, n, seconds))
+
     def get_abandoned_files(self):
         install_dir = self.pkg_install_dir()
         abandoned_files = []
@@ -10,8 +10,10 @@
 # Please read the COPYING file.
 
 import os
+import hashlib
 import pisi
 import pisi.context as ctx
+import pisi.package
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -82,3 +84,48 @@ def check_package(package, config=False):
         return check_config_files(package)
     else:
         return check_package_files(package)
+
+def check_package_archive(path):
+    """Verify the install archive of the package file at path against the
+    hashes in its files.xml"""
+    package = pisi.package.Package(path)
+    files = package.get_files()
+
+    tar = package.get_install_archive()
+    if tar is None:
+        raise pisi.Error(_("Package %s has no install archive") % path)
+
+    results = {
+        'missing': [],
+        'corrupted': [],
+        'denied': [],
+        'config': [],
+    }
+
+    expected = dict((f.path, f.hash) for f in files.list if f.hash)
+
+    tar.open_tar()
+    try:
+        for tarinfo in tar.tar:
+            file_hash = expected.pop(tarinfo.name, None)
+            if file_hash is None:
+                continue
+
+            if tarinfo.issym():
+                data_hash = pisi.util.sha1_data(tarinfo.linkname.encode("utf-8"))
+            elif tarinfo.isreg():
+                sha1 = hashlib.sha1()
+                data = tar.tar.extractfile(tarinfo)
+                for chunk in iter(lambda: data.read(1024 * 1024), b""):
+                    sha1.update(chunk)
+                data_hash = sha1.hexdigest()
+            else:
+                continue
+
+            if data_hash != file_hash:
+                results['corrupted'].append(tarinfo.name)
+    finally:
+        tar.close()
+
+    results['missing'].extend(sorted(expected))
+    return results
@@ -10,105 +10,352 @@
 # Please read the COPYING file.
 
 import os
+import lzma
+import mmap
+import zlib
+import shutil
+import tarfile
+import tempfile
+import multiprocessing
 
 import gettext
 __trans = gettext.translation("pisi", fallback=True)
 _ = __trans.gettext  # Python 3'te `ugettext` yerine `gettext` kullanılıyor
 
+import pisi
 import pisi.context as ctx
 import pisi.package
+import pisi.bdiff as bdiff
 import pisi.util as util
+import pisi.pxml.xmlfile as xmlfile
+import pisi.pxml.autoxml as autoxml
 
+# Files smaller than this are always stored as a whole
+binary_diff_min_size = 64 * 1024
 
-def create_delta_packages_from_obj(old_packages, new_package_obj, specdir):
-    new_pkg_info = new_package_obj.metadata.package
-    new_pkg_files = new_package_obj.files
 
-    new_pkg_path = new_package_obj.tmp_dir
+class Error(pisi.Error):
+    pass
 
-    new_pkg_name = os.path.basename(new_package_obj.filepath)
-    name, new_version, new_release, new_distro_id, new_arch = \
-            util.split_package_filename(new_pkg_name)
+def map_file(f):
+    """Return a read-only mmap of the non-empty open file f"""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-    cwd = os.getcwd()
-    out_dir = ctx.get_option("output_dir")
-    target_format = ctx.get_option("package_format")
-    delta_packages = []
+class Patch(metaclass=autoxml.autoxml):
+    t_Path = [autoxml.String, autoxml.mandatory]
+    t_Name = [autoxml.String, autoxml.mandatory]
+    t_OldHash = [autoxml.String, autoxml.mandatory]
+    t_Hash = [autoxml.String, autoxml.mandatory, "SHA1Sum"]
 
-    for old_package in old_packages:
-        old_pkg = pisi.package.Package(old_package)
-        old_pkg_info = old_pkg.metadata.package
+class Patches(xmlfile.XmlFile, metaclass=autoxml.autoxml):
+    """Binary patches of a delta package, read from patches.xml"""
 
-        if old_pkg_info.name != new_pkg_info.name:
-            ctx.ui.warning(_("The file '%s' belongs to a different package "
-                             "other than '%s'. Skipping it...")
-                             % (old_package, new_pkg_info.name))
-            continue
+    tag = "Patches"
 
-        if old_pkg_info.release == new_pkg_info.release:
-            ctx.ui.warning(_("Package '%s' has the same release number with "
-                             "the new package. Skipping it...") % old_package)
-            continue
+    t_List = [[Patch], autoxml.optional, "Patch"]
 
-        delta_name = "-".join((old_pkg_info.name,
-                               old_pkg_info.release,
-                               new_pkg_info.release,
-                               new_distro_id,
-                               new_arch)) + ctx.const.delta_package_suffix
 
-        ctx.ui.info(_("Creating %s...") % delta_name)
+def create_delta_packages_from_obj(old_packages, new_package_obj, specdir,
+                                   binary_diff=None, out_dir=None):
+    """Create delta packages from each of old_packages to new_package_obj.
 
-        if out_dir:
-            delta_name = util.join_path(out_dir, delta_name)
+    Deltas against several old packages are created in parallel. The
+    decoded files list of the new package and its hash map are handed to
+    every worker process once instead of being rebuilt per delta."""
 
-        old_pkg_files = old_pkg.get_files()
+    if binary_diff is None:
+        binary_diff = ctx.get_option("binary_diff")
+    if out_dir is None:
+        out_dir = ctx.get_option("output_dir")
 
-        files_delta = find_delta(old_pkg_files, new_pkg_files)
+    new_pkg_name = os.path.basename(new_package_obj.filepath)
+    new_distro_id, new_arch = util.split_package_filename(new_pkg_name)[3:]
+
+    new_package = {
+        "info": new_package_obj.metadata.package,
+        "files": new_package_obj.files,
+        "hashes": files_by_hash(new_package_obj.files),
+        "path": new_package_obj.tmp_dir,
+        "specdir": specdir,
+        "distro_id": new_distro_id,
+        "arch": new_arch,
+        "out_dir": out_dir,
+        "format": ctx.get_option("package_format"),
+        "binary_diff": binary_diff,
+    }
+
+    if len(old_packages) < 2:
+        _init_delta_worker(new_package)
+        results = list(map(create_delta_from_old_package, old_packages))
+    else:
+        processes = min(len(old_packages), multiprocessing.cpu_count())
+        pool = multiprocessing.Pool(processes, _init_delta_worker, (new_package,))
+        try:
+            results = pool.map(create_delta_from_old_package, old_packages)
+        except:
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
 
-        if len(files_delta) == len(new_pkg_files.list):
-            ctx.ui.warning(_("All files in the package '%s' are different "
-                             "from the files in the new package. Skipping "
-                             "it...") % old_package)
-            continue
+    # Return delta package names
+    return [delta_name for delta_name in results if delta_name]
+
+# The new package shared by the delta creation workers
+_new_package = None
 
-        delta_pkg = pisi.package.Package(delta_name, "w", format=target_format)
+def _init_delta_worker(new_package):
+    global _new_package
+    _new_package = new_package
 
-        # add comar files to package
-        os.chdir(specdir)
-        for pcomar in new_pkg_info.providesComar:
-            fname = util.join_path(ctx.const.comar_dir, pcomar.script)
-            delta_pkg.add_to_package(fname)
+def create_delta_from_old_package(old_package):
+    """Create a delta package from old_package to the new package set up
+    by _init_delta_worker, return its path or None if skipped"""
 
-        # add xmls and files
-        os.chdir(new_pkg_path)
+    new = _new_package
+    new_pkg_info = new["info"]
 
-        delta_pkg.add_metadata_xml(ctx.const.metadata_xml)
-        delta_pkg.add_files_xml(ctx.const.files_xml)
+    old_pkg = pisi.package.Package(old_package)
+    old_pkg_info = old_pkg.metadata.package
 
-        # only metadata information may change in a package,
-        # so no install archive added to delta package
-        if files_delta:
-            # Sort the files in-place according to their path for an ordered
-            # tarfile layout which dramatically improves the compression
-            # performance of lzma. This improvement is stolen from build.py
-            # (commit r23485).
-            files_delta.sort(key=lambda x: x.path)
+    if old_pkg_info.name != new_pkg_info.name:
+        ctx.ui.warning(_("The file '%s' belongs to a different package "
+                         "other than '%s'. Skipping it...")
+                         % (old_package, new_pkg_info.name))
+        return None
 
-            for finfo in files_delta:
-                orgname = util.join_path("install", finfo.path)
-                if new_pkg_info.debug_package:
-                    orgname = util.join_path("debug", finfo.path)
-                delta_pkg.add_to_install(orgname, finfo.path)
+    if old_pkg_info.release == new_pkg_info.release:
+        ctx.ui.warning(_("Package '%s' has the same release number with "
+                         "the new package. Skipping it...") % old_package)
+        return None
 
+    delta_name = "-".join((old_pkg_info.name,
+                           old_pkg_info.release,
+                           new_pkg_info.release,
+                           new["distro_id"],
+                           new["arch"])) + ctx.const.delta_package_suffix
+
+    ctx.ui.info(_("Creating %s...") % delta_name)
+
+    # Every delta gets its own work directory for the install archive and
+    # patches, deltas of the same package are created concurrently.
+    work_dir = util.join_path(ctx.config.tmp_dir(), delta_name)
+    util.clean_dir(work_dir)
+    util.ensure_dirs(work_dir)
+
+    if new["out_dir"]:
+        delta_name = util.join_path(new["out_dir"], delta_name)
+
+    cwd = os.getcwd()
+    try:
+        if not write_delta_package(delta_name, old_package, old_pkg, work_dir):
+            return None
+    except:
+        # A partly written delta would be taken as an existing one
+        if os.path.exists(delta_name):
+            os.unlink(delta_name)
+        raise
+    finally:
         os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return delta_name
+
+def write_delta_package(delta_name, old_package, old_pkg, work_dir):
+    """Write the delta package from old_pkg to the new package into
+    delta_name using work_dir, return False if it is skipped"""
+
+    new = _new_package
+    new_pkg_info = new["info"]
+    new_pkg_files = new["files"]
+    new_pkg_path = new["path"]
+
+    old_pkg_files = old_pkg.get_files()
+
+    files_delta = find_delta(old_pkg_files, new_pkg_files, new["hashes"])
+
+    install_dir = "debug" if new_pkg_info.debug_package else "install"
+    patches = None
+    if new["binary_diff"] and files_delta:
+        patches = create_patches(old_pkg, old_pkg_files, files_delta,
+                                 util.join_path(new_pkg_path, install_dir),
+                                 work_dir)
+        patched = set(patch.path for patch in patches.list)
+        files_delta = [f for f in files_delta if f.path not in patched]
+
+    if len(files_delta) == len(new_pkg_files.list):
+        ctx.ui.warning(_("All files in the package '%s' are different "
+                         "from the files in the new package. Skipping "
+                         "it...") % old_package)
+        return False
+
+    delta_pkg = pisi.package.Package(delta_name, "w", format=new["format"],
+                                     tmp_dir=work_dir)
+
+    # add binary patches and their list
+    if patches and patches.list:
+        patches_xml = util.join_path(work_dir, ctx.const.patches_xml)
+        patches.write(patches_xml)
+        delta_pkg.add_to_package(patches_xml, ctx.const.patches_xml)
+        for patch in patches.list:
+            delta_pkg.add_to_package(util.join_path(work_dir, patch.name),
+                                     util.join_path(ctx.const.patches_dir, patch.name))
+
+    # add comar files to package
+    os.chdir(new["specdir"])
+    for pcomar in new_pkg_info.providesComar:
+        fname = util.join_path(ctx.const.comar_dir, pcomar.script)
+        delta_pkg.add_to_package(fname)
+
+    # add xmls and files
+    os.chdir(new_pkg_path)
+
+    delta_pkg.add_metadata_xml(ctx.const.metadata_xml)
+    delta_pkg.add_files_xml(ctx.const.files_xml)
+
+    # only metadata information may change in a package,
+    # so no install archive added to delta package
+    if files_delta:
+        # Sort the files in-place according to their path for an ordered
+        # tarfile layout which dramatically improves the compression
+        # performance of lzma. This improvement is stolen from build.py
+        # (commit r23485).
+        files_delta.sort(key=lambda x: x.path)
+
+        for finfo in files_delta:
+            orgname = util.join_path(install_dir, finfo.path)
+            delta_pkg.add_to_install(orgname, finfo.path)
+
+    delta_pkg.close()
+    return True
+
+def open_install_archive(package):
+    """Return a streaming TarFile of the install archive of package"""
+    archive_name, archive_format = package.archive_name_and_format(package.format)
+    if archive_name is None or not package.impl.has_file(archive_name):
+        return None
+
+    # LZMAFile reads both xz and legacy lzma streams
+    fileobj = lzma.LZMAFile(package.impl.open(archive_name))
+    return tarfile.open(fileobj=fileobj, mode="r|")
+
+def create_patches(old_pkg, old_files, files_delta, install_dir, patch_dir):
+    """Create binary patches for the changed regular files which also exist
+    in the old package. Patch data is written under patch_dir and only
+    patches smaller than the compressed new file are kept."""
+
+    patches = Patches()
+
+    old_hashes = dict((f.path, f.hash) for f in old_files.list if f.hash)
+    candidates = {}
+    for finfo in files_delta:
+        if finfo.hash is None or finfo.path not in old_hashes:
+            continue
+        path = util.join_path(install_dir, finfo.path)
+        if os.path.islink(path) or not os.path.isfile(path) or \
+                os.path.getsize(path) < binary_diff_min_size:
+            continue
+        candidates[finfo.path] = finfo
 
-        delta_pkg.close()
-        delta_packages.append(delta_name)
+    if not candidates:
+        return patches
 
-    # Return delta package names
-    return delta_packages
+    tar = open_install_archive(old_pkg)
+    if tar is None:
+        return patches
 
-def create_delta_packages(old_packages, new_package):
+    util.ensure_dirs(patch_dir)
+    for tarinfo in tar:
+        finfo = candidates.get(tarinfo.name)
+        if finfo is None or not tarinfo.isreg() or not tarinfo.size:
+            continue
+
+        # Both files are mapped instead of read, the old one is
+        # extracted to an unlinked temporary file first
+        with tempfile.TemporaryFile(dir=patch_dir) as old_file, \
+                open(util.join_path(install_dir, finfo.path), "rb") as new_file:
+            shutil.copyfileobj(tar.extractfile(tarinfo), old_file)
+            old_file.flush()
+            with map_file(old_file) as old_data, map_file(new_file) as new_data:
+                data = bdiff.diff(old_data, new_data)
+                new_size = len(new_data)
+                if data is None or len(data) >= len(zlib.compress(new_data, 1)):
+                    continue
+
+        name = "%d.bdiff" % len(patches.list)
+        with open(util.join_path(patch_dir, name), "wb") as f:
+            f.write(data)
+
+        patch = Patch()
+        patch.path = finfo.path
+        patch.name = name
+        patch.oldHash = old_hashes[finfo.path]
+        patch.hash = finfo.hash
+        patches.list.append(patch)
+
+        ctx.ui.info(_("Binary patch of /%s: %d bytes instead of %d") %
+                    (finfo.path, len(data), new_size), verbose=True)
+
+    tar.close()
+    return patches
+
+def read_patches(package):
+    """Return the binary patches of a delta package or None"""
+    if not package.impl.has_file(ctx.const.patches_xml):
+        return None
+
+    patches = Patches()
+    patches.parse(package.impl.read_file(ctx.const.patches_xml))
+    return patches
+
+def check_patches(package, dest_dir):
+    """Return the paths whose installed files do not match the files the
+    binary patches of package were created against"""
+    patches = read_patches(package)
+    if patches is None:
+        return []
+
+    mismatched = []
+    for patch in patches.list:
+        path = util.join_path(dest_dir, patch.path)
+        try:
+            if os.path.islink(path) or util.sha1_file(path) != patch.oldHash:
+                mismatched.append(patch.path)
+        except util.FileError:
+            mismatched.append(patch.path)
+
+    return mismatched
+
+def apply_patches(package, dest_dir):
+    """Rebuild the patched files of a delta package from installed files"""
+    patches = read_patches(package)
+    if patches is None:
+        return
+
+    for patch in patches.list:
+        path = util.join_path(dest_dir, patch.path)
+        with open(path, "rb") as f, map_file(f) as old_data:
+            if util.sha1_data(old_data) != patch.oldHash:
+                raise Error(_("Cannot apply binary patch, /%s has been changed") % patch.path)
+
+            data = package.impl.read_file(util.join_path(ctx.const.patches_dir, patch.name))
+            new_data = bdiff.patch(old_data, data)
+
+        if util.sha1_data(new_data) != patch.hash:
+            raise Error(_("Binary patch of /%s gives a corrupt file") % patch.path)
+
+        # Write next to the old file and rename over it, the old inode may
+        # still be in use (shared libraries, running executables).
+        tmp = path + ctx.const.temporary_suffix
+        with open(tmp, "wb") as f:
+            f.write(new_data)
+        st = os.stat(path)
+        os.chmod(tmp, st.st_mode)
+        os.chown(tmp, st.st_uid, st.st_gid)
+        os.rename(tmp, path)
+
+def create_delta_packages(old_packages, new_package, out_dir=None):
     if new_package in old_packages:
         ctx.ui.warning(_("New package '%s' exists in the list of old "
                          "packages. Skipping it...") % new_package)
@@ -121,21 +368,23 @@ def create_delta_packages(old_packages, new_package):
     new_pkg = pisi.package.Package(new_package, tmp_dir=new_pkg_path)
     new_pkg.read()
 
-    # Unpack new package to temp
-    new_pkg.extract_pisi_files(new_pkg_path)
-    new_pkg.extract_dir("comar", new_pkg_path)
-
-    install_dir = util.join_path(new_pkg_path, "install")
-    util.clean_dir(install_dir)
-    os.mkdir(install_dir)
-    new_pkg.extract_install(install_dir)
+    try:
+        # Unpack new package to temp
+        new_pkg.extract_pisi_files(new_pkg_path)
+        new_pkg.extract_dir("comar", new_pkg_path)
 
-    delta_packages = create_delta_packages_from_obj(old_packages,
-                                                    new_pkg,
-                                                    new_pkg_path)
+        install_dir = util.join_path(new_pkg_path, "install")
+        util.clean_dir(install_dir)
+        os.mkdir(install_dir)
+        new_pkg.extract_install(install_dir)
 
-    # Remove temp dir
-    util.clean_dir(new_pkg_path)
+        delta_packages = create_delta_packages_from_obj(old_packages,
+                                                        new_pkg,
+                                                        new_pkg_path,
+                                                        out_dir=out_dir)
+    finally:
+        # Remove temp dir
+        shutil.rmtree(new_pkg_path, ignore_errors=True)
 
     # Return delta package names
     return delta_packages
@@ -144,17 +393,67 @@ def create_delta_package(old_package, new_package):
     packages = create_delta_packages([old_package], new_package)
     return packages or None
 
+def create_repo_delta_packages(repo_dir, releases=5):
+    """Create delta packages for every package in repo_dir from its
+    previous releases (at most releases of them) found in the same tree.
+
+    Deltas are written next to the new package unless an output directory
+    is given, existing deltas are not created again."""
+
+    groups = {}
+    for root, dirs, files in os.walk(repo_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for fn in files:
+            if fn.endswith(ctx.const.delta_package_suffix) or \
+                    not fn.endswith(ctx.const.package_suffix):
+                continue
+            name, version, release, distro_id, arch = util.split_package_filename(fn)
+            try:
+                release = int(release)
+            except (TypeError, ValueError):
+                continue
+            groups.setdefault((name, distro_id, arch), []).append(
+                    (release, os.path.join(root, fn)))
+
+    out_dir = ctx.get_option("output_dir")
+    delta_packages = []
+    for (name, distro_id, arch), packages in sorted(groups.items()):
+        if len(packages) < 2:
+            continue
+
+        packages.sort()
+        new_release, new_package = packages[-1]
+        target_dir = out_dir or os.path.dirname(new_package)
+
+        old_packages = []
+        for old_release, old_package in packages[-releases - 1:-1]:
+            delta_name = "-".join((name, str(old_release), str(new_release),
+                                   distro_id, arch)) + ctx.const.delta_package_suffix
+            if not os.path.exists(util.join_path(target_dir, delta_name)):
+                old_packages.append(old_package)
+
+        if old_packages:
+            delta_packages.extend(create_delta_packages(old_packages, new_package,
+                                                        out_dir=target_dir))
+
+    return delta_packages
+
 
 #  Hash not equals                      (these are the deltas)
 #  Hash equal but path different ones   (these are the relocations)
 #  Hash and also path equal ones        (do nothing)
 
-def find_delta(old_files, new_files):
+def files_by_hash(files):
     hashto_files = {}
-    for f in new_files.list:
+    for f in files.list:
         hashto_files.setdefault(f.hash, []).append(f)
+    return hashto_files
+
+def find_delta(old_files, new_files, hashto_files=None):
+    if hashto_files is None:
+        hashto_files = files_by_hash(new_files)
 
-    new_hashes = {f.hash for f in new_files.list}
+    new_hashes = set(hashto_files)
     old_hashes = {f.hash for f in old_files.list}
     hashes_delta = new_hashes - old_hashes
 
@@ -10,7 +10,11 @@
 # Please read the COPYING file.
 #
 
+import os
 import sys
+import time
+import multiprocessing
+import multiprocessing.connection
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -24,6 +28,9 @@ import pisi.atomicoperations as atomicoperations
 import pisi.ui as ui
 import pisi.db
 
+class Error(pisi.Error):
+    pass
+
 def emerge(A):
     # A was a list, remove duplicates and expand components
     A = [str(x) for x in A]
@@ -67,11 +74,14 @@ installed in the respective order to satisfy dependencies:
 
     # ctx.ui.notify(ui.packagestogo, order=order_build)
 
-    for x in order_build:
-        package_names = atomicoperations.build(x).new_packages
-        pisi.operations.install.install_pkg_files(package_names, reinstall=True)  # handle inter-package deps here
-        # reset counts between builds
-        ctx.ui.errors = ctx.ui.warnings = 0
+    jobs = ctx.get_option('jobs') or ctx.config.values.build.emergejobs
+    load = ctx.get_option('load_average') or ctx.config.values.build.emergeload
+    scheduler = BuildScheduler(order_build, source_dependencies(G_f, order_build),
+                               jobs=int(jobs or 1), load=float(load or 0),
+                               log_dir=ctx.config.tmp_dir())
+    start = time.time()
+    scheduler.run()
+    report_build_times(order_build, scheduler.deps, scheduler.times, time.time() - start)
 
     # FIXME: take a look at the fixme above :(, we have to be sure
     # that order_build is a known type...
@@ -146,3 +156,194 @@ def plan_emerge(A):
     G_f2, order_inst = pisi.operations.install.plan_install_pkg_names(install_list)
 
     return G_f, order_inst, order_build
+
+def source_dependencies(G_f, order_build):
+    """Return the sources each source of order_build has to wait for"""
+    if G_f is None:
+        # Dependencies are not known, build in the given order
+        return dict((x, set(order_build[i - 1:i])) for i, x in enumerate(order_build))
+
+    sources = set(order_build)
+    return dict((x, set(G_f.adj(x)) & sources) for x in order_build)
+
+def critical_path(order_build, deps, times):
+    """Return the longest chain of dependent builds and its build time"""
+    finish = {}
+    previous = {}
+    for x in order_build:
+        if x not in times:
+            continue
+        before = [d for d in deps[x] if d in finish]
+        previous[x] = max(before, key=lambda d: finish[d]) if before else None
+        finish[x] = times[x] + (finish[previous[x]] if previous[x] else 0)
+
+    if not finish:
+        return [], 0
+
+    last = max(finish, key=lambda x: finish[x])
+    path = []
+    x = last
+    while x:
+        path.append(x)
+        x = previous[x]
+    path.reverse()
+    return path, finish[last]
+
+def report_build_times(order_build, deps, times, total):
+    if not times:
+        return
+
+    ctx.ui.info(_("Build times:"))
+    for x in order_build:
+        if x in times:
+            ctx.ui.info("  %-30s %8.1fs" % (x, times[x]))
+
+    path, length = critical_path(order_build, deps, times)
+    ctx.ui.info(_("Critical path: %s (%.1fs)") % (" -> ".join(path), length))
+    ctx.ui.info(_("Total time: %.1fs, sum of build times: %.1fs")
+                % (total, sum(times.values())))
+
+def build_source(name):
+    """Build the source package name and return its package files"""
+    return atomicoperations.build(name).new_packages
+
+def install_packages(package_names):
+    pisi.operations.install.install_pkg_files(package_names, reinstall=True)  # handle inter-package deps here
+    # reset counts between builds
+    ctx.ui.errors = ctx.ui.warnings = 0
+
+def run_build(build, name, conn, log_file):
+    """Entry point of the build processes"""
+    if log_file:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+
+    try:
+        result = (True, build(name))
+    except Exception as e:
+        result = (False, str(e))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    conn.send(result)
+    conn.close()
+
+class BuildScheduler(object):
+    """Builds the sources of an emerge operation. A source is built after
+    the sources it depends on have been built and installed. Up to jobs
+    sources are built at the same time in child processes, and no new
+    build is started while the load average is above load. The packages
+    of the finished builds are installed one build at a time by the
+    scheduler."""
+
+    def __init__(self, order_build, deps, jobs=1, load=0, log_dir=None,
+                 build=build_source, install=install_packages):
+        self.order_build = order_build
+        self.deps = deps
+        self.jobs = max(jobs, 1)
+        self.load = load
+        self.log_dir = log_dir
+        self.build = build
+        self.install = install
+        self.times = {}
+
+        # Sources with longer chains of sources waiting for them go first
+        dependents = dict((x, []) for x in order_build)
+        for x in order_build:
+            for d in deps[x]:
+                dependents[d].append(x)
+        self.height = {}
+        for x in reversed(order_build):
+            self.height[x] = 1 + max([self.height[y] for y in dependents[x]] or [0])
+
+    def run(self):
+        if self.jobs == 1:
+            self.run_serial()
+        else:
+            self.run_parallel()
+
+    def run_serial(self):
+        for x in self.order_build:
+            start = time.time()
+            package_names = self.build(x)
+            self.times[x] = time.time() - start
+            self.install(package_names)
+
+    def log_file(self, name):
+        if self.log_dir:
+            return os.path.join(self.log_dir, "%s-emerge.log" % name)
+
+    def overloaded(self):
+        return self.load and os.getloadavg()[0] >= self.load
+
+    def start(self, name):
+        receiver, sender = multiprocessing.Pipe(False)
+        log_file = self.log_file(name)
+        process = multiprocessing.get_context("fork").Process(
+            target=run_build, args=(self.build, name, sender, log_file))
+        process.start()
+        sender.close()
+
+        if log_file:
+            ctx.ui.info(_("Building %s, log file: %s") % (name, log_file))
+        else:
+            ctx.ui.info(_("Building %s") % name)
+        return process, receiver, time.time()
+
+    def run_parallel(self):
+        pending = list(self.order_build)
+        done = set()
+        running = {}
+        failed = []
+
+        try:
+            while pending or running:
+                while pending and not failed and len(running) < self.jobs:
+                    ready = [x for x in pending if self.deps[x] <= done]
+                    if not ready or (running and self.overloaded()):
+                        break
+                    name = max(ready, key=lambda x: self.height[x])
+                    pending.remove(name)
+                    running[name] = self.start(name)
+
+                if not running:
+                    break
+
+                # Check the load average again from time to time
+                timeout = 5 if self.load and pending else None
+                receivers = dict((receiver, name) for name, (process, receiver, start)
+                                 in running.items())
+                for receiver in multiprocessing.connection.wait(list(receivers), timeout):
+                    name = receivers[receiver]
+                    process, receiver, start = running.pop(name)
+                    try:
+                        ok, result = receiver.recv()
+                    except EOFError:
+                        ok, result = False, _("build process exited with status %s") \
+                                % process.exitcode
+                    receiver.close()
+                    process.join()
+                    self.times[name] = time.time() - start
+
+                    if not ok:
+                        ctx.ui.error(_("Building %s failed: %s") % (name, result))
+                        failed.append(name)
+                        continue
+
+                    ctx.ui.info(_("%s is built in %.1fs") % (name, self.times[name]))
+                    self.install(result)
+                    done.add(name)
+        finally:
+            for process, receiver, start in running.values():
+                process.terminate()
+                process.join()
+                receiver.close()
+
+        if failed:
+            raise Error(_("Building failed: %s") % ", ".join(failed))
+        if pending:
+            raise Error(_("Cannot build %s, dependencies are not built")
+                        % ", ".join(pending))
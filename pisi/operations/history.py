@@ -10,6 +10,8 @@
 # Please read the COPYING file.
 
 import os
+import concurrent.futures
+
 import gettext
 __trans = gettext.translation("pisi", fallback=True)
 _ = __trans.gettext  # Python 3'te ugettext yerine gettext kullanılır
@@ -19,6 +21,7 @@ import pisi.context as ctx
 import pisi.util
 import pisi.db
 import pisi.fetcher
+import pisi.file
 
 class PackageNotFound(pisi.Error):
     pass
@@ -50,51 +53,99 @@ def __listactions(actions):
 
     return beinstalled, beremoved, configs
 
-def __getpackageurl(package):
+# Number of packages downloaded at the same time
+fetch_jobs = 4
+
+def package_repos(names):
+    """Return a dictionary of the repositories of the packages in names.
+    Packages which are not in any repository are looked up in the
+    obsoleted packages of the binary repositories."""
     packagedb = pisi.db.packagedb.PackageDB()
     repodb = pisi.db.repodb.RepoDB()
-    pkg, ver = pisi.util.parse_package_name(package)
 
-    reponame = None
-    try:
-        reponame = packagedb.which_repo(pkg)
-    except Exception:
-        # Maybe this package is obsoleted from repository
+    repos = {}
+    names = set(names)
+    for repo in repodb.list_repos():
+        for name in names.difference(repos):
+            if packagedb.has_package(name, repo):
+                repos[name] = repo
+
+    missing = names.difference(repos)
+    if missing:
+        # Maybe these packages are obsoleted from repository
         for repo in repodb.get_binary_repos():
-            if pkg in packagedb.get_obsoletes(repo):
-                reponame = repo
-
-    if not reponame:
-        raise PackageNotFound
-
-    repourl = repodb.get_repo_url(reponame)
-    ctx.ui.info(_("Package %s found in repository %s") % (pkg, reponame))
-
-    # return _possible_ url for this package
-    return os.path.join(os.path.dirname(repourl),
-                        pisi.util.parse_package_dir_path(package),
-                        package)
-
-def fetch_remote_file(package, errors):
-    try:
-        uri = pisi.file.File.make_uri(__getpackageurl(package))
-    except PackageNotFound:
-        errors.append(package)
-        ctx.ui.info(pisi.util.colorize(_("%s could not be found") % (package), "red"))
-        return False
+            for name in missing.intersection(packagedb.get_obsoletes(repo)):
+                repos[name] = repo
+
+    return repos
 
+def package_urls(packages):
+    """Return a dictionary of the _possible_ urls of the package files,
+    None for the packages which are not found"""
+    repodb = pisi.db.repodb.RepoDB()
+    names = dict((package, pisi.util.parse_package_name(package)[0]) for package in packages)
+    repos = package_repos(names.values())
+
+    urls = {}
+    repo_urls = {}
+    for package in packages:
+        reponame = repos.get(names[package])
+        if not reponame:
+            urls[package] = None
+            continue
+
+        if reponame not in repo_urls:
+            repo_urls[reponame] = repodb.get_repo_url(reponame)
+        ctx.ui.info(_("Package %s found in repository %s") % (names[package], reponame))
+        urls[package] = os.path.join(os.path.dirname(repo_urls[reponame]),
+                                     pisi.util.parse_package_dir_path(package),
+                                     package)
+    return urls
+
+def fetch_packages(packages):
+    """Download the package files which are not in the package cache,
+    fetch_jobs at a time. Return the paths of the package files and the
+    packages which could not be found."""
     dest = ctx.config.cached_packages_dir()
-    filepath = os.path.join(dest, uri.filename())
-    if not os.path.exists(filepath):
-        try:
-            pisi.fetcher.fetch_url(uri, dest, ctx.ui.Progress)
-        except pisi.fetcher.FetchError as e:  # Exception, not as e
+    urls = package_urls(packages)
+
+    errors = []
+    paths = []
+    downloads = []
+    for package in packages:
+        if urls[package] is None:
             errors.append(package)
             ctx.ui.info(pisi.util.colorize(_("%s could not be found") % (package), "red"))
-            return False
-    else:
-        ctx.ui.info(_('%s [cached]') % uri.filename())
-    return True
+            continue
+
+        uri = pisi.file.File.make_uri(urls[package])
+        filepath = os.path.join(dest, uri.filename())
+        if os.path.exists(filepath):
+            ctx.ui.info(_('%s [cached]') % uri.filename())
+            paths.append(filepath)
+        else:
+            downloads.append((package, uri, filepath))
+
+    def fetch(uri):
+        # Progress bars of concurrent downloads would be mixed up
+        pisi.fetcher.fetch_url(uri, dest, ctx.ui.Progress if fetch_jobs == 1 else None)
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, fetch_jobs)) as executor:
+        jobs = dict((executor.submit(fetch, uri), (package, filepath))
+                    for package, uri, filepath in downloads)
+        for count, job in enumerate(concurrent.futures.as_completed(jobs)):
+            package, filepath = jobs[job]
+            try:
+                job.result()
+            except pisi.fetcher.FetchError:
+                errors.append(package)
+                ctx.ui.info(pisi.util.colorize(_("%s could not be found") % (package), "red"))
+                continue
+            ctx.ui.info(pisi.util.colorize(_("Downloaded %s (%d / %d)") % (
+                os.path.basename(filepath), count + 1, len(jobs)), "yellow"))
+            paths.append(filepath)
+
+    return paths, errors
 
 def get_snapshot_actions(operation):
     actions = {}
@@ -149,13 +200,7 @@ def takeback(operation):
     if (beremoved or beinstalled) and not ctx.ui.confirm(_('Do you want to continue?')):
         return
 
-    errors = []
-    paths = []
-    for pkg in beinstalled:
-        ctx.ui.info(pisi.util.colorize(_("Downloading %d / %d") % (beinstalled.index(pkg) + 1, len(beinstalled)), "yellow"))
-        pkg += ctx.const.package_suffix
-        if fetch_remote_file(pkg, errors):
-            paths.append(os.path.join(ctx.config.cached_packages_dir(), pkg))
+    paths, errors = fetch_packages([pkg + ctx.const.package_suffix for pkg in beinstalled])
 
     if errors:
         ctx.ui.info(_("\nFollowing packages could not be found in repositories and are not cached:\n") + 
@@ -129,14 +129,21 @@ def install_pkg_names(A, reinstall=False, extra=False):
     if not ctx.get_option('ignore_package_conflicts'):
         conflicts = operations.helper.check_conflicts(order, packagedb)
 
+    # Packages are downloaded while they are installed in stream mode
+    stream = not ctx.get_option('fetch_only') and \
+            (ctx.get_option('stream') or ctx.config.values.general.stream_install)
+
     paths = []
     extra_paths = {}
     for x in order:
-        ctx.ui.info(util.colorize(_("Downloading %d / %d") % (order.index(x) + 1, len(order)), "yellow"))
-        install_op = atomicoperations.Install.from_name(x)
-        paths.append(install_op.package_fname)
+        if stream:
+            path = x
+        else:
+            ctx.ui.info(util.colorize(_("Downloading %d / %d") % (order.index(x) + 1, len(order)), "yellow"))
+            path = atomicoperations.Install.from_name(x).package_fname
+        paths.append(path)
         if x in extra_packages or (extra and x in A):
-            extra_paths[install_op.package_fname] = x
+            extra_paths[path] = x
         elif reinstall and x in installdb.installed_extra:
             installdb.installed_extra.remove(x)
             with open(os.path.join(ctx.config.info_dir(), ctx.const.installed_extra), "w") as ie_file:
@@ -152,7 +159,10 @@ def install_pkg_names(A, reinstall=False, extra=False):
 
     for path in paths:
         ctx.ui.info(util.colorize(_("Installing %d / %d") % (paths.index(path) + 1, len(paths)), "yellow"))
-        install_op = atomicoperations.Install(path)
+        if stream:
+            install_op = atomicoperations.Install.from_name(path, stream=True)
+        else:
+            install_op = atomicoperations.Install(path)
         install_op.install(False)
         try:
             with open(os.path.join(ctx.config.info_dir(), ctx.const.installed_extra), "a") as ie_file:
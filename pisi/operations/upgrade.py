@@ -23,6 +23,7 @@ import pisi.atomicoperations as atomicoperations
 import pisi.operations as operations
 import pisi.util as util
 import pisi.db
+import pisi.db.versiontable
 import pisi.blacklist
 
 def check_update_actions(packages):
@@ -62,6 +63,13 @@ def check_update_actions(packages):
 
     return has_actions
 
+def is_upgradable(name):
+    installdb = pisi.db.installdb.InstallDB()
+    packagedb = pisi.db.packagedb.PackageDB()
+    upgrades, different, latest = pisi.db.versiontable.find_upgrades(
+        installdb.version_table, packagedb.get_version_table(), [name])
+    return bool(upgrades)
+
 def find_upgrades(packages, replaces):
     packagedb = pisi.db.packagedb.PackageDB()
     installdb = pisi.db.installdb.InstallDB()
@@ -70,46 +78,34 @@ def find_upgrades(packages, replaces):
     security_only = ctx.get_option('security_only')
     comparesha1sum = ctx.get_option('compare_sha1sum')
 
-    Ap = []
-    ds = []
+    installed = installdb.version_table
+    available = packagedb.get_version_table()
+
+    names = []
     for i_pkg in packages:
 
-        if i_pkg in replaces.keys():
+        if i_pkg in replaces:
             continue
 
         if i_pkg.endswith(ctx.const.package_suffix):
             ctx.ui.debug(_("Warning: package *name* ends with '.pisi'"))
 
-        if not installdb.has_package(i_pkg):
+        if i_pkg not in installed:
             ctx.ui.info(_('Package %s is not installed.') % i_pkg, True)
             continue
 
-        if not packagedb.has_package(i_pkg):
+        if i_pkg not in available:
             ctx.ui.info(_('Package %s is not available in repositories.') % i_pkg, True)
             continue
 
-        pkg = packagedb.get_package(i_pkg)
-        hash = installdb.get_install_tar_hash(i_pkg)
-        (version, release, build, distro, distro_release) = installdb.get_version_and_distro_release(i_pkg)
+        names.append(i_pkg)
 
-        if security_only and not pkg.has_update_type("security", release):
-            continue
+    Ap, ds, latest = pisi.db.versiontable.find_upgrades(installed, available, names,
+                                                        security_only, comparesha1sum)
 
-        if pkg.distribution == distro and \
-                pisi.version.make_version(pkg.distributionRelease) > pisi.version.make_version(distro_release):
-            Ap.append(i_pkg)
-
-        else:
-            if int(release) < int(pkg.release):
-                Ap.append(i_pkg)
-            elif comparesha1sum and \
-                int(release) == int(pkg.release) and \
-                not pkg.installTarHash == hash:
-                Ap.append(i_pkg)
-                ds.append(i_pkg)
-            else:
-                ctx.ui.info(_('Package %s is already at the latest release %s.')
-                            % (pkg.name, pkg.release), True)
+    for i_pkg in latest:
+        ctx.ui.info(_('Package %s is already at the latest release %s.')
+                    % (i_pkg, available.row(i_pkg)[1]), True)
 
     if debug and ds:
         ctx.ui.status(_('The following packages have different sha1sum:'))
@@ -193,8 +189,15 @@ def upgrade(A=None, repo=None):
     if not ctx.get_option('ignore_package_conflicts'):
         conflicts = operations.helper.check_conflicts(order, packagedb)
 
+    # Packages are downloaded while they are installed in stream mode
+    stream = not ctx.get_option('fetch_only') and \
+            (ctx.get_option('stream') or ctx.config.values.general.stream_install)
+
     paths = []
     for x in order:
+        if stream:
+            paths.append(x)
+            continue
         ctx.ui.info(util.colorize(_("Downloading %d / %d") % (order.index(x) + 1, len(order)), "yellow"))
         install_op = atomicoperations.Install.from_name(x)
         paths.append(install_op.package_fname)
@@ -210,7 +213,11 @@ def upgrade(A=None, repo=None):
 
     for path in paths:
         ctx.ui.info(util.colorize(_("Installing %d / %d") % (paths.index(path) + 1, len(paths)), "yellow"))
-        install_op = atomicoperations.Install(path, ignore_file_conflicts=True)
+        if stream:
+            install_op = atomicoperations.Install.from_name(path, stream=True)
+            install_op.ignore_file_conflicts = True
+        else:
+            install_op = atomicoperations.Install(path, ignore_file_conflicts=True)
         install_op.install(not ctx.get_option('compare_sha1sum'))
 
 def plan_upgrade(A, force_replaced=True, replaces=None):
@@ -13,6 +13,7 @@
 """package abstraction methods to add/remove files, extract control files"""
 
 import os.path
+import time
 import gettext
 import pisi
 import pisi.context as ctx
@@ -23,6 +24,7 @@ import pisi.file
 import pisi.files
 import pisi.util as util
 import pisi.fetcher
+import pisi.xzblock
 
 __trans = gettext.translation('pisi', fallback=True)
 _ = __trans.gettext
@@ -54,7 +56,8 @@ class Package:
         archive_name = ctx.const.install_tar + archive_suffix
         return archive_name, archive_format
 
-    def __init__(self, packagefn, mode='r', format=None, tmp_dir=None):
+    def __init__(self, packagefn, mode='r', format=None, tmp_dir=None,
+                 compression_level=None):
         self.filepath = packagefn
         url = pisi.uri.URI(packagefn)
 
@@ -88,6 +91,8 @@ class Package:
             raise Error(_("Unsupported package format: %s") % format)
 
         self.tmp_dir = tmp_dir or ctx.config.tmp_dir()
+        self.compression_level = compression_level
+        self.compression_time = 0
 
     def fetch_remote_file(self, url):
         dest = ctx.config.cached_packages_dir()
@@ -124,9 +129,13 @@ class Package:
             archive_name, archive_format = self.archive_name_and_format(self.format)
             self.install_archive_path = util.join_path(self.tmp_dir, archive_name)
             ctx.build_leftover = self.install_archive_path
-            self.install_archive = archive.ArchiveTar(self.install_archive_path, archive_format)
+            self.install_archive = archive.ArchiveTar(self.install_archive_path,
+                                                      archive_format,
+                                                      compresslevel=self.compression_level)
 
+        start = time.time()
         self.install_archive.add_to_archive(name, arcname)
+        self.compression_time += time.time() - start
 
     def add_metadata_xml(self, path):
         self.metadata = pisi.metadata.MetaData()
@@ -143,7 +152,14 @@ class Package:
     def close(self):
         """Close the package archive"""
         if self.install_archive:
+            start = time.time()
             self.install_archive.close()
+            self.compression_time += time.time() - start
+            ctx.ui.info(_("Compressed %s in %.2f seconds (level %s, %d threads)") %
+                        (os.path.basename(self.install_archive_path),
+                         self.compression_time,
+                         self.install_archive.compresslevel or ctx.config.values.build.compressionlevel,
+                         self.install_archive.get_threads()))
             arcpath = self.install_archive_path
             arcname = os.path.basename(arcpath)
             self.add_to_package(arcpath, arcname)
@@ -160,7 +176,18 @@ class Package:
         if archive_name is None or not self.impl.has_file(archive_name):
             return
 
-        archive_file = self.impl.open(archive_name)
+        archive_file = None
+        if archive_format == "tarxz":
+            # Multi-block archives stored uncompressed in the package are
+            # decompressed in parallel
+            member = self.impl.stored_member(archive_name)
+            if member:
+                offset, size = member
+                archive_file = pisi.xzblock.block_reader(self.filepath, offset, size)
+
+        if archive_file is None:
+            archive_file = self.impl.open(archive_name)
+
         tar = archive.ArchiveTar(fileobj=archive_file,
                                  arch_type=archive_format,
                                  no_same_permissions=False,
@@ -198,23 +225,10 @@ class Package:
 
     def extract_install(self, outdir):
         def callback(tarinfo, extracted):
-            if not extracted:
-                # Installing packages (especially shared libraries) is a
-                # bit tricky. You should also change the inode if you
-                # change the file, cause the file is opened already and
-                # accessed. Removing and creating the file will also
-                # change the inode and will do the trick (in fact, old
-                # file will be deleted only when its closed).
-                #
-                # Also, tar.extract() doesn't write on symlinks... Not any
-                # more :).
-                if os.path.isfile(tarinfo.name) or os.path.islink(tarinfo.name):
-                    try:
-                        os.unlink(tarinfo.name)
-                    except OSError as e:
-                        ctx.ui.warning(e)
-
-            else:
+            # Files are written to a temporary name and renamed over the
+            # old ones by the extractor, so running programs keep using
+            # the old inode (especially shared libraries).
+            if extracted:
                 # Added for package-manager
                 if tarinfo.name.endswith(".desktop"):
                     ctx.ui.notify(pisi.ui.desktopfile, desktopfile=tarinfo.name)
@@ -222,7 +236,13 @@ class Package:
         tar = self.get_install_archive()
 
         if tar:
-            tar.unpack_dir(outdir, callback=callback)
+            # Create the directory skeleton up front if the file list
+            # has already been read
+            dirs = None
+            if getattr(self, "files", None):
+                dirs = set(os.path.dirname(f.path) for f in self.files.list)
+                dirs.discard("")
+            tar.unpack_dir(outdir, callback=callback, dirs=dirs)
         else:
             self.extract_dir_flat('install', outdir)
 
@@ -34,6 +34,14 @@ class Replace(pisi.relation.Relation):
             s += _(" release ") + self.release
         return s
 
+def parse_replace(node):
+    """Return the Replace relation of a Package element under Replaces"""
+    replace = Replace()
+    replace.package = node.text
+    for attr in ("version", "versionFrom", "versionTo", "release", "releaseFrom", "releaseTo"):
+        setattr(replace, attr, node.get(attr))
+    return replace
+
 def installed_package_replaced(repinfo):
     """Determine if an installed package in *repository* is replaced by
     the given package."""
@@ -23,7 +23,6 @@ import pisi.context as ctx
 import pisi.archive
 import pisi.uri
 import pisi.fetcher
-import pisi.mirrors
 
 
 class Error(pisi.Error):
@@ -82,32 +81,15 @@ class SourceArchive:
         pisi.fetcher.fetch_url(src, ctx.config.archives_dir(), self.progress)
 
     def fetch_from_mirror(self):
-        uri = self.url.get_uri()
-        sep = uri[len("mirrors://"):].split("/")
-        name = sep.pop(0)
-        archive = "/".join(sep)
-
-        mirrors = pisi.mirrors.Mirrors().get_mirrors(name)
-        if not mirrors:
-            raise Error(_("%s mirrors are not defined.") % name)
-
-        for mirror in mirrors:
-            try:
-                url = os.path.join(mirror, archive)
-                ctx.ui.warning(_('Fetching source from mirror: %s') % url)
-                pisi.fetcher.fetch_url(url, ctx.config.archives_dir(), self.progress)
-                return
-            except pisi.fetcher.FetchError:
-                pass
-
-        raise pisi.fetcher.FetchError(_('Could not fetch source from %s mirrors.') % name)
+        # The fetcher tries the mirrors in the order of their measured speed
+        pisi.fetcher.fetch_url(self.url, ctx.config.archives_dir(), self.progress)
 
     def is_cached(self, interactive=True):
         if not os.access(self.archiveFile, os.R_OK):
             return False
 
         # check hash
-        if util.check_file_hash(self.archiveFile, self.archive.sha1sum):
+        if util.check_file_hash(self.archiveFile, self.archive.sha1sum, cache=True):
             if interactive:
                 ctx.ui.info(_('%s [cached]') % self.archive.name)
             return True
@@ -116,7 +98,7 @@ class SourceArchive:
 
     def unpack(self, target_dir, clean_dir=True):
         # check archive file's integrity
-        if not util.check_file_hash(self.archiveFile, self.archive.sha1sum):
+        if not util.check_file_hash(self.archiveFile, self.archive.sha1sum, cache=True):
             raise Error(_("unpack: check_file_hash failed"))
 
         try:
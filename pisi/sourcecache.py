@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Cache of unpacked and patched source trees.
+
+The tree of a source package is stored after its archives have been
+unpacked, the additional source files copied and the patches applied.
+Its key is a hash of the archive hashes, the additional files and the
+patches, so builds with the same sources restore the tree instead of
+unpacking and patching again. Only the newest tree of each source is
+kept.
+
+Files are copied with reflinks where the file system supports them and
+with plain copies otherwise. Hard links are not used: builds modify
+files of the source tree in place, which would change the cache too."""
+
+import os
+import errno
+import fcntl
+import shutil
+import hashlib
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+import pisi.util as util
+import pisi.context as ctx
+
+# ioctl of Linux cloning a file into another one sharing its extents
+FICLONE = 0x40049409
+
+def clone_file(src, dest):
+    """Copy src to dest with a reflink if possible"""
+    with open(src, "rb") as fsrc:
+        with open(dest, "wb") as fdest:
+            try:
+                fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+                return
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                                   errno.EINVAL, errno.EBADF):
+                    raise
+            shutil.copyfileobj(fsrc, fdest, 1024 * 1024)
+
+def copy_tree(src, dest):
+    """Copy the tree at src to dest keeping modes, times and symlinks"""
+    os.makedirs(dest)
+    for root, dirs, files in os.walk(src):
+        target = os.path.join(dest, os.path.relpath(root, src))
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            new = os.path.join(target, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), new)
+            elif os.path.isdir(path):
+                os.mkdir(new)
+            else:
+                clone_file(path, new)
+                shutil.copystat(path, new)
+
+    # Directory times after their contents have been created
+    for root, dirs, files in os.walk(src):
+        for name in dirs:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                shutil.copystat(path, os.path.join(dest, os.path.relpath(path, src)))
+    shutil.copystat(src, dest)
+
+def hash_file(sha, path):
+    if os.path.exists(path):
+        sha.update(util.sha1_file(path).encode("utf-8"))
+    else:
+        sha.update(b"missing")
+
+def tree_key(builder):
+    """Return the key of the patched source tree of builder"""
+    source = builder.spec.source
+    files_dir = os.path.join(builder.specdir, ctx.const.files_dir)
+    sha = hashlib.sha256()
+
+    for archive in source.archive:
+        sha.update(("archive %s %s %s %s\n" % (archive.sha1sum, archive.type,
+                                               archive.target, archive.name)).encode("utf-8"))
+
+    for afile in source.additionalFiles:
+        sha.update(("file %s %s %s " % (afile.filename, afile.target,
+                                        afile.permission)).encode("utf-8"))
+        hash_file(sha, os.path.join(files_dir, afile.filename))
+        sha.update(b"\n")
+
+    # Patches are applied in the work directory set by actions.py
+    work_dir = builder.actionGlobals.get("WorkDir") if builder.actionGlobals else None
+    sha.update(("workdir %s\n" % work_dir).encode("utf-8"))
+
+    for patch in source.patches:
+        sha.update(("patch %s %s %s %s " % (patch.filename, patch.level, patch.reverse,
+                                            patch.compressionType)).encode("utf-8"))
+        hash_file(sha, os.path.join(files_dir, patch.filename))
+        sha.update(b"\n")
+
+    return sha.hexdigest()
+
+class SourceCache(object):
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or ctx.config.source_cache_dir()
+
+    def tree_dir(self, name, key):
+        return os.path.join(self.cache_dir, name, key)
+
+    def restore(self, name, key, work_dir):
+        """Replace work_dir with the cached tree. Return False if there
+        is no tree for key."""
+        tree = self.tree_dir(name, key)
+        if not os.path.isdir(tree):
+            return False
+
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+        copy_tree(tree, work_dir)
+        return True
+
+    def store(self, name, key, work_dir, exclude=()):
+        """Store the tree at work_dir as the tree of key, replacing the
+        older trees of name"""
+        source_dir = os.path.join(self.cache_dir, name)
+        tmp = "%s.%d%s" % (self.tree_dir(name, key), os.getpid(), ctx.const.temporary_suffix)
+        util.ensure_dirs(source_dir)
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+
+        try:
+            copy_tree(work_dir, tmp)
+            for path in exclude:
+                path = os.path.join(tmp, path)
+                if os.path.lexists(path):
+                    os.unlink(path)
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        for old in os.listdir(source_dir):
+            if old != os.path.basename(tmp):
+                shutil.rmtree(os.path.join(source_dir, old), ignore_errors=True)
+        os.rename(tmp, self.tree_dir(name, key))
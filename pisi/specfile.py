@@ -183,6 +183,7 @@ class Source:
     t_Version = [autoxml.String, autoxml.optional]
     t_Release = [autoxml.String, autoxml.optional]
     t_SourceURI = [autoxml.String, autoxml.optional]  # used in index
+    t_CompressionLevel = [autoxml.String, autoxml.optional]
 
     def buildtimeDependencies(self):
         return self.buildDependencies
@@ -234,6 +235,7 @@ class Package:
     t_Icon = [autoxml.String, autoxml.optional]
     t_BuildFlags = [[autoxml.String], autoxml.optional, "BuildFlags/Flag"]
     t_BuildType = [autoxml.String, autoxml.optional]
+    t_CompressionLevel = [autoxml.String, autoxml.optional]
     t_BuildDependencies = [[pisi.dependency.Dependency], autoxml.optional, "Dependency"]
     t_AdditionalFiles = [[AdditionalFile], autoxml.optional, "AdditionalFile"]
     t_Provides = [[pisi.replace.Replace], autoxml.optional, "Replace"]
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Installing packages while they are downloaded.
+
+A .pisi file is a zip archive whose members are written in the order
+metadata.xml, files.xml, install archive and finally the zip central
+directory. StreamPackage reads the local headers of the members straight
+from the download stream, keeps the control files in memory and extracts
+the install archive into a staging directory as its bytes arrive. The
+SHA1 of the package is computed over the whole stream and the staged
+files are moved into place only if it matches the repository index."""
+
+import os
+import stat
+import errno
+import zlib
+import shutil
+import struct
+import hashlib
+import tempfile
+import zipfile
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+import pisi.context as ctx
+import pisi.util as util
+import pisi.archive as archive
+import pisi.fetcher
+import pisi.package
+import pisi.uri
+
+BUFFER_SIZE = 64 * 1024
+
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+_local_header = struct.Struct("<4s5H3L2H")
+
+# General purpose flags which make a member unreadable from a stream
+_FLAG_ENCRYPTED = 0x1
+_FLAG_DATA_DESCRIPTOR = 0x8
+
+class Error(pisi.Error):
+    pass
+
+class NotStreamable(Error):
+    """The package has to be downloaded before it can be read"""
+    pass
+
+class HashingReader(object):
+    """Reads a download stream, computing its SHA1, reporting progress
+    and optionally keeping a copy of the data"""
+
+    def __init__(self, stream, progress=None, copy=None):
+        self.stream = stream
+        self.progress = progress
+        self.copy = copy
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+
+    def read(self, size):
+        data = self.stream.read(size)
+        self.sha1.update(data)
+        if self.copy:
+            self.copy.write(data)
+        self.size += len(data)
+        if self.progress:
+            self.progress.update(self.size)
+        return data
+
+    def read_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.read(size - len(data))
+            if not chunk:
+                raise Error(_("Unexpected end of package stream"))
+            data += chunk
+        return data
+
+    def drain(self):
+        while self.read(BUFFER_SIZE):
+            pass
+
+    def hexdigest(self):
+        return self.sha1.hexdigest()
+
+class MemberReader(object):
+    """File object for the data of a zip member in the stream"""
+
+    def __init__(self, stream, size, method):
+        self.stream = stream
+        self.left = size
+        self.buf = b""
+        if method == zipfile.ZIP_DEFLATED:
+            self.decompressor = zlib.decompressobj(-15)
+        else:
+            self.decompressor = None
+
+    def _read_raw(self, size):
+        data = self.stream.read(min(size, self.left))
+        if not data and self.left:
+            raise Error(_("Unexpected end of package stream"))
+        self.left -= len(data)
+        return data
+
+    def read(self, size=-1):
+        if size < 0:
+            size = float("inf")
+
+        if self.decompressor is None:
+            chunks = []
+            while size and self.left:
+                data = self._read_raw(min(size, BUFFER_SIZE))
+                chunks.append(data)
+                size -= len(data)
+            return b"".join(chunks)
+
+        while len(self.buf) < size and (self.left or self.decompressor.unconsumed_tail):
+            raw = self.decompressor.unconsumed_tail or self._read_raw(BUFFER_SIZE)
+            self.buf += self.decompressor.decompress(raw, BUFFER_SIZE)
+
+        if size == float("inf"):
+            size = len(self.buf)
+        data = self.buf[:size]
+        self.buf = self.buf[size:]
+        return data
+
+    def skip(self):
+        while self.left:
+            self._read_raw(BUFFER_SIZE)
+        self.buf = b""
+
+def read_member_header(stream):
+    """Read the next local header of a zip stream and return the name,
+    compression method and compressed size of the member, or None at the
+    start of the central directory"""
+
+    signature = stream.read_exactly(4)
+    if signature != LOCAL_HEADER_SIGNATURE:
+        return None
+
+    header = signature + stream.read_exactly(_local_header.size - 4)
+    (signature, version, flags, method, mtime, mdate,
+     crc, compressed_size, size, name_length, extra_length) = _local_header.unpack(header)
+
+    name = stream.read_exactly(name_length).decode("utf-8")
+    stream.read_exactly(extra_length)
+
+    if flags & (_FLAG_ENCRYPTED | _FLAG_DATA_DESCRIPTOR):
+        raise NotStreamable(_("Member %s has no size in its local header") % name)
+    if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        raise NotStreamable(_("Member %s uses an unsupported compression method") % name)
+
+    return name, method, compressed_size
+
+class MemoryArchive(object):
+    """The control files of a streamed package"""
+
+    def __init__(self):
+        self.members = {}
+
+    def has_file(self, path):
+        return path in self.members
+
+    def read_file(self, path):
+        return self.members[path]
+
+    def close(self):
+        pass
+
+class StreamPackage(pisi.package.Package):
+    """A remote package which is installed while it is downloaded"""
+
+    def __init__(self, packagefn, sha1sum, tmp_dir=None):
+        self.filepath = packagefn
+        self.sha1sum = sha1sum
+        self.tmp_dir = tmp_dir or ctx.config.tmp_dir()
+        self.install_archive = None
+        self.impl = MemoryArchive()
+        self.member = None
+        self.install_member = None
+
+        url = pisi.uri.URI(packagefn)
+        dest = ctx.config.cached_packages_dir()
+        fetcher = pisi.fetcher.Fetcher(url, dest)
+        self.response = fetcher.open()
+
+        # Keep a copy in the package cache only if it is enabled, the
+        # point of streaming is not to write the package to disk
+        self.cache_file = None
+        copy = None
+        if ctx.config.values.general.package_cache:
+            self.cache_file = fetcher.archive_file
+            copy = open(fetcher.partial_file, "wb")
+
+        progress = pisi.fetcher.UIHandler(ctx.ui.Progress)
+        progress.start(fetcher.partial_file, url.get_uri(),
+                       os.path.basename(fetcher.partial_file),
+                       getattr(self.response, "length", None), None)
+        self.stream = HashingReader(self.response, progress, copy)
+        self.partial_file = fetcher.partial_file
+
+        try:
+            self.read_control_files()
+            self.read()
+            self.format = self.metadata.package.packageFormat or \
+                    pisi.package.Package.default_format
+
+            if self.format not in pisi.package.Package.formats:
+                raise Error(_("Unsupported package format: %s") % self.format)
+        except:
+            self.close_stream()
+            raise
+
+    def read_control_files(self):
+        """Read the members before the install archive"""
+        archive_names = [self.archive_name_and_format(format)[0]
+                         for format in pisi.package.Package.formats]
+
+        while True:
+            header = read_member_header(self.stream)
+            if header is None:
+                raise NotStreamable(_("Package has no install archive"))
+
+            name, method, size = header
+            member = MemberReader(self.stream, size, method)
+            if name in archive_names:
+                self.install_member = name
+                self.member = member
+                break
+
+            self.impl.members[name] = member.read()
+
+        if not self.impl.has_file(ctx.const.metadata_xml) or \
+                not self.impl.has_file(ctx.const.files_xml):
+            raise NotStreamable(_("Control files are not at the start of the package"))
+
+    def get_install_archive(self):
+        archive_name, archive_format = self.archive_name_and_format(self.format)
+        if archive_name != self.install_member:
+            raise Error(_("Install archive %s does not match the package format") %
+                        self.install_member)
+
+        return archive.ArchiveTar(fileobj=self.member,
+                                  arch_type=archive_format,
+                                  no_same_permissions=False,
+                                  no_same_owner=False)
+
+    def finish_download(self):
+        """Read the rest of the package and verify its hash"""
+        self.member.skip()
+        while True:
+            header = read_member_header(self.stream)
+            if header is None:
+                break
+            name, method, size = header
+            self.impl.members[name] = MemberReader(self.stream, size, method).read()
+        self.stream.drain()
+
+        if self.stream.hexdigest() != self.sha1sum:
+            raise pisi.Error(_("Download Error: Package does not match the repository package."))
+
+        if self.stream.copy:
+            self.stream.copy.close()
+            self.stream.copy = None
+            os.rename(self.partial_file, self.cache_file)
+
+    def close_stream(self):
+        self.response.close()
+        if self.stream.copy:
+            self.stream.copy.close()
+            self.stream.copy = None
+            os.unlink(self.partial_file)
+
+    def extract_install(self, outdir):
+        stage_dir = tempfile.mkdtemp(prefix=".pisi-stage-", dir=self.tmp_dir)
+        try:
+            super(StreamPackage, self).extract_install(stage_dir)
+            self.finish_download()
+            commit_staged(stage_dir, outdir)
+        finally:
+            self.close_stream()
+            shutil.rmtree(stage_dir, ignore_errors=True)
+
+def move_file(source, dest):
+    try:
+        os.rename(source, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Copy next to the destination first so that running programs
+        # keep the old inode
+        tmp = util.join_path(os.path.dirname(dest),
+                             ".pisi-new." + os.path.basename(dest))
+        shutil.copy2(source, tmp, follow_symlinks=False)
+        st = os.lstat(source)
+        os.lchown(tmp, st.st_uid, st.st_gid)
+        os.rename(tmp, dest)
+        os.unlink(source)
+
+def replace_directory(staged, dest):
+    """Remove the directory dest which is replaced by a file or symlink"""
+    if os.path.islink(staged):
+        # Move the old contents to the directory the symlink points to
+        target = os.path.join(os.path.dirname(dest), os.readlink(staged))
+        if os.path.isdir(target):
+            for name in os.listdir(dest):
+                if not os.path.lexists(os.path.join(target, name)):
+                    shutil.move(os.path.join(dest, name), os.path.join(target, name))
+    shutil.rmtree(dest)
+
+def commit_staged(stage_dir, dest_dir):
+    """Move the files extracted into stage_dir over to dest_dir"""
+    directories = []
+    is_root = os.geteuid() == 0
+
+    for root, dirs, files in os.walk(stage_dir):
+        relative = os.path.relpath(root, stage_dir)
+        target_root = os.path.normpath(util.join_path(dest_dir, relative))
+
+        for name in sorted(dirs + files):
+            staged = os.path.join(root, name)
+            dest = os.path.join(target_root, name)
+
+            if os.path.isdir(staged) and not os.path.islink(staged):
+                # Existing directories and symlinks to directories are
+                # used as they are, like tar does
+                if not os.path.isdir(dest):
+                    if os.path.lexists(dest):
+                        os.unlink(dest)
+                    os.mkdir(dest)
+                directories.append((staged, dest))
+                continue
+
+            if os.path.isdir(dest) and not os.path.islink(dest):
+                replace_directory(staged, dest)
+            move_file(staged, dest)
+
+    # Directory attributes last, deepest first
+    for staged, dest in reversed(directories):
+        if os.path.islink(dest):
+            continue
+        st = os.stat(staged)
+        if is_root:
+            os.chown(dest, st.st_uid, st.st_gid)
+        os.chmod(dest, stat.S_IMODE(st.st_mode))
+        os.utime(dest, (st.st_atime, st.st_mtime))
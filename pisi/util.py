@@ -46,6 +46,8 @@ class Singleton(type):
 # pisi modules
 import pisi
 import pisi.context as ctx
+import pisi.hashcache
+import pisi.filetype
 
 class Error(pisi.Error):
     pass
@@ -432,6 +434,50 @@ def is_ar_file(file_path):
     with open(file_path, 'rb') as f:
         return f.read(8) == b'!<arch>\n'
 
+def strip_file(filepath, fileinfo, outpath):
+    """Strip an elf file from debug symbols. The debug info of executables
+    and shared objects is saved to outpath when debug packages are
+    generated. Return True if the file is stripped."""
+    def run(cmd):
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = p.communicate()[0]
+        if p.returncode:
+            ctx.ui.warning(_("%s command failed for file '%s'!") % (cmd[0], filepath))
+            ctx.ui.info(_("Output:\n%s") % out.decode("utf-8", "replace"), verbose=True)
+        return p.returncode == 0
+
+    def save_elf_debug():
+        """copy debug info into file.debug file and mark the file to use it"""
+        # Several files may be processed at the same time
+        os.makedirs(os.path.dirname(outpath), exist_ok=True)
+        debug_file = outpath + ctx.const.debug_file_suffix
+        if run(["objcopy", "--only-keep-debug", filepath, debug_file]):
+            run(["objcopy", "--add-gnu-debuglink=%s" % debug_file, filepath])
+
+    if fileinfo is None:
+        fileinfo = pisi.filetype.detect(filepath)
+        if fileinfo is None:
+            return False
+
+    if fileinfo.startswith("current ar archive"):
+        run(["strip", "--strip-debug", filepath])
+        return True
+
+    elif "SB executable" in fileinfo or "SB shared object" in fileinfo:
+        if ctx.config.values.build.generatedebug:
+            save_elf_debug()
+        if "SB executable" in fileinfo:
+            run(["strip", filepath])
+        else:
+            run(["strip", "--strip-unneeded", filepath])
+        return True
+
+    elif "SB relocatable" in fileinfo:
+        run(["strip", "--strip-debug", filepath])
+        return True
+
+    return False
+
 def clean_ar_timestamps(ar_file):
     """Zero all timestamps in the ar files."""
     if not is_ar_file(ar_file):
@@ -492,12 +538,18 @@ def get_file_hashes(top, excludePrefix=None, removePrefix=None):
             if is_included(root):
                 yield calculate_hash(root)
 
-def check_file_hash(filename, hash):
+def check_file_hash(filename, hash, cache=False):
     """Check the file's integrity with a given hash."""
-    return sha1_file(filename) == hash
+    return sha1_file(filename, cache) == hash
+
+def sha1_file(filename, cache=False):
+    """Calculate sha1 hash of file. If cache is set, the hash is taken
+    from the verified hash cache while the file is unchanged."""
+    if cache:
+        return pisi.hashcache.sha1_file(filename, _sha1_file)
+    return _sha1_file(filename)
 
-def sha1_file(filename):
-    """Calculate sha1 hash of file."""
+def _sha1_file(filename):
     try:
         m = hashlib.sha1()
         with open(filename, 'rb') as f:
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Multi-block xz files.
+
+BlockWriter compresses its input in chunks of the dictionary size of the
+preset, at most 8 MiB, each into an independent xz block, and writes all
+of them into a single xz stream
+with an index of the blocks at its end. Any xz decoder reads the result
+as a normal xz file. BlockReader uses the index to decompress the blocks
+in parallel threads; liblzma releases the interpreter lock while it
+works, so this scales with the number of cores."""
+
+import os
+import lzma
+import zlib
+import struct
+import collections
+import multiprocessing
+import multiprocessing.pool
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.gettext
+
+import pisi
+
+MiB = 1024 * 1024
+
+# Dictionary size and encoder memory usage of the xz presets 0-9, see xz(1)
+DICT_SIZES = (MiB // 4, MiB, 2 * MiB, 4 * MiB, 4 * MiB, 8 * MiB, 8 * MiB,
+              16 * MiB, 32 * MiB, 64 * MiB)
+ENCODER_MEMORY = (3 * MiB, 9 * MiB, 17 * MiB, 32 * MiB, 48 * MiB, 94 * MiB,
+                  94 * MiB, 186 * MiB, 370 * MiB, 674 * MiB)
+MAX_BLOCK_SIZE = 8 * MiB
+
+HEADER_MAGIC = b"\xfd7zXZ\x00"
+FOOTER_MAGIC = b"YZ"
+HEADER_SIZE = 12
+FOOTER_SIZE = 12
+
+class Error(pisi.Error):
+    pass
+
+Block = collections.namedtuple("Block", "offset unpadded_size uncompressed_offset uncompressed_size")
+
+def _padded(size):
+    return (size + 3) & ~3
+
+def _encode_vli(value):
+    data = bytearray()
+    while value >= 0x80:
+        data.append((value & 0x7f) | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+def _decode_vli(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data) or shift > 63:
+            raise Error(_("Invalid xz index"))
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def _crc32(data):
+    return struct.pack("<I", zlib.crc32(data) & 0xffffffff)
+
+def encode_index(records):
+    """Return the xz index of (unpadded size, uncompressed size) records"""
+    index = bytearray(b"\x00")
+    index += _encode_vli(len(records))
+    for unpadded_size, uncompressed_size in records:
+        index += _encode_vli(unpadded_size)
+        index += _encode_vli(uncompressed_size)
+    index += b"\x00" * (_padded(len(index)) - len(index))
+    return bytes(index) + _crc32(index)
+
+def encode_footer(stream_flags, index_size):
+    data = struct.pack("<I", index_size // 4 - 1) + stream_flags
+    return _crc32(data) + data + FOOTER_MAGIC
+
+def decode_index(index):
+    if index[:1] != b"\x00" or _crc32(index[:-4]) != index[-4:]:
+        raise Error(_("Invalid xz index"))
+    count, pos = _decode_vli(index, 1)
+    records = []
+    for i in range(count):
+        unpadded_size, pos = _decode_vli(index, pos)
+        uncompressed_size, pos = _decode_vli(index, pos)
+        records.append((unpadded_size, uncompressed_size))
+    return records
+
+def decode_footer(footer):
+    if footer[10:] != FOOTER_MAGIC or _crc32(footer[4:10]) != footer[:4]:
+        raise Error(_("Invalid xz stream footer"))
+    backward_size, = struct.unpack("<I", footer[4:8])
+    return footer[8:10], (backward_size + 1) * 4
+
+def compress_block(data, preset):
+    """Compress data into a single xz block.
+
+    Returns the stream header, the padded block and its index record."""
+    stream = lzma.compress(data, format=lzma.FORMAT_XZ,
+                           check=lzma.CHECK_CRC64, preset=preset)
+    flags, index_size = decode_footer(stream[-FOOTER_SIZE:])
+    index = stream[-FOOTER_SIZE - index_size:-FOOTER_SIZE]
+    records = decode_index(index)
+    if len(records) != 1:
+        raise Error(_("Unexpected number of xz blocks"))
+    unpadded_size, uncompressed_size = records[0]
+    block = stream[HEADER_SIZE:HEADER_SIZE + _padded(unpadded_size)]
+    return stream[:HEADER_SIZE], block, records[0]
+
+def parse_preset(value):
+    """Return the lzma preset for a compression level like 6 or "9e"""
+    level = str(value).strip()
+    extreme = level.endswith("e")
+    if extreme:
+        level = level[:-1]
+    if not level.isdigit() or not 0 <= int(level) <= 9:
+        raise Error(_("Invalid compression level: %s") % value)
+
+    preset = int(level)
+    if extreme:
+        preset |= lzma.PRESET_EXTREME
+    return preset
+
+def preset_block_size(preset):
+    """Return the uncompressed block size for preset, its dictionary size
+    but at most MAX_BLOCK_SIZE, so that most install archives have
+    several blocks to decompress in parallel"""
+    return min(DICT_SIZES[preset & ~lzma.PRESET_EXTREME], MAX_BLOCK_SIZE)
+
+def memory_budget():
+    """Return the memory compressor threads may use, a quarter of the
+    physical memory"""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 4
+    except (ValueError, OSError):
+        return 1024 * MiB
+
+def max_jobs(preset, memory=None):
+    """Return the number of compressor threads which fit in memory.
+
+    Each thread needs an encoder and keeps up to two blocks and their
+    compressed data in memory."""
+    if memory is None:
+        memory = memory_budget()
+    per_job = ENCODER_MEMORY[preset & ~lzma.PRESET_EXTREME] + 4 * preset_block_size(preset)
+    return max(1, memory // per_job)
+
+class BlockWriter(object):
+    """Write-only file object producing a multi-block xz file.
+
+    Blocks are compressed by jobs threads. Block boundaries only depend
+    on block_size, by default derived from the preset, so the output is
+    the same for any number of threads."""
+
+    def __init__(self, fileobj, preset=6, block_size=None, jobs=1):
+        self.fileobj = fileobj
+        self.preset = preset
+        self.block_size = block_size or preset_block_size(preset)
+        self.buf = []
+        self.buf_size = 0
+        self.records = []
+        self.header = None
+        self.pos = 0
+
+        self.jobs = jobs
+        self.pool = multiprocessing.pool.ThreadPool(jobs) if jobs > 1 else None
+        self.pending = collections.deque()
+
+    def write(self, data):
+        size = len(data)
+        self.buf.append(bytes(data))
+        self.buf_size += size
+        self.pos += size
+        if self.buf_size >= self.block_size:
+            data = b"".join(self.buf)
+            end = len(data) - len(data) % self.block_size
+            for start in range(0, end, self.block_size):
+                self.write_block(data[start:start + self.block_size])
+            self.buf = [data[end:]]
+            self.buf_size = len(data) - end
+        return size
+
+    def write_block(self, data):
+        if self.pool is None:
+            self.write_compressed(compress_block(data, self.preset))
+            return
+
+        # Keep the number of blocks in memory bounded
+        while len(self.pending) >= self.jobs * 2:
+            self.write_compressed(self.pending.popleft().get())
+        self.pending.append(self.pool.apply_async(compress_block, (data, self.preset)))
+
+    def write_compressed(self, compressed):
+        header, block, record = compressed
+        if self.header is None:
+            self.header = header
+            self.fileobj.write(header)
+        self.fileobj.write(block)
+        self.records.append(record)
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if self.fileobj is None:
+            return
+        if self.buf_size or not (self.records or self.pending):
+            self.write_block(b"".join(self.buf))
+        self.buf = []
+
+        while self.pending:
+            self.write_compressed(self.pending.popleft().get())
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+
+        index = encode_index(self.records)
+        self.fileobj.write(index)
+        self.fileobj.write(encode_footer(self.header[6:8], len(index)))
+        self.fileobj.close()
+        self.fileobj = None
+
+def read_blocks(pread, size):
+    """Return the stream header and blocks of a single stream xz file"""
+    header = pread(HEADER_SIZE, 0)
+    if len(header) != HEADER_SIZE or not header.startswith(HEADER_MAGIC):
+        raise Error(_("Not an xz file"))
+
+    footer = pread(FOOTER_SIZE, size - FOOTER_SIZE)
+    flags, index_size = decode_footer(footer)
+    if flags != header[6:8]:
+        raise Error(_("Stream flags of xz header and footer do not match"))
+
+    index_offset = size - FOOTER_SIZE - index_size
+    records = decode_index(pread(index_size, index_offset))
+
+    blocks = []
+    offset = HEADER_SIZE
+    uncompressed_offset = 0
+    for unpadded_size, uncompressed_size in records:
+        blocks.append(Block(offset, unpadded_size, uncompressed_offset, uncompressed_size))
+        offset += _padded(unpadded_size)
+        uncompressed_offset += uncompressed_size
+
+    if offset != index_offset:
+        # Concatenated streams or stream padding, blocks are not all known
+        raise Error(_("xz file is not a single stream"))
+
+    return header, blocks
+
+def decompress_block(header, block_data, block):
+    """Decompress a block by wrapping it into a stream of its own"""
+    index = encode_index([(block.unpadded_size, block.uncompressed_size)])
+    stream = header + block_data + index + encode_footer(header[6:8], len(index))
+    try:
+        data = lzma.decompress(stream, format=lzma.FORMAT_XZ)
+    except lzma.LZMAError as e:
+        raise Error(_("Corrupted xz block: %s") % e)
+    if len(data) != block.uncompressed_size:
+        raise Error(_("Corrupted xz block: size mismatch"))
+    return data
+
+def block_reader(path, offset=0, size=None, jobs=None):
+    """Return a BlockReader of the xz file at path if its index has more
+    than one block, None if it is not worth reading it in parallel"""
+    try:
+        reader = BlockReader(path, offset, size, jobs)
+    except (Error, OSError):
+        return None
+
+    if len(reader.blocks) < 2:
+        reader.close()
+        return None
+
+    return reader
+
+class BlockReader(object):
+    """Read-only file object over a multi-block xz file or a part of a
+    file, such as an uncompressed zip member. The blocks following the
+    current read position are decompressed in parallel."""
+
+    def __init__(self, path, offset=0, size=None, jobs=None):
+        self.fd = os.open(path, os.O_RDONLY)
+        try:
+            self.offset = offset
+            self.size = size if size is not None else os.fstat(self.fd).st_size - offset
+            self.header, self.blocks = read_blocks(self.pread, self.size)
+        except:
+            os.close(self.fd)
+            raise
+
+        self.uncompressed_size = sum(block.uncompressed_size for block in self.blocks)
+        self.jobs = jobs or min(multiprocessing.cpu_count(), 4)
+        self.pool = multiprocessing.pool.ThreadPool(self.jobs) if self.jobs > 1 else None
+        self.name = path
+
+        self.pos = 0
+        self.next_block = 0
+        self.pending = collections.deque()
+        self.buf = b""
+        self.buf_start = 0
+
+    def pread(self, size, offset):
+        return os.pread(self.fd, size, self.offset + offset)
+
+    def decompress(self, block):
+        data = self.pread(_padded(block.unpadded_size), block.offset)
+        return decompress_block(self.header, data, block)
+
+    def fill(self):
+        """Make the block containing the read position current"""
+        while self.next_block < len(self.blocks) and len(self.pending) < self.jobs:
+            block = self.blocks[self.next_block]
+            if self.pool:
+                result = self.pool.apply_async(self.decompress, (block,))
+            else:
+                result = self.decompress(block)
+            self.pending.append((block, result))
+            self.next_block += 1
+
+        if not self.pending:
+            return False
+
+        block, result = self.pending.popleft()
+        self.buf = result.get() if self.pool else result
+        self.buf_start = block.uncompressed_offset
+        return True
+
+    def read(self, size=-1):
+        chunks = []
+        while size:
+            start = self.pos - self.buf_start
+            if not 0 <= start < len(self.buf):
+                if not self.fill():
+                    break
+                continue
+            end = len(self.buf) if size < 0 else min(len(self.buf), start + size)
+            chunks.append(self.buf[start:end])
+            self.pos += end - start
+            if size > 0:
+                size -= end - start
+        return b"".join(chunks)
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self.pos
+        elif whence == os.SEEK_END:
+            pos += self.uncompressed_size
+
+        if not self.buf_start <= pos < self.buf_start + len(self.buf):
+            pending = [block for block, result in self.pending]
+            if not pending or not pending[0].uncompressed_offset <= pos:
+                # Restart the pipeline at the block containing pos
+                self.pending.clear()
+                self.buf = b""
+                self.next_block = 0
+                for number, block in enumerate(self.blocks):
+                    if block.uncompressed_offset + block.uncompressed_size > pos:
+                        self.next_block = number
+                        break
+                else:
+                    self.next_block = len(self.blocks)
+                self.buf_start = pos
+
+        self.pos = pos
+        return pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+# Compare files/sec of the extraction engine and the old per-member
+# tarfile.extract path on a synthetic archive with many small files.
+#
+# Usage: benchmark-extract.py [files] [size]
+
+import os
+import io
+import sys
+import time
+import shutil
+import tarfile
+import tempfile
+
+import pisi.archive
+
+def make_archive(path, count, size):
+    data = b"x" * size
+    with tarfile.open(path, "w") as tar:
+        for i in range(count):
+            name = "usr/share/bench/%03d/file-%d" % (i % 100, i)
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = size
+            tarinfo.mode = 0o644
+            tarinfo.mtime = time.time()
+            tar.addfile(tarinfo, io.BytesIO(data))
+
+def run(path, method, target):
+    archive = pisi.archive.ArchiveTar(path, "tar",
+                                      no_same_permissions=False,
+                                      no_same_owner=False)
+    start = time.time()
+    getattr(archive, method)(target)
+    return time.time() - start
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+
+    work = tempfile.mkdtemp(prefix="pisi-bench-")
+    try:
+        path = os.path.join(work, "bench.tar")
+        make_archive(path, count, size)
+
+        for method in ("unpack_dir_by_member", "unpack_dir"):
+            # First run on an empty tree, second one over the old files
+            target = os.path.join(work, method)
+            os.mkdir(target)
+            for run_name in ("fresh", "upgrade"):
+                elapsed = run(path, method, target)
+                print("%-22s %-8s %8.0f files/s" % (method, run_name,
+                                                     count / elapsed))
+            shutil.rmtree(target)
+    finally:
+        shutil.rmtree(work)
+
+if __name__ == "__main__":
+    main()
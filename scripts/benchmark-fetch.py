@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+# Compare requests/sec of the pooled HTTP client and a new connection per
+# file, as done by urllib, against a local keep-alive HTTP server.
+#
+# Usage: benchmark-fetch.py [requests] [size]
+
+import sys
+import time
+import threading
+import http.server
+import urllib.request
+
+import pisi.httpclient
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    data = b""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.data)))
+        self.end_headers()
+        self.wfile.write(self.data)
+
+def pooled(url, count):
+    client = pisi.httpclient.HTTPClient()
+    for i in range(count):
+        client.open(url).read()
+
+def per_connection(url, count):
+    for i in range(count):
+        with urllib.request.urlopen(url) as response:
+            response.read()
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    Handler.data = b"x" * (int(sys.argv[2]) if len(sys.argv) > 2 else 4096)
+
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = "http://127.0.0.1:%d/file" % httpd.server_address[1]
+
+    try:
+        for method in (per_connection, pooled):
+            start = time.time()
+            method(url, count)
+            print("%-16s %8.0f requests/s" % (method.__name__,
+                                             count / (time.time() - start)))
+    finally:
+        httpd.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+# Compare removing the files of a synthetic large package one by one, with
+# a database lookup and a walk over the parent directories per file, and
+# with the batched removal of Remove.remove_files.
+#
+# Usage: benchmark-remove.py [files] [files per directory]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import pisi.context as ctx
+import pisi.atomicoperations as atomicoperations
+
+class FilesDB(object):
+    def __init__(self, owners):
+        self.owners = owners
+
+    def get_file(self, path):
+        return self.owners.get(path), path
+
+    def get_packages(self, paths):
+        return dict((p, self.owners[p]) for p in paths if p in self.owners)
+
+def make_package(root, count, per_dir):
+    files = []
+    for i in range(count):
+        path = "usr/share/big/%d/%d/file%d" % (i // (per_dir * 16), i // per_dir, i)
+        fpath = os.path.join(root, path)
+        if not os.path.isdir(os.path.dirname(fpath)):
+            os.makedirs(os.path.dirname(fpath))
+        open(fpath, "w").close()
+        files.append(SimpleNamespace(path=path, type="data", permanent=None, hash=None))
+    return files
+
+def one_by_one(files):
+    for fileinfo in files:
+        fpath = os.path.join(ctx.config.dest_dir(), fileinfo.path)
+        pkg, path = ctx.filesdb.get_file(fileinfo.path)
+        if pkg and pkg != "big":
+            continue
+        if os.path.isfile(fpath) or os.path.islink(fpath):
+            os.unlink(fpath)
+        dpath = os.path.dirname(fpath)
+        while dpath != ctx.config.dest_dir() and not os.listdir(dpath):
+            os.rmdir(dpath)
+            dpath = os.path.dirname(dpath)
+
+def batched(files):
+    atomicoperations.Remove.remove_files(files, "big")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 60000
+    per_dir = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    for method in (one_by_one, batched):
+        root = tempfile.mkdtemp()
+        try:
+            files = make_package(root, count, per_dir)
+            ctx.config = SimpleNamespace(dest_dir=lambda: root, get_option=lambda opt: None)
+            ctx.filesdb = FilesDB(dict((f.path, "big") for f in files))
+
+            start = time.time()
+            method(files)
+            elapsed = time.time() - start
+            assert os.listdir(root) == []
+            print("%-12s %8.2fs %10.0f files/s" % (method.__name__, elapsed, count / elapsed))
+        finally:
+            shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import pisi.ui
+import pisi.db
+import pisi.context as ctx
+from pisi import asyncapi
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(ctx, "ui", ctx.ui)
+    api = asyncapi.AsyncAPI()
+    yield api
+    api.close()
+
+
+def install(count, installed):
+    ctx.ui.notify(pisi.ui.packagestogo, order=["p%d" % i for i in range(count)])
+    for i in range(count):
+        package = SimpleNamespace(name="p%d" % i)
+        ctx.ui.notify(pisi.ui.installing, package=package, files=None)
+        time.sleep(0.01)
+        installed.append(package.name)
+        ctx.ui.notify(pisi.ui.installed, package=package, files=None)
+    return installed
+
+
+async def collect(api, events):
+    async for event in api.events():
+        events.append(event)
+
+
+@pytest.mark.unit
+def test_events(api):
+    events = []
+
+    async def main():
+        listener = asyncio.ensure_future(collect(api, events))
+        await asyncio.sleep(0)
+        result = await api.call(install, 3, [])
+        await asyncio.sleep(0.01)
+        listener.cancel()
+        return result
+
+    assert asyncio.run(main()) == ["p0", "p1", "p2"]
+    assert [e.kind for e in events] == ["packagestogo"] + ["installing", "installed"] * 3
+    assert events[1].data == {"package": "p0"}
+
+
+@pytest.mark.unit
+def test_cancel(api):
+    installed = []
+
+    async def main():
+        task = asyncio.ensure_future(api.call(install, 100, installed))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The operation has stopped before returning
+        count = len(installed)
+        await asyncio.sleep(0.05)
+        assert len(installed) == count
+
+        # Later calls are not cancelled
+        return await api.call(install, 1, [])
+
+    assert asyncio.run(main()) == ["p0"]
+    assert 0 < len(installed) < 100
+
+
+def fake_fetch_url(url, dest_dir, progress=None, destfile=None):
+    """Write the url as the content of the downloaded file"""
+    with open(os.path.join(dest_dir, os.path.basename(url)), "w") as f:
+        f.write(url)
+
+
+def url_hash(url):
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+@pytest.mark.unit
+def test_concurrent_downloads(api, monkeypatch, tmp_path):
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def fetch_url(url, dest_dir, progress=None, destfile=None):
+        with lock:
+            running.append(url)
+            peak.append(len(running))
+        time.sleep(0.05)
+        fake_fetch_url(url, dest_dir)
+        with lock:
+            running.remove(url)
+
+    monkeypatch.setattr(asyncapi.pisi.fetcher, "fetch_url", fetch_url)
+    urls = ["http://example.com/p%d.pisi" % i for i in range(8)]
+    downloads = [(url, url_hash(url)) for url in urls]
+    start = time.time()
+    asyncio.run(api.download(downloads, str(tmp_path)))
+    assert max(peak) == 4
+    assert time.time() - start < 0.3
+
+
+@pytest.mark.unit
+def test_corrupt_download_removed(api, monkeypatch, tmp_path):
+    monkeypatch.setattr(asyncapi.pisi.fetcher, "fetch_url", fake_fetch_url)
+    url = "http://example.com/p0.pisi"
+
+    with pytest.raises(pisi.Error):
+        asyncio.run(api.download([(url, "0" * 40)], str(tmp_path)))
+    assert not (tmp_path / "p0.pisi").exists()
+
+    asyncio.run(api.download([(url, url_hash(url))], str(tmp_path)))
+    assert (tmp_path / "p0.pisi").read_text() == url
+
+
+class FakePackage(object):
+    name = "bash"
+    distribution = "Pisi Linux"
+    distributionRelease = "2.0"
+    packageHash = url_hash("http://example.com/b/bash/bash-5.0-2-p2-x86_64.pisi")
+
+    def __init__(self, uri):
+        self.packageURI = uri
+
+    def get_delta(self, release):
+        return release == 1 and SimpleNamespace(releaseFrom="1")
+
+
+def fake_dbs(monkeypatch, repo_url, uri="b/bash/bash-5.0-2-p2-x86_64.pisi"):
+    class FakePackageDB(object):
+        def get_package_repo(self, name):
+            return FakePackage(uri), "main"
+
+    class FakeInstallDB(object):
+        def has_package(self, name):
+            return True
+
+        def get_version_and_distro_release(self, name):
+            return "5.0", 1, None, "Pisi Linux", "2.0"
+
+    class FakeRepoDB(object):
+        def get_repo_url(self, repo):
+            return repo_url
+
+    monkeypatch.setattr(pisi.db.packagedb, "PackageDB", FakePackageDB)
+    monkeypatch.setattr(pisi.db.installdb, "InstallDB", FakeInstallDB)
+    monkeypatch.setattr(pisi.db.repodb, "RepoDB", FakeRepoDB)
+    monkeypatch.setattr(ctx.config.values.general, "ignore_delta", False)
+
+
+@pytest.mark.unit
+def test_fetch_installed_package_with_delta(api, monkeypatch, tmp_path):
+    fake_dbs(monkeypatch, "http://example.com/pisi-index.xml.xz")
+    fetched = []
+    monkeypatch.setattr(asyncapi.pisi.fetcher, "fetch_url",
+                        lambda url, dest_dir, progress=None, destfile=None:
+                        fetched.append((url, dest_dir)) or fake_fetch_url(url, dest_dir))
+
+    # The installer upgrades bash with its delta, nothing to prefetch
+    assert asyncapi.package_downloads(["bash"], str(tmp_path), for_install=True) == []
+
+    asyncio.run(api.fetch(["bash"], str(tmp_path)))
+    assert fetched == [("http://example.com/b/bash/bash-5.0-2-p2-x86_64.pisi",
+                        str(tmp_path))]
+
+
+@pytest.mark.unit
+def test_fetch_local_package(api, monkeypatch, tmp_path):
+    fake_dbs(monkeypatch, "/var/repo/pisi-index.xml")
+
+    assert asyncapi.package_downloads(["bash"], str(tmp_path), for_install=True) == []
+    assert asyncapi.package_downloads(["bash"], str(tmp_path)) == \
+        [("/var/repo/b/bash/bash-5.0-2-p2-x86_64.pisi", FakePackage.packageHash)]
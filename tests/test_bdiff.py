@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import mmap
+import time
+import random
+
+import pytest
+
+from pisi import bdiff
+
+
+@pytest.fixture
+def old_data():
+    rnd = random.Random(4113)
+    return bytes(rnd.getrandbits(8) for i in range(512 * 1024))
+
+
+@pytest.mark.unit
+def test_patch_roundtrip(old_data):
+    new = old_data[:1000] + b"one line fix" + old_data[1010:300000] + \
+          os.urandom(100) + old_data[300000:]
+    data = bdiff.diff(old_data, new)
+
+    assert data is not None
+    assert len(data) < len(new) // 100
+    assert bdiff.patch(old_data, data) == new
+
+
+@pytest.mark.unit
+def test_identical_and_empty(old_data):
+    assert bdiff.patch(old_data, bdiff.diff(old_data, old_data)) == old_data
+    assert bdiff.patch(b"", bdiff.diff(b"", b"")) == b""
+
+
+@pytest.mark.unit
+def test_unrelated_data_is_not_diffed(old_data):
+    assert bdiff.diff(old_data, os.urandom(len(old_data))) is None
+
+
+@pytest.mark.unit
+def test_invalid_patch(old_data):
+    with pytest.raises(bdiff.Error):
+        bdiff.patch(old_data, b"garbage")
+
+
+@pytest.mark.unit
+def test_large_mapped_input_is_fast(tmp_path):
+    rnd = random.Random(4113)
+    old = rnd.randbytes(16 * 1024 * 1024)
+    # Edits, an insertion and a deletion spread over the file
+    new = old[:1000000] + b"patched" + old[1000007:6000000] + \
+          rnd.randbytes(5000) + old[6000000:12000000] + old[12004000:]
+
+    old_path = tmp_path / "old"
+    new_path = tmp_path / "new"
+    old_path.write_bytes(old)
+    new_path.write_bytes(new)
+
+    with open(old_path, "rb") as old_file, open(new_path, "rb") as new_file, \
+            mmap.mmap(old_file.fileno(), 0, access=mmap.ACCESS_READ) as old_data, \
+            mmap.mmap(new_file.fileno(), 0, access=mmap.ACCESS_READ) as new_data:
+        start = time.time()
+        data = bdiff.diff(old_data, new_data)
+        elapsed = time.time() - start
+
+        assert bdiff.patch(old_data, data) == new
+
+    assert elapsed < 10
+    assert len(data) < 16 * 1024
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import pisi.uri
+from pisi import buildcache
+
+
+class InstallDB(object):
+    versions = {"zlib": ("1.2.11", "3", None)}
+
+    def has_package(self, name):
+        return name in self.versions
+
+    def get_version(self, name):
+        return self.versions[name]
+
+
+def make_builder(specdir):
+    patch = SimpleNamespace(filename="fix.patch")
+    source = SimpleNamespace(patches=[patch], additionalFiles=[], archive=[],
+                             buildDependencies=[SimpleNamespace(package="zlib")])
+    spec = SimpleNamespace(source=source, packages=[])
+    return SimpleNamespace(specdir=str(specdir), spec=spec,
+                           specuri=pisi.uri.URI(str(specdir / "pspec.xml")),
+                           installdb=InstallDB(), target_package_format="1.2")
+
+
+@pytest.mark.unit
+def test_build_key(tmp_path):
+    (tmp_path / "pspec.xml").write_text("<PISI/>")
+    (tmp_path / "actions.py").write_text("def install(): pass")
+    (tmp_path / "files").mkdir()
+    (tmp_path / "files/fix.patch").write_text("--- a\n+++ b\n")
+    builder = make_builder(tmp_path)
+
+    key = buildcache.build_key(builder)
+    assert buildcache.build_key(builder) == key
+
+    (tmp_path / "files/fix.patch").write_text("--- a\n+++ c\n")
+    patched = buildcache.build_key(builder)
+    assert patched != key
+
+    InstallDB.versions["zlib"] = ("1.2.12", "4", None)
+    assert buildcache.build_key(builder) != patched
+
+
+@pytest.mark.unit
+def test_store_and_evict(tmp_path):
+    cache = buildcache.BuildCache(str(tmp_path / "cache"), limit=2500)
+    output = tmp_path / "output"
+    output.mkdir()
+
+    for number, key in enumerate(("aa01", "bb02", "cc03")):
+        package = output / ("%s.pisi" % key)
+        package.write_bytes(b"x" * 1000)
+        cache.put(key, [str(package)], [])
+        used = time.time() - 100 + number
+        os.utime(os.path.join(cache.entry_dir(key), buildcache.MANIFEST), (used, used))
+
+    # The least recently used build was removed
+    assert sorted(key for used, size, key in cache.entries()) == ["bb02", "cc03"]
+
+    fresh = tmp_path / "fresh"
+    packages, debug_packages = cache.get("cc03", str(fresh))
+    assert packages == [str(fresh / "cc03.pisi")]
+    assert (fresh / "cc03.pisi").read_bytes() == b"x" * 1000
+    assert cache.get("aa01", str(fresh)) is None
+    assert cache.stats() == {"hits": 1, "misses": 1}
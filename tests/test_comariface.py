@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import sys
+import types
+import threading
+import importlib
+
+import pytest
+
+import pisi
+import pisi.ui
+import pisi.api
+import pisi.db.installdb
+import pisi.context as ctx
+
+MISSING = "tr.org.pardus.comar.Missing"
+
+
+class DBusException(Exception):
+
+    def __init__(self, name):
+        Exception.__init__(self, name)
+        self._dbus_error_name = name
+
+
+class ComarObject(object):
+
+    def __init__(self, link, om, name, methods):
+        self.link = link
+        self.om = om
+        self.name = name
+        self.methods = methods
+
+    def __getattr__(self, method):
+        def call(*args, **kw):
+            if method not in self.methods:
+                raise DBusException(MISSING)
+            self.link.record((self.om, self.name, method) + args)
+            return self.methods[method](*args)
+        return call
+
+
+class ComarGroup(object):
+
+    def __init__(self, link, om):
+        self.link = link
+        self.om = om
+        # Scripts are registered in the daemon, not in the link
+        self.objects = Link.registry.setdefault(om, {})
+
+    def __iter__(self):
+        self.link.record(("list", self.om))
+        return iter(list(self.objects))
+
+    def __getitem__(self, name):
+        return ComarObject(self.link, self.om, name, self.objects.get(name, {}))
+
+
+class Link(object):
+    """COMAR stand-in recording the calls made through it"""
+
+    links = []
+    registry = {}
+
+    def __init__(self, socket=None, alternate=False):
+        self.alternate = alternate
+        self.calls = []
+        self.lock = threading.Lock()
+        self.System = types.SimpleNamespace(
+            Package=ComarGroup(self, "System.Package"),
+            PackageHandler=ComarGroup(self, "System.PackageHandler"),
+            Service=ComarGroup(self, "System.Service"))
+        Link.links.append(self)
+
+    def record(self, call):
+        with self.lock:
+            self.calls.append(call)
+
+    def setLocale(self):
+        pass
+
+    def register(self, name, om, path):
+        self.record(("register", name, om))
+
+
+class Script(object):
+
+    def __init__(self, om, name=None):
+        self.om = om
+        self.name = name
+        self.script = "package.py"
+
+
+@pytest.fixture
+def comariface(monkeypatch):
+    monkeypatch.setitem(sys.modules, "comar", types.SimpleNamespace(Link=Link))
+    monkeypatch.setitem(sys.modules, "dbus", types.SimpleNamespace(DBusException=DBusException))
+    sys.modules.pop("pisi.comariface", None)
+    module = importlib.import_module("pisi.comariface")
+    Link.links = []
+    Link.registry = {}
+    ctx.comar_link = None
+    yield module
+    ctx.comar_link = None
+    pisi.api.set_comar_updated(False)
+    sys.modules.pop("pisi.comariface", None)
+
+
+def package(name, scripts=()):
+    return (name, list(scripts), "/comar", "/%s/metadata.xml" % name,
+            "/%s/files.xml" % name, None, None, "1.0", "1")
+
+
+@pytest.mark.unit
+def testLinkReused(comariface):
+    link = comariface.get_link()
+    assert comariface.get_link() is link
+    assert len(Link.links) == 1
+
+    # A new operation connects again
+    ctx.comar_link = None
+    assert comariface.get_link() is not link
+
+    pisi.api.set_comar_updated(True)
+    assert comariface.get_link().alternate
+
+
+@pytest.mark.unit
+def testHandlersBatched(comariface):
+    link = comariface.get_link()
+    handlers = link.System.PackageHandler.objects
+    handlers["fonts"] = {"setupPackages": lambda metapaths, filepaths: None}
+    handlers["mime"] = {"setupPackage": lambda metapath, filepath: None}
+    handlers["other"] = {}
+
+    comariface.post_install_packages([package("a"), package("b"), package("c")])
+    comariface.post_install_packages([package("d")])
+
+    calls = [call[:3] for call in link.calls]
+    assert calls.count(("list", "System.PackageHandler")) == 1
+    assert ("System.PackageHandler", "fonts", "setupPackages") in calls
+    fonts = [call for call in link.calls if call[:3] == ("System.PackageHandler", "fonts", "setupPackages")]
+    assert fonts[0][3] == ["/a/metadata.xml", "/b/metadata.xml", "/c/metadata.xml"]
+    assert calls.count(("System.PackageHandler", "fonts", "setupPackages")) == 2
+    assert calls.count(("System.PackageHandler", "mime", "setupPackage")) == 4
+
+
+@pytest.mark.unit
+def testScriptsConcurrent(comariface):
+    link = comariface.get_link()
+    barrier = threading.Barrier(2, timeout=10)
+    order = []
+
+    def post_install(name, wait):
+        def run(*args):
+            if wait:
+                barrier.wait()
+            order.append(name)
+        return run
+
+    packages = link.System.Package.objects
+    for name, wait in (("a", True), ("b", True), ("c", False)):
+        packages[name] = {"postInstall": post_install(name, wait)}
+
+    events = []
+    scripts = [Script("System.Package")]
+    comariface.post_install_packages([package("c", scripts), package("a", scripts),
+                                      package("b", scripts), package("d")],
+                                     deps={"c": {"a"}},
+                                     notify=lambda event, name: events.append((event, name)))
+    assert sorted(order[:2]) == ["a", "b"]
+    assert order[2] == "c"
+    assert ("register", "d", "System.Package") not in link.calls
+
+    # Each worker thread calls the scripts over its own link
+    script_links = [script_link for script_link in Link.links
+                    if any(call[2:3] == ("postInstall",) for call in script_link.calls)]
+    assert link not in script_links
+    assert len(script_links) >= 2
+
+    for name in "abcd":
+        assert events.count((pisi.ui.configuring, name)) == 1
+        assert events.count((pisi.ui.configured, name)) == 1
+        assert events.index((pisi.ui.configuring, name)) < events.index((pisi.ui.configured, name))
+    assert events.index((pisi.ui.configured, "a")) < events.index((pisi.ui.configured, "c"))
+
+
+@pytest.mark.unit
+def testScriptFails(comariface):
+    link = comariface.get_link()
+    ran = []
+
+    def post_install(name):
+        def run(*args):
+            if name == "a":
+                raise DBusException("tr.org.pardus.comar.python.error")
+            ran.append(name)
+        return run
+
+    packages = link.System.Package.objects
+    for name in "abc":
+        packages[name] = {"postInstall": post_install(name)}
+
+    configured = []
+
+    def notify(event, name):
+        if event == pisi.ui.configured:
+            configured.append(name)
+
+    scripts = [Script("System.Package")]
+    with pytest.raises(comariface.Error):
+        comariface.post_install_packages([package("a", scripts), package("b", scripts),
+                                          package("c", scripts), package("d")],
+                                         deps={"c": {"a"}}, notify=notify)
+
+    # The independent script still ran, the dependent one did not
+    assert ran == ["b"]
+    assert sorted(configured) == ["b", "d"]
+
+
+class InstallDB(object):
+
+    def __init__(self):
+        self.pending = ["a", "b"]
+
+    def list_pending(self):
+        return list(self.pending)
+
+    def has_package(self, name):
+        return True
+
+    def get_package(self, name):
+        return types.SimpleNamespace(name=name, providesComar=[], version="1.0", release="1")
+
+    def package_path(self, name):
+        return "/var/lib/pisi/package/%s" % name
+
+    def get_rev_deps(self, name):
+        return []
+
+    def clear_pending(self, name):
+        self.pending.remove(name)
+
+
+@pytest.mark.unit
+def testConfigurePendingNotifies(comariface, monkeypatch):
+    installdb = InstallDB()
+    monkeypatch.setattr(pisi.db.installdb, "InstallDB", lambda: installdb)
+    monkeypatch.setattr(pisi.db, "invalidate_caches", lambda: None)
+    monkeypatch.setattr(pisi.db, "update_caches", lambda: None)
+    events = []
+    monkeypatch.setattr(ctx.ui, "notify",
+                        lambda event, **keywords: events.append((event, keywords["package"].name)))
+
+    pisi.api.configure_pending()
+
+    assert events == [(pisi.ui.configuring, "a"), (pisi.ui.configuring, "b"),
+                      (pisi.ui.configured, "a"), (pisi.ui.configured, "b")]
+    assert installdb.pending == []
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import threading
+
+import pytest
+
+import pisi
+import pisi.api
+import pisi.errors
+import pisi.pxml.autoxml
+import pisi.context as ctx
+from pisi import daemon
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    watched = tmp_path / "packages"
+    watched.mkdir()
+    server = daemon.Server(str(tmp_path / "pisi.sock"), watch=lambda: [str(watched)])
+    server.invalidated = 0
+
+    def invalidate():
+        server.invalidated += 1
+    server.invalidate = invalidate
+
+    def search_package(terms, lang=None, repo=None):
+        if not terms:
+            raise pisi.Error("No terms")
+        return [(t, lang) for t in terms]
+
+    def list_upgradable():
+        ctx.ui.warning("Dependency zlib of bash cannot be satisfied")
+        ctx.ui.info("Checking", verbose=True)
+        return ["bash"]
+    server.queries["list_installed"] = lambda: ["bash", "zlib"]
+    server.queries["search_package"] = search_package
+    server.queries["list_upgradable"] = list_upgradable
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.watched = watched
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.unit
+def test_queries(server, monkeypatch):
+    client = daemon.Client(server.path)
+    assert client.call("list_installed") == ["bash", "zlib"]
+    assert client.call("search_package", [["x"]], {"lang": "tr"}) == [["x", "tr"]]
+
+    # Queries use the language of the client unless it is given
+    monkeypatch.setattr(pisi.pxml.autoxml.LocalText, "get_lang", staticmethod(lambda: "de"))
+    assert client.call("search_package", [["x"]]) == [["x", "de"]]
+    assert client.call("search_package", [["x"], None, "main"]) == [["x", "de"]]
+
+    # Errors keep their class
+    with pytest.raises(pisi.Error) as error:
+        client.call("search_package", [[]])
+    assert error.type is pisi.Error
+    assert str(error.value) == "No terms"
+    with pytest.raises(daemon.RemoteError):
+        client.call("install", [["bash"]])
+
+    # The connection is kept open between calls
+    assert client.call("list_installed") == ["bash", "zlib"]
+    client.close()
+    assert os.stat(server.path).st_mode & 0o777 == 0o666
+
+
+@pytest.mark.unit
+def test_invalidate(server):
+    client = daemon.Client(server.path)
+    client.call("list_installed")
+    assert server.invalidated == 0
+
+    (server.watched / "bash").mkdir()
+    os.utime(str(server.watched), ns=(0, 12345))
+    client.call("list_installed")
+    assert server.invalidated == 1
+
+    client.call("invalidate")
+    assert server.invalidated == 2
+
+
+@pytest.mark.unit
+def test_api_uses_daemon(server, monkeypatch):
+    monkeypatch.setattr(ctx, "daemon", daemon.Client(server.path))
+    assert pisi.api.list_installed() == ["bash", "zlib"]
+
+    # The queries run locally when the daemon is not reachable
+    def list_installed():
+        return ["local"]
+    local = pisi.api.query(list_installed)
+    monkeypatch.setattr(ctx, "daemon", daemon.Client(server.path + ".missing"))
+    assert local() == ["local"]
+    assert ctx.daemon is None
+
+
+class RecordingUI(object):
+    def __init__(self):
+        self.messages = []
+
+    def info(self, msg, verbose=False, noln=False):
+        self.messages.append(("info", msg, verbose))
+
+    def warning(self, msg):
+        self.messages.append(("warning", msg))
+
+    def debug(self, msg):
+        pass
+
+
+@pytest.mark.unit
+def test_messages_are_replayed(server, monkeypatch):
+    ui = RecordingUI()
+    monkeypatch.setattr(ctx, "ui", ui)
+    client = daemon.Client(server.path)
+    assert client.call("list_upgradable") == ["bash"]
+    assert ui.messages == [("warning", "Dependency zlib of bash cannot be satisfied"),
+                           ("info", "Checking", True)]
+    client.close()
+
+
+@pytest.mark.unit
+def test_invalidate_needs_root(server, monkeypatch):
+    # A client of another user than the daemon and root
+    monkeypatch.setattr(daemon, "peer_uid", lambda sock: os.getuid() + 1)
+    client = daemon.Client(server.path)
+    with pytest.raises(pisi.errors.PrivilegeError):
+        client.call("invalidate")
+    assert server.invalidated == 0
+
+    # The daemon itself may always invalidate
+    server.dispatch({"call": "invalidate"})
+    assert server.invalidated == 1
+    client.close()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import json
+import types
+import hashlib
+import tarfile
+import zipfile
+
+import pytest
+
+import pisi.context as ctx
+import pisi.package
+import pisi.cli.delta
+from pisi.operations import delta
+
+
+def make_files(*entries):
+    return types.SimpleNamespace(list=[types.SimpleNamespace(path=path, hash=hash)
+                                       for path, hash in entries])
+
+
+@pytest.mark.unit
+def test_find_delta_with_shared_hash_map():
+    old = make_files(("usr/bin/a", "1"), ("usr/lib/b", "2"), ("usr/share/c", "3"))
+    new = make_files(("usr/bin/a", "1"), ("usr/lib/b", "4"), ("usr/lib/moved", "3"))
+
+    hashes = delta.files_by_hash(new)
+    changed = delta.find_delta(old, new, hashes)
+
+    assert [f.path for f in changed] == ["usr/lib/b"]
+    assert [f.path for f in delta.find_delta(old, new)] == ["usr/lib/b"]
+
+
+class FakePackage(object):
+    """A package file holding its name, release and files as JSON.
+    Written packages also record what the delta worker added and where."""
+
+    formats = ("1.2",)
+    default_format = "1.2"
+
+    def __init__(self, path, mode="r", format=None, tmp_dir=None):
+        self.filepath = path
+        self.tmp_dir = tmp_dir
+        if mode == "w":
+            self.written = {"install": {}, "tmp_dir": tmp_dir, "pid": os.getpid()}
+            return
+
+        with open(path) as f:
+            self.data = json.load(f)
+        self.metadata = types.SimpleNamespace(package=types.SimpleNamespace(
+            name=self.data["name"], release=str(self.data["release"]),
+            providesComar=[], debug_package=False))
+
+    def get_files(self):
+        return make_files(*[(path, hashlib.sha1(content.encode()).hexdigest())
+                            for path, content in sorted(self.data["files"].items())])
+
+    def read(self):
+        self.files = self.get_files()
+
+    def extract_pisi_files(self, outdir):
+        os.makedirs(outdir, exist_ok=True)
+        for name in (ctx.const.metadata_xml, ctx.const.files_xml):
+            with open(os.path.join(outdir, name), "w") as f:
+                json.dump({"name": self.data["name"], "release": self.data["release"]}, f)
+
+    def extract_dir(self, dir, outdir):
+        pass
+
+    def extract_install(self, outdir):
+        for path, content in self.data["files"].items():
+            os.makedirs(os.path.dirname(os.path.join(outdir, path)), exist_ok=True)
+            with open(os.path.join(outdir, path), "w") as f:
+                f.write(content)
+
+    def add_metadata_xml(self, path):
+        pass
+
+    def add_files_xml(self, path):
+        pass
+
+    def add_to_package(self, fn, an=None):
+        pass
+
+    def add_to_install(self, name, arcname):
+        with open(name) as f:
+            self.written["install"][arcname] = f.read()
+
+    def close(self):
+        with open(self.filepath, "w") as f:
+            json.dump(self.written, f)
+
+
+def write_package(repo, release, files):
+    path = os.path.join(repo, "tasma-1.0-%d-p2-x86_64.pisi" % release)
+    with open(path, "w") as f:
+        json.dump({"name": "tasma", "release": release, "files": files}, f)
+    return path
+
+
+def release_files(release):
+    # Every release changes its own file and the shared one
+    files = dict(("usr/lib/r%d" % r, "release %d" % r) for r in range(1, 5))
+    files["usr/lib/r%d" % release] = "changed in %d" % release
+    files["usr/bin/tasma"] = "tasma %d" % release
+    return files
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.setattr(delta.pisi.package, "Package", FakePackage)
+    monkeypatch.setattr(delta.multiprocessing, "cpu_count", lambda: 4)
+    monkeypatch.setattr(ctx.config, "tmp_dir", lambda: str(tmp_path / "tmp"))
+    monkeypatch.setattr(ctx, "ui", ctx.ui)
+    monkeypatch.setattr(ctx.config, "options", ctx.config.options)
+
+    repo = tmp_path / "repo" / "t" / "tasma"
+    repo.mkdir(parents=True)
+    for release in range(1, 5):
+        write_package(str(repo), release, release_files(release))
+    return repo
+
+
+@pytest.mark.unit
+def test_repo_deltas_in_parallel(repo, monkeypatch):
+    # The hash map of the new package is built once and shared with the
+    # workers by the pool initializer
+    hashed = []
+    files_by_hash = delta.files_by_hash
+    monkeypatch.setattr(delta, "files_by_hash",
+                        lambda files: hashed.append(files) or files_by_hash(files))
+
+    command = pisi.cli.delta.Delta(["delta", "--repo-dir", str(repo.parent.parent),
+                                    "--releases", "2"])
+    command.run()
+
+    deltas = sorted(fn for fn in os.listdir(str(repo)) if fn.endswith(".delta.pisi"))
+    assert deltas == ["tasma-2-4-p2-x86_64.delta.pisi", "tasma-3-4-p2-x86_64.delta.pisi"]
+
+    new_files = release_files(4)
+    work_dirs = set()
+    for fn in deltas:
+        with open(str(repo / fn)) as f:
+            written = json.load(f)
+        base = int(fn.split("-")[1])
+
+        # Installing the delta over its base gives the new release
+        installed = dict(release_files(base))
+        installed.update(written["install"])
+        assert installed == new_files
+        assert sorted(written["install"]) == ["usr/bin/tasma", "usr/lib/r%d" % base,
+                                              "usr/lib/r4"]
+
+        # Created by a pool worker in a work directory of its own
+        assert written["pid"] != os.getpid()
+        assert not os.path.exists(written["tmp_dir"])
+        work_dirs.add(written["tmp_dir"])
+    assert len(work_dirs) == 2
+    assert len(hashed) == 1
+
+    # Existing deltas are not created again
+    assert delta.create_repo_delta_packages(str(repo.parent.parent), 2) == []
+
+
+class WrittenPackage(pisi.package.Package):
+    """A real package writer. The xml files are added without being
+    parsed, they hold the JSON of the fake packages."""
+
+    def add_metadata_xml(self, path):
+        self.add_to_package(path, ctx.const.metadata_xml)
+
+    def add_files_xml(self, path):
+        self.add_to_package(path, ctx.const.files_xml)
+
+
+class RealWriter(object):
+    """Reads the fake packages and writes real ones"""
+
+    formats = pisi.package.Package.formats
+    default_format = pisi.package.Package.default_format
+
+    def __new__(cls, path, mode="r", **kw):
+        if mode == "w":
+            return WrittenPackage(path, mode, **kw)
+        return FakePackage(path, mode, **kw)
+
+
+@pytest.mark.unit
+def test_write_real_delta_package(repo, monkeypatch):
+    monkeypatch.setattr(delta.pisi.package, "Package", RealWriter)
+    monkeypatch.setattr(ctx.config.values.build, "compressionlevel", "1")
+
+    deltas = delta.create_repo_delta_packages(str(repo.parent.parent), 1)
+    assert [os.path.basename(path) for path in deltas] == ["tasma-3-4-p2-x86_64.delta.pisi"]
+
+    with zipfile.ZipFile(deltas[0]) as package:
+        assert sorted(package.namelist()) == ["files.xml", "install.tar.xz", "metadata.xml"]
+        assert json.loads(package.read("metadata.xml")) == {"name": "tasma", "release": 4}
+        with package.open("install.tar.xz") as archive:
+            with tarfile.open(fileobj=archive, mode="r:xz") as tar:
+                installed = dict((member.name, tar.extractfile(member).read().decode())
+                                 for member in tar.getmembers())
+
+    new_files = release_files(4)
+    assert installed == dict((path, new_files[path])
+                             for path in ("usr/bin/tasma", "usr/lib/r3", "usr/lib/r4"))
+    assert os.listdir(str(repo.parent.parent.parent / "tmp")) == []
+
+
+@pytest.mark.unit
+def test_failed_delta_cleaned_up(repo, monkeypatch):
+    def add_to_install(self, name, arcname):
+        raise IOError("No space left on device")
+
+    monkeypatch.setattr(FakePackage, "add_to_install", add_to_install)
+    monkeypatch.setattr(delta.multiprocessing, "cpu_count", lambda: 1)
+
+    with pytest.raises(IOError):
+        delta.create_repo_delta_packages(str(repo.parent.parent), 1)
+
+    assert not [fn for fn in os.listdir(str(repo)) if fn.endswith(".delta.pisi")]
+    assert os.listdir(str(repo.parent.parent.parent / "tmp")) == []
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import time
+
+import pytest
+
+import pisi.graph
+from pisi.operations import emerge
+
+# c and d depend on a, e depends on b and c
+EDGES = [("c", "a"), ("d", "a"), ("e", "b"), ("e", "c")]
+DURATIONS = {"a": 0.3, "b": 0.3, "c": 0.3, "d": 0.1, "e": 0.1}
+
+
+def plan():
+    G = pisi.graph.Digraph()
+    for x in sorted(DURATIONS):
+        G.add_vertex(x)
+    for u, v in EDGES:
+        G.add_edge(u, v)
+    order_build = G.topological_sort()
+    order_build.reverse()
+    return order_build, emerge.source_dependencies(G, order_build)
+
+
+def build(name):
+    time.sleep(DURATIONS[name])
+    if name == "b" and build.fail:
+        raise Exception("broken")
+    return ["%s.pisi" % name]
+build.fail = False
+
+
+@pytest.mark.unit
+def test_parallel_builds():
+    order_build, deps = plan()
+    installed = []
+
+    def install(packages):
+        name = packages[0][0]
+        assert deps[name] <= set(p[0][0] for p in installed)
+        installed.append(packages)
+
+    scheduler = emerge.BuildScheduler(order_build, deps, jobs=3,
+                                      build=build, install=install)
+    start = time.time()
+    scheduler.run()
+    elapsed = time.time() - start
+
+    assert sorted(p[0] for p in installed) == sorted("%s.pisi" % x for x in DURATIONS)
+    # a and b in parallel, then c and d, then e
+    assert elapsed < sum(DURATIONS.values()) - 0.2
+
+    path, length = emerge.critical_path(order_build, deps, scheduler.times)
+    assert path == ["a", "c", "e"]
+    assert length >= 0.7
+
+
+@pytest.mark.unit
+def test_failed_build():
+    order_build, deps = plan()
+    installed = []
+    build.fail = True
+    try:
+        scheduler = emerge.BuildScheduler(order_build, deps, jobs=2,
+                                          build=build, install=installed.extend)
+        with pytest.raises(emerge.Error):
+            scheduler.run()
+    finally:
+        build.fail = False
+
+    # e needs b, so it is not built
+    assert "e.pisi" not in installed
+    assert "a.pisi" in installed
+
+
+@pytest.mark.unit
+def test_ignored_dependencies():
+    deps = emerge.source_dependencies(None, ["x", "y", "z"])
+    assert deps == {"x": set(), "y": {"x"}, "z": {"y"}}
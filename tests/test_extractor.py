@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import io
+import os
+import errno
+import tarfile
+
+import pytest
+
+from pisi import extractor
+
+
+def make_tar(path, members):
+    with tarfile.open(path, "w") as tar:
+        for name, kind, value in members:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.mtime = 1000000000
+            if kind == "dir":
+                tarinfo.type = tarfile.DIRTYPE
+                tarinfo.mode = 0o755
+                tar.addfile(tarinfo)
+            elif kind == "file":
+                tarinfo.size = len(value)
+                tarinfo.mode = 0o640
+                tar.addfile(tarinfo, io.BytesIO(value))
+            elif kind == "sym":
+                tarinfo.type = tarfile.SYMTYPE
+                tarinfo.linkname = value
+                tar.addfile(tarinfo)
+            elif kind == "link":
+                tarinfo.type = tarfile.LNKTYPE
+                tarinfo.linkname = value
+                tar.addfile(tarinfo)
+
+
+def extract(path, target, fallback=None):
+    ex = extractor.TarExtractor(str(target), fallback=fallback)
+    with tarfile.open(path) as tar:
+        ex.extract_all(tar)
+    return ex
+
+
+@pytest.mark.unit
+def test_extract_members(tmp_path):
+    path = str(tmp_path / "a.tar")
+    make_tar(path, [("usr", "dir", None),
+                    ("usr/lib/libfoo.so.1", "file", b"library"),
+                    ("usr/lib/libfoo.so", "sym", "libfoo.so.1"),
+                    ("usr/lib/libbar.so.1", "link", "usr/lib/libfoo.so.1")])
+    target = tmp_path / "root"
+    target.mkdir()
+
+    ex = extract(path, target)
+
+    lib = target / "usr/lib/libfoo.so.1"
+    assert lib.read_bytes() == b"library"
+    assert lib.stat().st_mode & 0o7777 == 0o640
+    assert lib.stat().st_mtime == 1000000000
+    assert os.readlink(str(target / "usr/lib/libfoo.so")) == "libfoo.so.1"
+    assert os.path.samefile(str(lib), str(target / "usr/lib/libbar.so.1"))
+    assert ex.files == 4
+    assert ex.fallbacks == 0
+    assert not [f for f in os.listdir(str(target / "usr/lib"))
+                if f.startswith(extractor.TMP_PREFIX)]
+
+
+@pytest.mark.unit
+def test_replace_keeps_old_inode(tmp_path):
+    target = tmp_path / "root"
+    (target / "bin").mkdir(parents=True)
+    old = target / "bin/prog"
+    old.write_bytes(b"old")
+    running = open(str(old), "rb")
+
+    path = str(tmp_path / "a.tar")
+    make_tar(path, [("bin/prog", "file", b"new")])
+    extract(path, target)
+
+    assert old.read_bytes() == b"new"
+    assert running.read() == b"old"
+    running.close()
+
+
+@pytest.mark.unit
+def test_fallback(tmp_path):
+    target = tmp_path / "root"
+    (target / "usr/lib64").mkdir(parents=True)
+
+    path = str(tmp_path / "a.tar")
+    make_tar(path, [("usr/lib64", "sym", "lib")])
+
+    handled = []
+    ex = extract(path, target, fallback=lambda tarinfo: handled.append(tarinfo.name))
+    assert handled == ["usr/lib64"]
+    assert ex.fallbacks == 1
+
+    with pytest.raises(extractor.Error):
+        extract(path, target)
+
+
+@pytest.mark.unit
+def test_fallback_only_on_conflicts(tmp_path, monkeypatch):
+    target = tmp_path / "root"
+    target.mkdir()
+    # A file is where the archive has a directory
+    (target / "usr").write_bytes(b"file")
+
+    path = str(tmp_path / "a.tar")
+    make_tar(path, [("usr/bin/prog", "file", b"prog")])
+
+    handled = []
+    extract(path, target, fallback=lambda tarinfo: handled.append(tarinfo.name))
+    assert handled == ["usr/bin/prog"]
+
+    # Disk errors are not retried through the fallback
+    (target / "usr").unlink()
+
+    def extract_file(self, tar, tarinfo, path):
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    monkeypatch.setattr(extractor.TarExtractor, "extract_file", extract_file)
+    handled = []
+    with pytest.raises(OSError) as e:
+        extract(path, target, fallback=lambda tarinfo: handled.append(tarinfo.name))
+    assert e.value.errno == errno.ENOSPC
+    assert handled == []
+
+
+@pytest.mark.unit
+def test_outside_target(tmp_path):
+    path = str(tmp_path / "a.tar")
+    make_tar(path, [("../evil", "file", b"x")])
+    target = tmp_path / "root"
+    target.mkdir()
+
+    with pytest.raises(extractor.Error):
+        extract(path, target)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import shutil
+import importlib.util
+from types import SimpleNamespace
+
+import pytest
+
+from pisi import filetype
+from pisi.operations.build import Builder
+
+
+def make_tree(root):
+    os.makedirs(str(root / "usr/lib/python3/site"))
+    os.makedirs(str(root / "usr/bin"))
+    shutil.copy("/bin/true", str(root / "usr/bin/true"))
+    (root / "usr/lib/libfoo.la").write_text(
+        "# libfoo.la - a libtool library file\n# Generated by libtool\n")
+    (root / "usr/lib/libfoo.a").write_bytes(b"!<arch>\n")
+    (root / "usr/lib/python3/site/mod.pyc").write_bytes(
+        importlib.util.MAGIC_NUMBER + b"\0" * 12)
+    (root / "usr/lib/Foo.pod").write_text("\n=head1 NAME\n\nFoo\n")
+    (root / "usr/lib/readme").write_text("Not POD\n=head1 later\n")
+    os.symlink("true", str(root / "usr/bin/link"))
+
+
+@pytest.mark.unit
+def test_detect(tmp_path):
+    make_tree(tmp_path)
+    lib = tmp_path / "usr/lib"
+    assert filetype.detect(str(tmp_path / "usr/bin/true")).startswith("ELF")
+    assert "SB " in filetype.detect(str(tmp_path / "usr/bin/true"))
+    assert filetype.detect(str(lib / "libfoo.la")).startswith("libtool library file")
+    assert filetype.detect(str(lib / "libfoo.a")) == "current ar archive"
+    assert filetype.detect(str(lib / "python3/site/mod.pyc")) == "python 3 byte-compiled"
+    assert filetype.detect(str(lib / "Foo.pod")) == "Perl POD document text"
+    assert filetype.detect(str(lib / "readme")) is None
+    assert filetype.detect(str(tmp_path / "usr/bin/link")) == "symbolic link to true"
+
+
+@pytest.mark.unit
+@pytest.mark.skipif(not shutil.which("strip"), reason="strip is not installed")
+def test_file_actions(tmp_path, monkeypatch):
+    import pisi.context as ctx
+    monkeypatch.setattr(ctx, "config", SimpleNamespace(
+        values=SimpleNamespace(build=SimpleNamespace(stripjobs=2, generatedebug=False)),
+        tmp_dir=lambda: "/var/pisi"))
+
+    install_dir = tmp_path / "install"
+    make_tree(install_dir)
+    builder = SimpleNamespace(pkg_install_dir=lambda: str(install_dir),
+                              actionGlobals={"KeepSpecial": ["libtool"]})
+    Builder.file_actions(builder)
+
+    lib = install_dir / "usr/lib"
+    assert (lib / "libfoo.la").exists()
+    assert not (lib / "python3").exists()
+    assert not (lib / "Foo.pod").exists()
+    assert (lib / "readme").exists()
+    assert os.path.getsize(str(install_dir / "usr/bin/true")) <= os.path.getsize("/bin/true")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import time
+import hashlib
+
+import pytest
+
+from pisi import hashcache
+
+
+class CountingHash(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = hashcache.HashCache(str(tmp_path / "sha1sums.cache"))
+    monkeypatch.setattr(hashcache, "_cache", cache)
+    return cache
+
+
+def make_old(path, content):
+    path.write_bytes(content)
+    old = time.time() - 60
+    os.utime(str(path), (old, old))
+
+
+@pytest.mark.unit
+def test_hashed_once(tmp_path, cache):
+    archive = tmp_path / "source.tar.xz"
+    make_old(archive, b"source" * 1000)
+    hash_file = CountingHash()
+
+    for i in range(3):
+        value = hashcache.sha1_file(str(archive), hash_file)
+    assert value == hashlib.sha1(b"source" * 1000).hexdigest()
+    assert hash_file.calls == 1
+
+    # The cache is written once, at the end of the operation
+    assert not os.path.exists(cache.path)
+    hashcache.save()
+    reloaded = hashcache.HashCache(cache.path)
+    assert reloaded.get(str(archive), hashcache.file_key(str(archive))) == value
+
+
+@pytest.mark.unit
+def test_save_drops_removed_files(tmp_path, cache):
+    archives = [tmp_path / ("source%d.tar.xz" % i) for i in range(3)]
+    for archive in archives:
+        make_old(archive, archive.name.encode())
+        hashcache.sha1_file(str(archive), CountingHash())
+    hashcache.save()
+    mtime = os.stat(cache.path).st_mtime_ns
+
+    # Nothing new, nothing written
+    archives[0].unlink()
+    hashcache.save()
+    assert os.stat(cache.path).st_mtime_ns == mtime
+
+    make_old(tmp_path / "new.tar.xz", b"new")
+    hashcache.sha1_file(str(tmp_path / "new.tar.xz"), CountingHash())
+    hashcache.save()
+    assert sorted(os.path.basename(path) for path in hashcache.HashCache(cache.path).entries) == \
+        ["new.tar.xz", "source1.tar.xz", "source2.tar.xz"]
+
+
+@pytest.mark.unit
+def test_invalidation(tmp_path, cache):
+    archive = tmp_path / "source.tar.xz"
+    make_old(archive, b"source" * 1000)
+    hash_file = CountingHash()
+    hashcache.sha1_file(str(archive), hash_file)
+
+    # Same size and restored mtime, but rewritten
+    stat = os.stat(str(archive))
+    with open(str(archive), "r+b") as f:
+        f.write(b"SOURCE")
+    os.utime(str(archive), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    value = hashcache.sha1_file(str(archive), hash_file)
+    assert value == hashlib.sha1(b"SOURCE" + b"source" * 999).hexdigest()
+    assert hash_file.calls == 2
+
+
+@pytest.mark.unit
+def test_recent_file_not_cached(tmp_path, cache):
+    archive = tmp_path / "source.tar.xz"
+    archive.write_bytes(b"new")
+    hash_file = CountingHash()
+
+    hashcache.sha1_file(str(archive), hash_file)
+    hashcache.sha1_file(str(archive), hash_file)
+    assert hash_file.calls == 2
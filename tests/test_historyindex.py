@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import pytest
+
+import pisi.history
+from pisi.db import historyindex
+
+
+def make_operation(otype, date, packages=(), repos=()):
+    operation = pisi.history.Operation()
+    operation.type = otype
+    operation.date = date
+    operation.time = "12:00"
+    operation.packages = []
+    operation.repos = []
+    for name, op, before, after in packages:
+        package = pisi.history.Package()
+        package.name = name
+        package.operation = op
+        package.type = None
+        package.before = historyindex.package_info(*before) if before else None
+        package.after = historyindex.package_info(*after) if after else None
+        operation.packages.append(package)
+    for name, uri in repos:
+        repo = pisi.history.Repo()
+        repo.name = name
+        repo.uri = uri
+        repo.operation = "update"
+        operation.repos.append(repo)
+    return operation
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = historyindex.HistoryIndex(str(tmp_path / "history.db"))
+    index.add(1, make_operation("install", "2008-01-11",
+                                [("gdb", "install", None, ("6.6", "8"))]))
+    index.add(2, make_operation("repoupdate", "2008-01-14",
+                                repos=[("pardus", "http://example.com/pisi-index.xml")]))
+    index.add(3, make_operation("upgrade", "2008-01-14",
+                                [("gdb", "upgrade", ("6.6", "8"), ("6.6", "9")),
+                                 ("rsync", "remove", ("2.6.9", "8"), None)]))
+    index.add(4, make_operation("repoupdate", "2008-01-16",
+                                repos=[("pardus", "http://example.com/pisi-index.xml")]))
+    yield index
+    index.close()
+
+
+@pytest.mark.unit
+def testGet(index):
+    assert [op.no for op in index.operations()] == [4, 3, 2, 1]
+
+    operation = index.get(3)
+    assert operation.type == "upgrade"
+    assert operation.date == "2008-01-14"
+    assert [p.name for p in operation.packages] == ["gdb", "rsync"]
+    gdb, rsync = operation.packages
+    assert (gdb.before.version, gdb.before.release) == ("6.6", "8")
+    assert (gdb.after.version, gdb.after.release) == ("6.6", "9")
+    assert rsync.after is None
+    assert [(r.name, r.uri) for r in index.get(2).repos] == \
+        [("pardus", "http://example.com/pisi-index.xml")]
+    assert index.get(5) is None
+
+
+@pytest.mark.unit
+def testSearch(index):
+    assert [op.no for op in index.search(package="gdb")] == [3, 1]
+    assert [op.no for op in index.search(otype="repoupdate")] == [4, 2]
+    assert [op.no for op in index.search(since="2008-01-14")] == [4, 3, 2]
+    assert [op.no for op in index.search(since="2008-01-12", until="2008-01-14")] == [3, 2]
+    assert [op.no for op in index.search(package="gdb", otype="upgrade")] == [3]
+    assert [op.no for op in index.search(limit=2)] == [4, 3]
+    assert index.repo_update_dates() == ["2008-01-14", "2008-01-16"]
+
+
+@pytest.mark.unit
+def testAddReplaces(index, tmp_path):
+    index.add(3, make_operation("remove", "2008-01-15",
+                                [("xyz", "remove", ("1.0", "1"), None)]))
+    assert [p.name for p in index.get(3).packages] == ["xyz"]
+    assert index.search(package="gdb")[0].no == 1
+
+    # Operations are kept in the file, the import is done once
+    (tmp_path / "history").mkdir()
+    index.import_xml(str(tmp_path / "history"))
+    reopened = historyindex.HistoryIndex(str(tmp_path / "history.db"))
+    assert reopened.is_imported()
+    assert reopened.get(3).type == "remove"
+    reopened.close()
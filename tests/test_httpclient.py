@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import re
+import time
+import random
+import threading
+import http.server
+
+import pytest
+
+import pisi.fetcher
+from pisi import httpclient
+
+DATA = random.Random(35).randbytes(3 * 1024 * 1024 + 17)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    files = {"/data": DATA, "/small": b"small file"}
+    etag = '"v1"'
+    requests = []
+    credentials = []
+    location = None
+    fail_after = None
+    refuse_ranges = False
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("Range")))
+        self.credentials.append((self.path, self.headers.get("Authorization"),
+                                 self.headers.get("Cookie")))
+        if self.path in ("/moved", "/elsewhere"):
+            self.send_response(302)
+            self.send_header("Location", "/small" if self.path == "/moved" else self.location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        data = self.files[self.path]
+        if self.refuse_ranges and self.headers.get("Range"):
+            self.send_response(416)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = 0, len(data)
+        status = 200
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        if_range = self.headers.get("If-Range")
+        if match and (if_range is None or if_range == self.etag):
+            start = int(match.group(1))
+            end = min(end, int(match.group(2)) + 1 if match.group(2) else end)
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % len(data))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("ETag", self.etag)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start))
+        if status == 206:
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end - 1, len(data)))
+        self.end_headers()
+
+        body = data[start:end]
+        if self.fail_after is not None:
+            # Simulate a dropped connection in the middle of the body
+            self.wfile.write(body[:self.fail_after])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+def start_server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return httpd
+
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    Handler.credentials = []
+    Handler.fail_after = None
+    Handler.refuse_ranges = False
+    Handler.etag = '"v1"'
+    httpd = start_server()
+    yield "http://127.0.0.1:%d" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.unit
+def test_keep_alive(server):
+    client = httpclient.HTTPClient()
+    count = 200
+    start = time.time()
+    for i in range(count):
+        assert client.open(server + "/small").read() == b"small file"
+    rate = count / (time.time() - start)
+    print("%.0f requests/s" % rate)
+
+    assert client.pool.connections == 1
+    assert client.open(server + "/moved").read() == b"small file"
+    assert client.pool.connections == 1
+
+
+@pytest.mark.unit
+def test_redirect_drops_credentials(server):
+    client = httpclient.HTTPClient(headers=[("Authorization", "Basic cGlzaTpwaXNp")])
+    headers = {"Cookie": "session=1"}
+
+    # Redirects on the same origin keep the credentials
+    assert client.open(server + "/moved", headers).read() == b"small file"
+    assert Handler.credentials == [("/moved", "Basic cGlzaTpwaXNp", "session=1"),
+                                   ("/small", "Basic cGlzaTpwaXNp", "session=1")]
+
+    # Another port is another origin
+    other = start_server()
+    try:
+        Handler.location = "http://127.0.0.1:%d/small" % other.server_address[1]
+        Handler.credentials = []
+        assert client.open(server + "/elsewhere", headers).read() == b"small file"
+    finally:
+        other.shutdown()
+        other.server_close()
+    assert Handler.credentials == [("/elsewhere", "Basic cGlzaTpwaXNp", "session=1"),
+                                   ("/small", None, None)]
+
+
+@pytest.mark.unit
+def test_resume(server, tmp_path):
+    path = str(tmp_path / "data.part")
+    client = httpclient.HTTPClient()
+
+    Handler.fail_after = 1000000
+    with pytest.raises(httpclient.Error):
+        client.download(server + "/data", path)
+    with open(path, "rb") as f:
+        assert f.read() == DATA[:1000000]
+
+    Handler.fail_after = None
+    client.download(server + "/data", path)
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert Handler.requests[-1] == ("/data", "bytes=1000000-")
+    assert not (tmp_path / ("data.part" + httpclient.VALIDATOR_SUFFIX)).exists()
+
+    # Complete files are not fetched again
+    client.download(server + "/data", path)
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+
+
+@pytest.mark.unit
+def test_resume_changed_file(server, tmp_path):
+    path = tmp_path / "data.part"
+    path.write_bytes(b"x" * 5000)
+    (tmp_path / ("data.part" + httpclient.VALIDATOR_SUFFIX)).write_text('"v0"')
+
+    httpclient.HTTPClient().download(server + "/data", str(path))
+    assert path.read_bytes() == DATA
+
+
+@pytest.mark.unit
+def test_segments(server, tmp_path):
+    path = str(tmp_path / "data.part")
+    sizes = []
+    client = httpclient.HTTPClient(segments=4, segment_size=512 * 1024)
+    client.download(server + "/data", path,
+                    progress=lambda size, total: sizes.append((size, total)))
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert len(Handler.requests) == 4
+    assert sizes[-1] == (len(DATA), len(DATA))
+
+    # Small files are fetched with the first request
+    path = str(tmp_path / "small.part")
+    client.download(server + "/small", path)
+    with open(path, "rb") as f:
+        assert f.read() == b"small file"
+
+
+@pytest.mark.unit
+def test_range_refused_without_partial_file(server, tmp_path):
+    path = tmp_path / "data.part"
+    Handler.refuse_ranges = True
+
+    httpclient.HTTPClient(segments=4).download(server + "/data", str(path))
+    assert path.read_bytes() == DATA
+    assert Handler.requests[-1] == ("/data", None)
+
+
+@pytest.mark.unit
+def test_fetcher(server, tmp_path):
+    pisi.fetcher.fetch_url(server + "/small", str(tmp_path))
+    assert (tmp_path / "small").read_bytes() == b"small file"
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import lzma
+import types
+import hashlib
+import multiprocessing
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import pisi.file
+import pisi.index
+
+
+def make_package(repo, fn, data=b"pisi"):
+    path = os.path.join(repo, fn)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def cached_index(repo, full=False):
+    return pisi.index.IndexCache(str(repo), full)
+
+
+@pytest.mark.unit
+def test_index_cache_reuses_unchanged_packages(tmp_path):
+    path = make_package(str(tmp_path), "tasma-1.0-1-p2-x86_64.pisi")
+
+    cache = cached_index(tmp_path)
+    assert cache.lookup(path, {}) is None
+    cache.set(path, {}, "tasma", b"<Package>tasma</Package>")
+    cache.save()
+
+    cache = cached_index(tmp_path)
+    record = cache.lookup(path, {})
+    assert record[1] == "tasma"
+    assert record[3] == "tasma-1.0-1-p2-x86_64.pisi"
+    assert cache.reuse(path, record) == b"<Package>tasma</Package>"
+    assert cache.hits == 1
+    cache.save()
+
+    # Only the records and the data file of the last run are kept
+    data_files = [fn for fn in os.listdir(str(tmp_path)) if fn.endswith(".data")]
+    assert data_files == [cache.new_data_name]
+    cache = cached_index(tmp_path)
+    assert cache.reuse(path, cache.lookup(path, {})) == b"<Package>tasma</Package>"
+
+    assert cached_index(tmp_path, full=True).lookup(path, {}) is None
+
+
+@pytest.mark.unit
+def test_index_cache_detects_changes(tmp_path):
+    path = make_package(str(tmp_path), "tasma-1.0-1-p2-x86_64.pisi")
+    delta = make_package(str(tmp_path), "tasma-1-2-p2-x86_64.delta.pisi")
+    deltas = {"tasma": [delta]}
+
+    cache = cached_index(tmp_path)
+    cache.set(path, deltas, "tasma", b"<Package/>")
+    cache.save()
+
+    assert cached_index(tmp_path).lookup(path, {}) is None
+
+    make_package(str(tmp_path), os.path.basename(path), b"changed")
+    assert cached_index(tmp_path).lookup(path, deltas) is None
+
+
+@pytest.mark.unit
+def test_index_cache_drops_removed_packages(tmp_path):
+    path = make_package(str(tmp_path), "tasma-1.0-1-p2-x86_64.pisi")
+
+    cache = cached_index(tmp_path)
+    cache.set(path, {}, "tasma", b"<Package/>")
+    cache.save()
+
+    # Nothing is looked up in this run, so the entry is not carried over
+    cached_index(tmp_path).save()
+    assert cached_index(tmp_path).records == {}
+
+
+@pytest.mark.unit
+def test_index_cache_discard_keeps_previous_run(tmp_path):
+    path = make_package(str(tmp_path), "tasma-1.0-1-p2-x86_64.pisi")
+
+    cache = cached_index(tmp_path)
+    cache.set(path, {}, "tasma", b"<Package/>")
+    cache.save()
+
+    cache = cached_index(tmp_path)
+    cache.set(path, {}, "tasma", b"<Package>new</Package>")
+    cache.discard()
+
+    cache = cached_index(tmp_path)
+    assert cache.reuse(path, cache.lookup(path, {})) == b"<Package/>"
+
+
+def fake_add_package(params):
+    path, deltas, repo_uri = params
+    return Element(os.path.basename(path).split("-")[0])
+
+
+@pytest.mark.unit
+def test_add_packages_keeps_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(pisi.index, "add_package", fake_add_package)
+    names = ["pkg%02d" % i for i in range(40)]
+    packages = [(make_package(str(tmp_path), "%s-1.0-1-p2-x86_64.pisi" % name),
+                 {}, str(tmp_path)) for name in names]
+
+    cache = cached_index(tmp_path)
+    pool = multiprocessing.Pool(2)
+    try:
+        added = list(pisi.index.add_packages(pool, packages, cache))
+        cache.save()
+
+        # The second run takes every entry from the cache
+        cache = cached_index(tmp_path)
+        reused = list(pisi.index.add_packages(pool, packages, cache))
+    finally:
+        pool.close()
+        pool.join()
+
+    assert [ET.fromstring(xml).get("name") for xml in added] == names
+    assert reused == added
+    assert cache.hits == len(names)
+
+
+@pytest.mark.unit
+def test_add_packages_looks_up_cache_lazily(tmp_path):
+    packages = [(make_package(str(tmp_path), "pkg%02d-1.0-1-p2-x86_64.pisi" % i),
+                 {}, str(tmp_path)) for i in range(10)]
+    cache = cached_index(tmp_path)
+    for path, deltas, repo_uri in packages:
+        cache.set(path, deltas, os.path.basename(path), b"<Package/>")
+    cache.save()
+
+    cache = cached_index(tmp_path)
+    lookups = []
+    lookup = cache.lookup
+    cache.lookup = lambda path, deltas: lookups.append(path) or lookup(path, deltas)
+
+    added = pisi.index.add_packages(None, packages, cache)
+    assert next(added) == b"<Package/>"
+    assert lookups == [packages[0][0]]
+    assert len(list(added)) == 9
+
+
+class Element(object):
+    packageSize = 4
+    deltaPackages = []
+
+    def __init__(self, name):
+        self.name = name
+
+    def encode(self, node, errs):
+        node.set("name", self.name)
+
+
+@pytest.mark.unit
+def test_index_writer_streams_compressed_index(tmp_path):
+    path = str(tmp_path / "pisi-index.xml")
+    writer = pisi.index.IndexWriter(path, sha1sum=True,
+                                    compress=pisi.file.File.COMPRESSION_TYPE_XZ)
+    for i in range(3):
+        writer.write_element("Package", Element("pkg%d" % i))
+    writer.close()
+
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path + ".xz", "rb") as f:
+        compressed = f.read()
+
+    assert lzma.decompress(compressed) == data
+    root = ET.fromstring(data)
+    assert root.tag == "PISI"
+    assert [node.get("name") for node in root] == ["pkg0", "pkg1", "pkg2"]
+
+    with open(path + ".xz.sha1sum") as f:
+        assert f.read() == hashlib.sha1(compressed).hexdigest()
+    with open(path + ".sha1sum") as f:
+        assert f.read() == hashlib.sha1(data).hexdigest()
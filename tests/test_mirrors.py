@@ -35,3 +35,34 @@ def testGetMirrors():
         "http://cpan.ulak.net.tr/",
     ] == mirrors.get_mirrors("cpan")
     assert ["http://ftp.gnu.org/gnu/"] == mirrors.get_mirrors("gnu")
+
+
+@pytest.mark.unit
+def test_mirror_stats(tmp_path):
+    from pisi import mirrors
+
+    path = str(tmp_path / "mirror-stats.cache")
+    stats = mirrors.MirrorStats(path)
+    stats.record("http://slow/", latency=0.8, throughput=100 * 1024)
+    stats.record("http://fast/", latency=0.02, throughput=10 * 1024 * 1024)
+    stats.record("http://broken/", latency=0.02, throughput=10 * 1024 * 1024)
+    stats.record("http://broken/", failed=True)
+    stats.save()
+
+    stats = mirrors.MirrorStats(path)
+    # Unmeasured mirrors get a chance before the very slow ones
+    assert stats.rank(["http://new/", "http://slow/", "http://broken/", "http://fast/"]) == \
+        ["http://fast/", "http://broken/", "http://new/", "http://slow/"]
+    assert stats.is_stale("http://new/") and not stats.is_stale("http://fast/")
+
+
+@pytest.mark.unit
+def test_mirror_stat_decay():
+    from pisi import mirrors
+
+    stat = mirrors.MirrorStat()
+    stat.record(0, latency=2.0, failed=True)
+    # Old measurements count much less than a new one
+    stat.record(4 * mirrors.HALF_LIFE, latency=0.1)
+    assert stat.latency < 0.2
+    assert stat.failures < 0.1
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import pisi.context as ctx
+import pisi.atomicoperations as atomicoperations
+
+
+class FilesDB(object):
+    def __init__(self, owners):
+        self.owners = owners
+        self.queries = 0
+
+    def get_packages(self, paths):
+        self.queries += 1
+        return dict((p, self.owners[p]) for p in paths if p in self.owners)
+
+
+def fileinfo(path, type="data", permanent=None):
+    return SimpleNamespace(path=path, type=type, permanent=permanent, hash=None)
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setattr(ctx, "config", SimpleNamespace(dest_dir=lambda: str(tmp_path),
+                                                       get_option=lambda opt: None))
+    for i in range(600):
+        path = tmp_path / "usr/share/foo" / str(i % 7) / ("file%d" % i)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x")
+    (tmp_path / "usr/share/other").mkdir()
+    (tmp_path / "usr/share/other/file").write_text("x")
+    (tmp_path / "usr/share/foo/empty").mkdir()
+    os.symlink("0", str(tmp_path / "usr/share/foo/link"))
+    return tmp_path
+
+
+@pytest.mark.unit
+def test_remove_files(root, tmp_path, monkeypatch):
+    files = [fileinfo("usr/share/foo/%d/file%d" % (i % 7, i)) for i in range(600)]
+    files += [fileinfo("usr/share/foo/link"), fileinfo("usr/share/foo/empty"),
+              fileinfo("usr/share/foo/missing"),
+              fileinfo("usr/share/other/file", permanent=True)]
+    owners = dict((f.path, "foo") for f in files)
+    owners["usr/share/foo/0/file0"] = "bar"
+    filesdb = FilesDB(owners)
+    monkeypatch.setattr(ctx, "filesdb", filesdb)
+    warnings = []
+    monkeypatch.setattr(ctx.ui, "warning", warnings.append)
+
+    old_paths = tmp_path / "old-paths"
+    atomicoperations.Remove.remove_files(files, "foo", store_old_paths=str(old_paths))
+
+    assert filesdb.queries == 1
+    # The file owned by bar and the permanent file are kept
+    assert sorted(p.name for p in (root / "usr/share/foo").iterdir()) == ["0"]
+    assert os.listdir(str(root / "usr/share/foo/0")) == ["file0"]
+    assert (root / "usr/share/other/file").exists()
+    assert len(old_paths.read_text().splitlines()) == 600
+    assert len(warnings) == 2
+
+
+@pytest.mark.unit
+def test_remove_empty_dirs(root):
+    atomicoperations.unlink_files([str(root / "usr/share/other/file")])
+    atomicoperations.remove_empty_dirs([str(root / "usr/share/other/file")], [], str(root))
+    assert not (root / "usr/share/other").exists()
+    assert (root / "usr/share").exists()
+    assert root.exists()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import pisi.db
+import pisi.db.lazydb
+import pisi.replace
+
+MAIN = """<PISI>
+  <Distribution><Obsoletes><Package>hashalot</Package><Package>gaim-otr</Package></Obsoletes></Distribution>
+  <Package><Name>pidgin</Name><Replaces><Package versionTo="2.0">gaim</Package></Replaces></Package>
+  <Package><Name>gimp-i18n-tr</Name><Replaces><Package>gimp-i18n</Package></Replaces></Package>
+  <Package><Name>gimp-i18n-de</Name><Replaces><Package>gimp-i18n</Package></Replaces></Package>
+  <Package><Name>nano</Name><Replaces><Package releaseFrom="5">pico</Package></Replaces></Package>
+</PISI>"""
+
+CONTRIB = """<PISI>
+  <Package><Name>pidgin</Name><Replaces><Package>pico</Package></Replaces></Package>
+  <Package><Name>kopete</Name><Replaces><Package>gaim</Package></Replaces></Package>
+</PISI>"""
+
+
+class FakeRepoDB(object):
+    docs = {"main": ET.fromstring(MAIN), "contrib": ET.fromstring(CONTRIB)}
+
+    def list_repos(self, only_active=True):
+        return ["main", "contrib"]
+
+    def get_repo_doc(self, repo):
+        return self.docs[repo]
+
+
+class FakeInstallDB(object):
+    installed = {"gaim": ("1.5", "3"), "gimp-i18n": ("2.6", "1"),
+                 "pico": ("4.0", "2"), "hashalot": ("2.3", "20")}
+
+    def has_package(self, name):
+        return name in self.installed
+
+    def get_version_release(self, name):
+        return self.installed[name]
+
+
+@pytest.fixture
+def packagedb(monkeypatch):
+    monkeypatch.setattr(pisi.db.lazydb.Singleton, "_the_instances", {})
+    monkeypatch.setattr(pisi.db.repodb, "RepoDB", FakeRepoDB)
+    monkeypatch.setattr(pisi.db.installdb, "InstallDB", FakeInstallDB)
+    db = pisi.db.packagedb.PackageDB()
+    db.init()
+    db.initialized = True
+    return db
+
+
+@pytest.mark.unit
+def testParseReplace():
+    node = ET.fromstring('<Package versionTo="2.0" releaseFrom="3">gaim</Package>')
+    replace = pisi.replace.parse_replace(node)
+    assert replace.package == "gaim"
+    assert replace.satisfies_relation("1.5", "4")
+    assert not replace.satisfies_relation("2.5", "4")
+    assert not replace.satisfies_relation("1.5", "2")
+
+
+@pytest.mark.unit
+def testGetReplaces(packagedb):
+    replaces = packagedb.get_replaces()
+    assert replaces["gaim"] == ["pidgin", "kopete"]
+    assert sorted(replaces["gimp-i18n"]) == ["gimp-i18n-de", "gimp-i18n-tr"]
+    # pidgin of main does not replace pico, nano only replaces release >= 5
+    assert "pico" not in replaces
+
+    assert packagedb.get_replaces("contrib") == {"pico": ["pidgin"], "gaim": ["kopete"]}
+
+
+@pytest.mark.unit
+def testReplacingRepoNotLookedUp(packagedb, monkeypatch):
+    def which_repo(name):
+        raise AssertionError("which_repo(%s) called" % name)
+
+    monkeypatch.setattr(packagedb, "which_repo", which_repo)
+    assert packagedb.get_replaces()["gaim"] == ["pidgin", "kopete"]
+
+
+@pytest.mark.unit
+def testGetObsoletes(packagedb):
+    obsoletes = packagedb.get_obsoletes()
+    assert isinstance(obsoletes, list)
+    assert sorted(obsoletes) == ["gaim-otr", "hashalot"]
+    assert packagedb.get_obsoletes("contrib") == []
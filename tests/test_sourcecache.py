@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from pisi import sourcecache
+
+
+def make_builder(specdir):
+    archive = SimpleNamespace(sha1sum="a" * 40, type="targz", target=None,
+                              name="foo-1.0.tar.gz")
+    patch = SimpleNamespace(filename="fix.patch", level=1, reverse=None,
+                            compressionType=None)
+    source = SimpleNamespace(archive=[archive], additionalFiles=[], patches=[patch])
+    return SimpleNamespace(specdir=str(specdir), spec=SimpleNamespace(source=source),
+                           actionGlobals={"WorkDir": "foo-1.0"})
+
+
+@pytest.mark.unit
+def test_tree_key(tmp_path):
+    (tmp_path / "files").mkdir()
+    (tmp_path / "files/fix.patch").write_text("--- a\n+++ b\n")
+    builder = make_builder(tmp_path)
+
+    key = sourcecache.tree_key(builder)
+    (tmp_path / "files/fix.patch").write_text("--- a\n+++ c\n")
+    assert sourcecache.tree_key(builder) != key
+
+    patched = sourcecache.tree_key(builder)
+    builder.actionGlobals["WorkDir"] = "foo"
+    assert sourcecache.tree_key(builder) != patched
+
+
+@pytest.mark.unit
+def test_store_and_restore(tmp_path):
+    work = tmp_path / "work"
+    (work / "foo-1.0/src").mkdir(parents=True)
+    configure = work / "foo-1.0/configure"
+    configure.write_text("#!/bin/sh\n")
+    configure.chmod(0o755)
+    os.utime(str(configure), (1000000000, 1000000000))
+    os.symlink("configure", str(work / "foo-1.0/configure.sh"))
+    (work / "pisiBuildState").write_text("unpack")
+
+    cache = sourcecache.SourceCache(str(tmp_path / "cache"))
+    cache.store("foo", "key1", str(work), exclude=["pisiBuildState"])
+    cache.store("foo", "key2", str(work), exclude=["pisiBuildState"])
+    # Only the newest tree of a source is kept
+    assert os.listdir(str(tmp_path / "cache/foo")) == ["key2"]
+
+    (work / "foo-1.0/build.o").write_text("object")
+    assert not cache.restore("foo", "key1", str(work))
+    assert cache.restore("foo", "key2", str(work))
+
+    assert not (work / "foo-1.0/build.o").exists()
+    assert not (work / "pisiBuildState").exists()
+    assert os.readlink(str(work / "foo-1.0/configure.sh")) == "configure"
+    assert configure.stat().st_mode & 0o777 == 0o755
+    assert configure.stat().st_mtime == 1000000000
+
+    # Changes in the work directory do not reach the cache
+    configure.write_text("changed")
+    assert (tmp_path / "cache/foo/key2/foo-1.0/configure").read_text() == "#!/bin/sh\n"
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import io
+import os
+import hashlib
+import tarfile
+import zipfile
+
+import pytest
+
+import pisi.archive
+from pisi import streampackage
+
+
+def make_install_archive():
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:xz") as tar:
+        content = b"#!/bin/sh\n" * 1000
+        tarinfo = tarfile.TarInfo("usr/bin/tool")
+        tarinfo.size = len(content)
+        tarinfo.mode = 0o755
+        tar.addfile(tarinfo, io.BytesIO(content))
+    return data.getvalue()
+
+
+def make_package():
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as package:
+        package.writestr("metadata.xml", b"<PISI/>")
+        package.writestr("files.xml", b"<Files/>" * 100,
+                         compress_type=zipfile.ZIP_DEFLATED)
+        package.writestr("install.tar.xz", make_install_archive())
+    return data.getvalue()
+
+
+@pytest.mark.unit
+def test_read_members():
+    package = make_package()
+    stream = streampackage.HashingReader(io.BytesIO(package))
+
+    members = {}
+    while True:
+        header = streampackage.read_member_header(stream)
+        if header is None:
+            break
+        name, method, size = header
+        members[name] = streampackage.MemberReader(stream, size, method).read()
+    stream.drain()
+
+    assert members["metadata.xml"] == b"<PISI/>"
+    assert members["files.xml"] == b"<Files/>" * 100
+    assert members["install.tar.xz"] == make_install_archive()
+    assert stream.hexdigest() == hashlib.sha1(package).hexdigest()
+
+
+@pytest.mark.unit
+def test_extract_from_stream(tmp_path):
+    stream = streampackage.HashingReader(io.BytesIO(make_package()))
+    while True:
+        name, method, size = streampackage.read_member_header(stream)
+        member = streampackage.MemberReader(stream, size, method)
+        if name == "install.tar.xz":
+            break
+        member.read()
+
+    tar = pisi.archive.ArchiveTar(fileobj=member, arch_type="tarxz",
+                                  no_same_permissions=False,
+                                  no_same_owner=False)
+    tar.unpack_dir(str(tmp_path))
+
+    tool = tmp_path / "usr/bin/tool"
+    assert tool.read_bytes() == b"#!/bin/sh\n" * 1000
+    assert tool.stat().st_mode & 0o777 == 0o755
+
+
+@pytest.mark.unit
+def test_not_streamable():
+    package = bytearray(make_package())
+    # Set the data descriptor flag, sizes are then after the member data
+    package[6] |= 0x8
+    stream = streampackage.HashingReader(io.BytesIO(bytes(package)))
+
+    with pytest.raises(streampackage.NotStreamable):
+        streampackage.read_member_header(stream)
+
+
+@pytest.mark.unit
+def test_commit_staged(tmp_path):
+    dest = tmp_path / "root"
+    (dest / "usr/lib64").mkdir(parents=True)
+    (dest / "usr/lib64/libold.so").write_bytes(b"old")
+    (dest / "usr/lib").mkdir()
+    (dest / "usr/bin").mkdir()
+    tool = dest / "usr/bin/tool"
+    tool.write_bytes(b"old")
+    running = open(str(tool), "rb")
+
+    stage = tmp_path / "stage"
+    (stage / "usr/bin").mkdir(parents=True)
+    (stage / "usr/bin/tool").write_bytes(b"new")
+    os.symlink("lib", str(stage / "usr/lib64"))
+
+    streampackage.commit_staged(str(stage), str(dest))
+
+    assert tool.read_bytes() == b"new"
+    assert running.read() == b"old"
+    running.close()
+    assert os.readlink(str(dest / "usr/lib64")) == "lib"
+    assert (dest / "usr/lib/libold.so").read_bytes() == b"old"
+
+
+@pytest.mark.unit
+def test_stream_file_url(tmp_path, monkeypatch):
+    package = bytearray(make_package())
+    package[6] |= 0x8
+    path = tmp_path / "tool-1.0-1-p2-x86_64.pisi"
+    path.write_bytes(bytes(package))
+    monkeypatch.setattr(streampackage.ctx.config.values.general, "package_cache", False)
+
+    # urllib responses of file and ftp urls have no length attribute
+    with pytest.raises(streampackage.NotStreamable):
+        streampackage.StreamPackage("file://" + str(path), None, str(tmp_path))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from pisi.db import tagindex
+
+
+def package(name, isa=(), build_host=None, part_of=None):
+    node = ET.Element("Package")
+    ET.SubElement(node, "Name").text = name
+    for value in isa:
+        ET.SubElement(node, "IsA").text = value
+    if build_host:
+        ET.SubElement(node, "BuildHost").text = build_host
+    if part_of:
+        ET.SubElement(node, "PartOf").text = part_of
+    return node
+
+
+@pytest.fixture
+def index():
+    index = tagindex.TagIndex()
+    index.add_package("dejavu", package("dejavu", ["data:font"], "farm", "x11.font"))
+    index.add_package("liberation", package("liberation", ["data:font", "data"], "farm", "x11.font"))
+    index.add_package("nvidia", package("nvidia", ["driver", "kernel"], "localhost", "kernel.drivers"))
+    index.add_package("bash", package("bash", ["app:console"]))
+    return index
+
+
+@pytest.mark.unit
+def testGet(index):
+    assert index.get("IsA", "data:font") == {"dejavu", "liberation"}
+    assert index.get("IsA", "kernel") == {"nvidia"}
+    assert index.get("IsA", "library") == set()
+    assert index.get("BuildHost", "farm") == {"dejavu", "liberation"}
+    assert index.get("BuildHost", None) == {"bash"}
+    assert index.get("PartOf", "x11.font") == {"dejavu", "liberation"}
+
+
+@pytest.mark.unit
+def testUpdateAndRemove(index):
+    # Reinstalled with new metadata
+    index.add_package("nvidia", package("nvidia", ["driver"], "farm", "kernel.drivers"))
+    assert index.get("IsA", "kernel") == set()
+    assert "kernel" not in index.index["IsA"]
+    assert index.get("BuildHost", "localhost") == set()
+    assert index.get("BuildHost", "farm") == {"dejavu", "liberation", "nvidia"}
+
+    index.remove("dejavu")
+    index.remove("missing")
+    assert index.get("IsA", "data:font") == {"liberation"}
+    assert index.get("PartOf", "x11.font") == {"liberation"}
+    assert "dejavu" not in index.values
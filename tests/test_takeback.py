@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import threading
+
+import pytest
+
+import pisi
+import pisi.db
+import pisi.fetcher
+import pisi.context as ctx
+from pisi.operations import history
+
+
+class FakePackageDB(object):
+    packages = {"main": {"bash", "zlib"}, "contrib": {"zlib", "vim"}}
+    obsoletes = {"main": ["hashalot"], "contrib": []}
+
+    def has_package(self, name, repo=None):
+        return name in self.packages[repo]
+
+    def get_obsoletes(self, repo=None):
+        return self.obsoletes[repo]
+
+
+class FakeRepoDB(object):
+
+    def list_repos(self):
+        return ["main", "contrib"]
+
+    def get_binary_repos(self):
+        return ["main", "contrib"]
+
+    def get_repo_url(self, repo):
+        return "http://example.com/%s/pisi-index.xml.xz" % repo
+
+
+@pytest.fixture
+def repos(monkeypatch, tmp_path):
+    monkeypatch.setattr(pisi.db.packagedb, "PackageDB", FakePackageDB)
+    monkeypatch.setattr(pisi.db.repodb, "RepoDB", FakeRepoDB)
+    monkeypatch.setattr(ctx.config, "cached_packages_dir", lambda: str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.unit
+def testPackageRepos(repos):
+    assert history.package_repos(["bash", "zlib", "vim", "hashalot", "nano"]) == \
+        {"bash": "main", "zlib": "main", "vim": "contrib", "hashalot": "main"}
+
+
+@pytest.mark.unit
+def testFetchPackages(repos, monkeypatch):
+    packages = ["bash-5.0-1-p1-x86_64.pisi", "vim-8.2-3-p1-x86_64.pisi",
+                "zlib-1.2-1-p1-x86_64.pisi", "nano-4.0-1-p1-x86_64.pisi"]
+    (repos / packages[2]).write_text("cached")
+
+    fetched = []
+    lock = threading.Lock()
+
+    def fetch_url(uri, dest, progress=None, destfile=None):
+        if "vim" in str(uri):
+            raise pisi.fetcher.FetchError("404")
+        with lock:
+            fetched.append(str(uri))
+        (repos / uri.filename()).write_text("fetched")
+    monkeypatch.setattr(pisi.fetcher, "fetch_url", fetch_url)
+
+    paths, errors = history.fetch_packages(packages)
+
+    assert fetched == ["http://example.com/main/b/bash/bash-5.0-1-p1-x86_64.pisi"]
+    assert sorted(paths) == [os.path.join(str(repos), p) for p in sorted(packages[:1] + packages[2:3])]
+    assert sorted(errors) == [packages[3], packages[1]]
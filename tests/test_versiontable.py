@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from pisi.db import versiontable
+
+
+def package(name, updates, distro_release="2.0", tar_hash="abc"):
+    history = "".join('<Update release="%s"%s><Version>%s</Version></Update>'
+                      % (release, ' type="%s"' % utype if utype else "", version)
+                      for release, version, utype in updates)
+    return ET.fromstring("<Package><Name>%s</Name><History>%s</History>"
+                         "<Distribution>Pardus</Distribution>"
+                         "<DistributionRelease>%s</DistributionRelease>"
+                         "<InstallTarHash>%s</InstallTarHash></Package>"
+                         % (name, history, distro_release, tar_hash))
+
+
+def table(*packages):
+    t = versiontable.VersionTable()
+    for node in packages:
+        t.add_package(node.findtext("Name"), node)
+    return t
+
+
+@pytest.fixture
+def tables():
+    installed = table(package("bash", [(3, "4.0", None)]),
+                      package("zlib", [(5, "1.2", None)]),
+                      package("gdb", [(2, "6.6", None)], tar_hash="old"),
+                      package("vim", [(7, "8.0", None)], distro_release="1.0"),
+                      package("local", [(1, "1.0", None)]))
+    available = table(package("bash", [(5, "4.1", None), (4, "4.0", "security"), (3, "4.0", None)]),
+                      package("zlib", [(6, "1.3", None), (5, "1.2", None)]),
+                      package("gdb", [(2, "6.6", None)], tar_hash="new"),
+                      package("vim", [(7, "8.0", None)], distro_release="2.0"))
+    return installed, available
+
+
+@pytest.mark.unit
+def testRow(tables):
+    installed, available = tables
+    assert available.row("bash") == ("4.1", 5, "Pardus", "2.0", available.row("bash")[4], "abc", 4)
+    assert len(installed) == 5 and "local" in installed and "nano" not in installed
+
+
+@pytest.mark.unit
+def testFindUpgrades(tables):
+    installed, available = tables
+    upgrades, different, latest = versiontable.find_upgrades(installed, available)
+    assert upgrades == ["bash", "zlib", "vim"]
+    assert different == []
+    assert latest == ["gdb"]
+
+    upgrades, different, latest = versiontable.find_upgrades(installed, available,
+                                                             compare_sha1sum=True)
+    assert upgrades == ["bash", "zlib", "gdb", "vim"]
+    assert different == ["gdb"]
+
+    upgrades, different, latest = versiontable.find_upgrades(installed, available,
+                                                             ["zlib", "bash"], security_only=True)
+    assert upgrades == ["bash"]
+
+
+@pytest.mark.unit
+def testRemoveAndUpdate(tables):
+    installed, available = tables
+    installed.remove("bash")
+    installed.remove("nano")
+    assert "bash" not in installed
+    assert installed.row("local")[0] == "1.0"
+    assert sorted(installed.names) == ["gdb", "local", "vim", "zlib"]
+
+    merged = table(package("zlib", [(9, "2.0", None)]))
+    merged.update(available)
+    assert merged.row("zlib")[1] == 9
+    assert merged.row("bash")[1] == 5
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import io
+import os
+import lzma
+import random
+import tarfile
+import zipfile
+
+import pytest
+
+import pisi.archive
+from pisi import xzblock
+
+
+@pytest.fixture
+def data():
+    rnd = random.Random(4113)
+    words = [bytes(rnd.getrandbits(8) for i in range(8)) for j in range(256)]
+    return b"".join(rnd.choice(words) for i in range(400000))
+
+
+def write_blocks(path, data, block_size=256 * 1024):
+    with open(path, "wb") as f:
+        writer = xzblock.BlockWriter(f, preset=1, block_size=block_size)
+        for start in range(0, len(data), 100000):
+            writer.write(data[start:start + 100000])
+        writer.close()
+
+
+@pytest.mark.unit
+def test_plain_xz_compatible(tmp_path, data):
+    path = str(tmp_path / "data.xz")
+    write_blocks(path, data)
+
+    with open(path, "rb") as f:
+        compressed = f.read()
+    decompressor = lzma.LZMADecompressor()
+    assert decompressor.decompress(compressed) == data
+    assert decompressor.eof and not decompressor.unused_data
+
+
+@pytest.mark.unit
+def test_parallel_read(tmp_path, data):
+    path = str(tmp_path / "data.xz")
+    write_blocks(path, data)
+
+    reader = xzblock.BlockReader(path, jobs=4)
+    assert len(reader.blocks) == len(data) // (256 * 1024) + 1
+    assert reader.read(1000) == data[:1000]
+    assert reader.read() == data[1000:]
+
+    reader.seek(2000000)
+    assert reader.read(10) == data[2000000:2000010]
+    reader.seek(10)
+    assert reader.read(600000) == data[10:600010]
+    reader.close()
+
+
+@pytest.mark.unit
+def test_not_multi_block(tmp_path, data):
+    path = str(tmp_path / "data.xz")
+    with open(path, "wb") as f:
+        f.write(lzma.compress(data[:1000]) + lzma.compress(data[:1000]))
+
+    with pytest.raises(xzblock.Error):
+        xzblock.BlockReader(path)
+
+
+@pytest.mark.unit
+def test_block_reader_needs_multiple_blocks(tmp_path, data):
+    path = str(tmp_path / "data.xz")
+    write_blocks(path, data)
+    reader = xzblock.block_reader(path)
+    assert len(reader.blocks) > 1
+    reader.close()
+
+    content = tmp_path / "content"
+    content.write_bytes(data)
+    with tarfile.open(path, "w:xz") as tar:
+        tar.add(str(content), arcname="content")
+    assert xzblock.block_reader(path) is None
+
+    tar = pisi.archive.ArchiveTar(path, "tarxz")
+    tar.open_tar()
+    assert not isinstance(tar.tar.fileobj, xzblock.BlockReader)
+    assert tar.tar.extractfile("content").read() == data
+    tar.close()
+
+
+@pytest.mark.unit
+def test_install_archive_in_zip(tmp_path, data):
+    content = tmp_path / "content"
+    content.write_bytes(data)
+
+    tar_path = str(tmp_path / "install.tar.xz")
+    tar = pisi.archive.TarFile.xzblockopen(tar_path, "w", compresslevel=1)
+    tar.add(str(content), arcname="usr/share/data")
+    tar.close()
+
+    package_path = str(tmp_path / "package.pisi")
+    with zipfile.ZipFile(package_path, "w") as package:
+        package.writestr("metadata.xml", b"<PISI/>")
+        package.write(tar_path, "install.tar.xz")
+
+    offset, size = pisi.archive.ArchiveZip(package_path).stored_member("install.tar.xz")
+    reader = xzblock.BlockReader(package_path, offset, size)
+    archive = pisi.archive.ArchiveTar(fileobj=reader, arch_type="tarxz",
+                                      no_same_permissions=False,
+                                      no_same_owner=False)
+    target = tmp_path / "target"
+    target.mkdir()
+    archive.unpack_dir(str(target))
+
+    assert (target / "usr/share/data").read_bytes() == data
+    assert reader.fd is None
+
+
+@pytest.mark.unit
+def test_threads_deterministic(tmp_path, data):
+    outputs = []
+    for jobs in (1, 4):
+        output = io.BytesIO()
+        output.close = lambda: None
+        writer = xzblock.BlockWriter(output, preset=1, block_size=256 * 1024,
+                                     jobs=jobs)
+        writer.write(data)
+        writer.close()
+        outputs.append(output.getvalue())
+
+    assert outputs[0] == outputs[1]
+    assert lzma.decompress(outputs[0]) == data
+
+
+@pytest.mark.unit
+def test_parse_preset():
+    assert xzblock.parse_preset(6) == 6
+    assert xzblock.parse_preset("9e") == 9 | lzma.PRESET_EXTREME
+    with pytest.raises(xzblock.Error):
+        xzblock.parse_preset("10")
+
+
+@pytest.mark.unit
+def test_block_size_follows_dictionary(data):
+    assert xzblock.preset_block_size(0) == 256 * 1024
+    assert xzblock.preset_block_size(1) == 1024 * 1024
+    assert xzblock.preset_block_size(9 | lzma.PRESET_EXTREME) == 8 * 1024 * 1024
+
+    # preset 1 has a 1 MiB dictionary, the data fits in four 1 MiB blocks
+    output = io.BytesIO()
+    output.close = lambda: None
+    writer = xzblock.BlockWriter(output, preset=1)
+    writer.write(data)
+    writer.close()
+    assert len(writer.records) == 4
+
+
+@pytest.mark.unit
+def test_max_jobs_fits_memory():
+    gib = 1024 * 1024 * 1024
+    assert xzblock.max_jobs(9, memory=gib) == 1
+    assert xzblock.max_jobs(9, memory=8 * gib) == 11
+    assert xzblock.max_jobs(1, memory=gib) == 78
+
+
+@pytest.mark.unit
+def test_mid_sized_archive_has_blocks(tmp_path):
+    # 20 MiB of files, like a mid-sized package, at the preset of the
+    # shipped configuration
+    content = tmp_path / "content"
+    content.write_bytes(random.Random(33).randbytes(65536) * 320)
+
+    path = str(tmp_path / "install.tar.xz")
+    tar = pisi.archive.ArchiveTar(path, "tarxz", compresslevel="9")
+    tar.add_to_archive(str(content), "usr/lib/content")
+    tar.close()
+
+    reader = xzblock.block_reader(path, jobs=4)
+    assert len(reader.blocks) == 3
+    reader.close()
+
+
+@pytest.mark.unit
+def test_archive_tar_default_config(tmp_path, data):
+    content = tmp_path / "content"
+    content.write_bytes(data)
+
+    path = str(tmp_path / "install.tar.xz")
+    tar = pisi.archive.ArchiveTar(path, "tarxz")
+    assert tar.get_threads() >= 1
+    tar.add_to_archive(str(content), "usr/share/data")
+    tar.close()
+
+    with open(path, "rb") as f:
+        assert lzma.decompress(f.read())
+
+    archive = pisi.archive.ArchiveTar(path, "tarxz",
+                                      no_same_permissions=False,
+                                      no_same_owner=False)
+    target = tmp_path / "target"
+    target.mkdir()
+    archive.unpack_dir(str(target))
+    assert (target / "usr/share/data").read_bytes() == data